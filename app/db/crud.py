@@ -1,8 +1,23 @@
 # app/db/crud.py
-from datetime import datetime
+from collections import Counter
+from datetime import datetime, timedelta
 from sqlalchemy import select, func, case, and_, or_
-from app.db.model import Auth, Branch, Transaction
-from app.db.init import database
+from sqlalchemy.dialects import postgresql, sqlite
+from app.db.model import ArchivePartition, Auth, BalanceCheckpoint, Branch, ChangeLog, ReceiptBlob, Role, SyncClient, Token, Transaction, UserRole
+from app.db.init import database, DIALECT, SQLITE
+
+# INSERT construct with ON CONFLICT support for the active dialect
+def dialect_insert(model):
+    if DIALECT == SQLITE:
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+# Branch path and every descendant path (LIKE wildcards in the path are escaped).
+# The pattern is built here rather than with autoescape, which renders a literal '%'
+# into the SQL that the SQLite driver then trips over when formatting parameters.
+def subtree_of(column, path: str):
+    escaped = path.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return (column == path) | column.like(f"{escaped}/%", escape="\\")
 
 # Create a new user in the Auth table
 async def create_user(email, username, password):
@@ -29,6 +44,16 @@ async def upload_branch(uid: str, path: str):
     except Exception as e:
         return {"status": False, "message": f"Failed to upload branch\n{str(e)}"}
 
+# Whether a user holds a role, e.g. "admin"
+async def has_role(uid: int, role_name: str) -> bool:
+    query = select(UserRole.uid).select_from(
+        UserRole.__table__.join(Role.__table__, UserRole.role_id == Role.role_id)
+    ).where(
+        (UserRole.uid == uid) &
+        (Role.role_name == role_name)
+    ).limit(1)
+    return await database.fetch_val(query) is not None
+
 # Retrieve user information from the Auth table
 async def get_auth_postgre(uid: str):
     query = Auth.__table__.select().where(Auth.uid == uid)
@@ -55,6 +80,7 @@ async def add_transaction_postgre(transaction: dict):
         t_date=transaction['t_date'],
         branch=transaction['branch'],
         cashflow=transaction['cashflow'],
+        currency=transaction.get('currency', 'CAD'),
         description=transaction['description'],
         receipt=transaction['receipt'],
         c_date=transaction['c_date'],
@@ -123,12 +149,18 @@ async def get_daily_postgre(uid: str, branch: str, begin_date: str, end_date: st
         for item in results
     ]
 
+# 'YYYY-MM' label expression for a date column on the active dialect
+def monthly_label_of(column):
+    if DIALECT == SQLITE:
+        return func.strftime('%Y-%m', column)
+    return func.to_char(column, 'YYYY-MM')
+
 # Retrieve monthly transactions grouped by month
 async def get_monthly_postgre(uid: str, branch: str, begin_date: str, end_date: str):
     begin_date = datetime.strptime(begin_date, '%Y-%m-%d').date()
     end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
 
-    monthly_label = func.to_char(Transaction.t_date, 'YYYY-MM')
+    monthly_label = monthly_label_of(Transaction.t_date)
     query = (
         select(
             monthly_label.label('monthly'),
@@ -155,6 +187,28 @@ async def get_monthly_postgre(uid: str, branch: str, begin_date: str, end_date:
 
     return monthly_box
 
+# Retrieve (branch, month, currency) sums for every branch of the user in one query
+async def get_branch_monthly_postgre(uid: str, begin_date: str, end_date: str):
+    begin_date = datetime.strptime(begin_date, '%Y-%m-%d').date()
+    end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+
+    monthly_label = monthly_label_of(Transaction.t_date)
+    query = (
+        select(
+            Transaction.branch.label('branch'),
+            monthly_label.label('monthly'),
+            Transaction.currency.label('currency'),
+            func.sum(case((Transaction.cashflow > 0, Transaction.cashflow), else_=0)).label('income'),
+            func.sum(case((Transaction.cashflow < 0, Transaction.cashflow), else_=0)).label('expenditure')
+        )
+        .where(
+            (Transaction.uid == uid) &
+            (Transaction.t_date.between(begin_date, end_date))
+        )
+        .group_by(Transaction.branch, monthly_label, Transaction.currency)
+    )
+    return await database.fetch_all(query)
+
 # Delete all transactions for a user
 async def delete_all_transaction_postgre(uid: str):
     try:
@@ -184,3 +238,118 @@ async def delete_user_postgre(uid: str):
         return await database.fetch_one(query)
     except Exception as e:
         raise Exception(f"Failed to delete user from PostgreSQL: {str(e)}")
+
+# receipt_blob.ref_count of a blob whose deletion is in progress. Such a row takes no new
+# references until the deleter drops it, or until it is older than RECEIPT_DELETE_CLAIM_TTL
+# (the deleter died) and a fresh upload takes it over.
+RECEIPT_DELETING = -1
+RECEIPT_DELETE_CLAIM_TTL = timedelta(minutes=10)
+
+# Take a reference on a blob that is already stored; None when there is no live row
+async def acquire_existing_receipt_ref(uid: int, file_name: str):
+    query = ReceiptBlob.__table__.update().where(
+        (ReceiptBlob.uid == uid) &
+        (ReceiptBlob.file_name == file_name) &
+        (ReceiptBlob.ref_count > 0)
+    ).values(ref_count=ReceiptBlob.ref_count + 1).returning(ReceiptBlob.ref_count)
+    # fetch_val, not execute: execute returns lastrowid on SQLite instead of the RETURNING value
+    return await database.fetch_val(query)
+
+# Take a reference on a blob that was just uploaded; returns the new reference count,
+# or None while an older copy of the blob is being deleted
+async def acquire_receipt_ref(uid: int, file_name: str):
+    now = datetime.utcnow()
+    query = dialect_insert(ReceiptBlob).values(
+        uid=uid,
+        file_name=file_name,
+        ref_count=1,
+        created_at=now
+    )
+    query = query.on_conflict_do_update(
+        index_elements=['uid', 'file_name'],
+        set_={'ref_count': case((ReceiptBlob.ref_count < 0, 1), else_=ReceiptBlob.ref_count + 1)},
+        where=(ReceiptBlob.ref_count >= 0) | (ReceiptBlob.created_at < now - RECEIPT_DELETE_CLAIM_TTL)
+    ).returning(ReceiptBlob.ref_count)
+    return await database.fetch_val(query)
+
+# Mark blobs nobody references as being deleted; returns the names the caller now owns
+# and must delete (then drop_receipt_claims). Names without a row, i.e. receipts stored
+# before content addressing or an upload whose reference was never taken, are claimed
+# with a new row, so an upload of the same bytes waits for the delete instead of racing it.
+async def _claim_unreferenced(uid: int, file_names: list) -> list:
+    now = datetime.utcnow()
+    query = ReceiptBlob.__table__.update().where(
+        (ReceiptBlob.uid == uid) &
+        (ReceiptBlob.file_name.in_(file_names)) &
+        (ReceiptBlob.ref_count == 0)
+    ).values(ref_count=RECEIPT_DELETING, created_at=now).returning(ReceiptBlob.file_name)
+    claimed = [row['file_name'] for row in await database.fetch_all(query)]
+
+    existing = select(ReceiptBlob.file_name).where(
+        (ReceiptBlob.uid == uid) & (ReceiptBlob.file_name.in_(file_names))
+    )
+    rowless = set(file_names) - {row['file_name'] for row in await database.fetch_all(existing)}
+    for name in rowless:
+        query = dialect_insert(ReceiptBlob).values(
+            uid=uid, file_name=name, ref_count=RECEIPT_DELETING, created_at=now
+        ).on_conflict_do_nothing(index_elements=['uid', 'file_name']).returning(ReceiptBlob.file_name)
+        if await database.fetch_val(query) is not None:
+            claimed.append(name)
+    return claimed
+
+async def claim_unreferenced_receipts(uid: int, file_names: list) -> list:
+    async with database.transaction():
+        return await _claim_unreferenced(uid, list(dict.fromkeys(file_names)))
+
+# Drop references on receipt blobs; returns the file names claimed for deletion
+async def release_receipt_refs(uid: int, file_names: list) -> list:
+    counts = Counter(name for name in file_names if name)
+    if not counts:
+        return []
+
+    async with database.transaction():
+        # One UPDATE per distinct decrement, so duplicates in the list are counted
+        by_amount = {}
+        for name, amount in counts.items():
+            by_amount.setdefault(amount, []).append(name)
+        for amount, names in by_amount.items():
+            query = ReceiptBlob.__table__.update().where(
+                (ReceiptBlob.uid == uid) &
+                (ReceiptBlob.file_name.in_(names)) &
+                (ReceiptBlob.ref_count > 0)
+            ).values(ref_count=case((ReceiptBlob.ref_count > amount, ReceiptBlob.ref_count - amount), else_=0))
+            await database.execute(query)
+        # Claimed in the same transaction, so no reference can be taken in between
+        return await _claim_unreferenced(uid, list(counts))
+
+# Blobs claimed for deletion are gone from storage: forget their rows
+async def drop_receipt_claims(uid: int, file_names: list):
+    query = ReceiptBlob.__table__.delete().where(
+        (ReceiptBlob.uid == uid) &
+        (ReceiptBlob.file_name.in_(file_names)) &
+        (ReceiptBlob.ref_count == RECEIPT_DELETING)
+    )
+    await database.execute(query)
+
+# Delete all receipt blob rows for a user
+async def delete_all_receipt_blob_postgre(uid: str):
+    try:
+        query = ReceiptBlob.__table__.delete().where(ReceiptBlob.uid == uid)
+        return await database.execute(query)
+    except Exception as e:
+        raise Exception(f"Failed to delete receipt blobs from PostgreSQL: {str(e)}")
+
+# Delete every DB row owned by a user in one transaction; returns the deleted uid or None
+async def delete_account_postgre(uid: int):
+    async with database.transaction():
+        await database.execute(Token.__table__.delete().where(Token.uid == uid))
+        await database.execute(ChangeLog.__table__.delete().where(ChangeLog.uid == uid))
+        await database.execute(SyncClient.__table__.delete().where(SyncClient.uid == uid))
+        await database.execute(ReceiptBlob.__table__.delete().where(ReceiptBlob.uid == uid))
+        await database.execute(BalanceCheckpoint.__table__.delete().where(BalanceCheckpoint.uid == uid))
+        await database.execute(ArchivePartition.__table__.delete().where(ArchivePartition.uid == uid))
+        await database.execute(Transaction.__table__.delete().where(Transaction.uid == uid))
+        await database.execute(Branch.__table__.delete().where(Branch.uid == uid))
+        await database.execute(UserRole.__table__.delete().where(UserRole.uid == uid))
+        query = Auth.__table__.delete().where(Auth.uid == uid).returning(Auth.uid)
+        return await database.fetch_one(query)
@@ -22,8 +22,10 @@ Base = declarative_base()
 
 # Create a Database object for async operations
 if DATABASE_URL.startswith("sqlite"):
+    DIALECT = SQLITE
     database = Database(DATABASE_URL)
 else:
+    DIALECT = POSTGRESQL
     database = Database(DATABASE_URL, ssl=True)
 
 # sync engine only for SQLAlchemy create_all / SessionLocal
@@ -0,0 +1,98 @@
+# app/db/migrate.py
+
+from app.db.init import Base, database, DIALECT, engine, SQLITE
+from app.db.model import BalanceCheckpoint
+
+# create_all only creates missing tables; these idempotent steps bring existing
+# databases (e.g. the checked-in SQLite file) up to the current model on startup.
+# The query/*.sql files remain the manual PostgreSQL equivalents.
+
+
+async def _columns(table: str) -> set:
+    if DIALECT == SQLITE:
+        return {row["name"] for row in await database.fetch_all(f"PRAGMA table_info('{table}')")}
+    rows = await database.fetch_all(
+        "SELECT column_name FROM information_schema.columns WHERE table_name = :table",
+        values={"table": table},
+    )
+    return {row["column_name"] for row in rows}
+
+
+async def _add_column(table: str, column: str, ddl: str):
+    if column not in await _columns(table):
+        await database.execute(f'ALTER TABLE "{table}" ADD COLUMN {column} {ddl}')
+
+
+# Whether a single-column unique index or constraint exists on table(column)
+async def _has_unique_index(table: str, column: str) -> bool:
+    if DIALECT == SQLITE:
+        for index in await database.fetch_all(f"PRAGMA index_list('{table}')"):
+            if not index["unique"]:
+                continue
+            columns = [row["name"] for row in await database.fetch_all(f"PRAGMA index_info('{index['name']}')")]
+            if columns == [column]:
+                return True
+        return False
+
+    rows = await database.fetch_all(
+        "SELECT indexdef FROM pg_indexes WHERE tablename = :table",
+        values={"table": table},
+    )
+    return any(
+        row["indexdef"].startswith("CREATE UNIQUE INDEX") and row["indexdef"].endswith(f"({column})")
+        for row in rows
+    )
+
+
+# One token row per user: keep the newest row, then enforce it (signin upserts on uid)
+async def ensure_token_uid_unique():
+    if await _has_unique_index("token", "uid"):
+        return
+    async with database.transaction():
+        await database.execute(
+            "DELETE FROM token WHERE token_id NOT IN (SELECT MAX(token_id) FROM token GROUP BY uid)"
+        )
+        await database.execute("CREATE UNIQUE INDEX IF NOT EXISTS token_uid_key ON token (uid)")
+
+
+# Per-transaction currency (query/add_transaction_currency.sql); existing amounts were
+# entered in the owner's display currency. Checkpoints became per currency and are rebuilt on read.
+async def ensure_transaction_currency():
+    if "currency" not in await _columns("transaction"):
+        async with database.transaction():
+            await database.execute(
+                'ALTER TABLE "transaction" ADD COLUMN currency VARCHAR(10) NOT NULL DEFAULT \'CAD\''
+            )
+            await database.execute(
+                'UPDATE "transaction" SET currency = '
+                '(SELECT display_currency FROM auth WHERE auth.uid = "transaction".uid)'
+            )
+
+    if "currency" not in await _columns("balance_checkpoint"):
+        await database.execute("DROP TABLE IF EXISTS balance_checkpoint")
+        Base.metadata.create_all(bind=engine, tables=[BalanceCheckpoint.__table__])
+
+
+# Per-user write counter behind ETags (query/add_auth_data_version.sql)
+async def ensure_auth_data_version():
+    await _add_column("auth", "data_version", "BIGINT NOT NULL DEFAULT 0")
+
+
+# Lowest change log cursor still served (query/add_auth_change_floor.sql)
+async def ensure_auth_change_floor():
+    await _add_column("auth", "change_floor", "BIGINT NOT NULL DEFAULT 0")
+
+
+# Archive file name and tid range per archived year (query/add_archive_partition_file.sql)
+async def ensure_archive_partition_file():
+    await _add_column("archive_partition", "file", "VARCHAR(128)")
+    await _add_column("archive_partition", "min_tid", "INTEGER")
+    await _add_column("archive_partition", "max_tid", "INTEGER")
+
+
+async def run_migrations():
+    await ensure_token_uid_unique()
+    await ensure_transaction_currency()
+    await ensure_auth_data_version()
+    await ensure_auth_change_floor()
+    await ensure_archive_partition_file()
@@ -1,7 +1,7 @@
 # app/db/model.py
 
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Date, Text, ForeignKey, TIMESTAMP, Boolean, LargeBinary
+from sqlalchemy import Column, String, Integer, Date, Text, ForeignKey, TIMESTAMP, Boolean, LargeBinary, UniqueConstraint, Float, BigInteger, Index
 from app.db.init import Base
 
 # Transaction model
@@ -11,18 +11,73 @@ class Transaction(Base):
     t_date = Column(Date, nullable=False)  # Transaction date
     branch = Column(String(255), nullable=False)  # Branch information
     cashflow = Column(Integer, nullable=False)  # Cashflow amount
+    currency = Column(String(10), nullable=False, default="CAD")  # Currency code of cashflow, e.g. "CAD"
     description = Column(Text, nullable=True)  # Optional description
     c_date = Column(TIMESTAMP, default=datetime.utcnow)  # Creation timestamp
     uid = Column(Integer, ForeignKey('auth.uid'), nullable=False)  # Foreign key to user ID
     receipt = Column(String(255), nullable=True)  # Receipt image directory path in Firebase Storage
+    __table_args__ = (
+        Index('ix_transaction_uid_branch', 'uid', 'branch'),  # Subtree filters and moves
+        Index('ix_transaction_uid_t_date', 'uid', 't_date'),  # Date-range reads
+    )
     
+# Balance checkpoint model: per-branch opening balance at the start of a month
+class BalanceCheckpoint(Base):
+    __tablename__ = 'balance_checkpoint'
+    cpid = Column(Integer, primary_key=True, autoincrement=True)  # Checkpoint ID
+    uid = Column(Integer, ForeignKey('auth.uid'), nullable=False)  # Foreign key to user ID
+    branch = Column(String(255), nullable=False)  # Exact branch path (not the subtree)
+    currency = Column(String(10), nullable=False)  # Balances are kept per currency, unconverted
+    period = Column(Date, nullable=False)  # First day of the month
+    balance = Column(BigInteger, nullable=False)  # Sum of the branch's cashflow in currency with t_date < period
+    __table_args__ = (UniqueConstraint('uid', 'branch', 'currency', 'period'),)
+
+# Archive partition model: one closed year of a user's transactions moved to a Parquet file
+class ArchivePartition(Base):
+    __tablename__ = 'archive_partition'
+    apid = Column(Integer, primary_key=True, autoincrement=True)  # Archive partition ID
+    uid = Column(Integer, ForeignKey('auth.uid'), nullable=False)  # Foreign key to user ID
+    year = Column(Integer, nullable=False)  # Calendar year held by the file
+    row_count = Column(Integer, nullable=False)  # Transactions in the file
+    file = Column(String(128))  # Current file under the archive root; NULL means "<uid>/<year>.parquet"
+    min_tid = Column(Integer)  # Lowest tid in the file (NULL: not recorded)
+    max_tid = Column(Integer)  # Highest tid in the file
+    sealed_before = Column(Date, nullable=False)  # Archive cutoff; checkpoints exist at this date
+    archived_at = Column(TIMESTAMP, default=datetime.utcnow)
+    __table_args__ = (UniqueConstraint('uid', 'year'),)
+
+# FX rate model: daily rate of a currency against FX_BASE_CURRENCY
+class FxRate(Base):
+    __tablename__ = 'fx_rate'
+    frid = Column(Integer, primary_key=True, autoincrement=True)  # FX rate ID
+    rate_date = Column(Date, nullable=False)  # Day the rate applies to
+    currency = Column(String(10), nullable=False)  # Currency code, e.g. "CAD"
+    rate = Column(Float, nullable=False)  # Units of currency per one unit of the base currency
+    __table_args__ = (UniqueConstraint('currency', 'rate_date'),)
+
+# FxRateVersion model: single row bumped by every FX rate import; part of every ETag
+class FxRateVersion(Base):
+    __tablename__ = 'fx_rate_version'
+    id = Column(Integer, primary_key=True)  # Always 1
+    version = Column(BigInteger, nullable=False)  # Incremented on each import
+
+# Receipt blob model: content-addressed receipt files shared by transactions
+class ReceiptBlob(Base):
+    __tablename__ = 'receipt_blob'
+    rbid = Column(Integer, primary_key=True, autoincrement=True)  # Receipt blob ID
+    uid = Column(Integer, ForeignKey('auth.uid'), nullable=False)  # Foreign key to user ID
+    file_name = Column(String(255), nullable=False)  # Content hash + extension, e.g. "<sha256>.jpg"
+    ref_count = Column(Integer, nullable=False, default=1)  # Number of transactions referencing the blob
+    created_at = Column(TIMESTAMP, default=datetime.utcnow)  # Creation timestamp
+    __table_args__ = (UniqueConstraint('uid', 'file_name'),)
+
 # Email verification model
 class EmailVerification(Base):
     __tablename__ = 'email_verification'
     code = Column(String(255), primary_key=True)  # Verification code
     email = Column(String(255), nullable=False, unique=True)  # Prevent duplicate email
     verified = Column(TIMESTAMP, default=None)  # Verification timestamp (optional)
-    created_at = Column(TIMESTAMP, default=datetime.utcnow)  # Creation timestamp
+    created_at = Column(TIMESTAMP, default=datetime.utcnow, index=True)  # Creation timestamp (indexed for the reaper)
 
 # Auth model for user authentication
 class Auth(Base):
@@ -36,6 +91,8 @@ class Auth(Base):
     update_time = Column(TIMESTAMP, default=datetime.utcnow)  # Last update time
     useai = Column(Boolean, default=False)  # Use AI for transaction categorization
     display_currency = Column(String(10), nullable=False, default="CAD")
+    data_version = Column(BigInteger, nullable=False, server_default="0")  # Bumped by every write; drives ETags
+    change_floor = Column(BigInteger, nullable=False, server_default="0")  # Change log entries at or below this are compacted
 
 # Branch model for organizing branches
 class Branch(Base):
@@ -61,8 +118,39 @@ class UserRole(Base):
 class Token(Base):
     __tablename__ = 'token'
     token_id = Column(Integer, primary_key=True, autoincrement=True)  # Token ID
-    uid = Column(Integer, ForeignKey('auth.uid'), nullable=False)  # Foreign key to user ID
+    uid = Column(Integer, ForeignKey('auth.uid'), nullable=False, unique=True)  # Foreign key to user ID (one token row per user)
     access_token = Column(Text, nullable=False)  # JWT access token
     refresh_token = Column(Text, nullable=True)  # Optional refresh token
     created_at = Column(TIMESTAMP, default=datetime.utcnow)  # Token creation timestamp
-    expires_at = Column(TIMESTAMP, nullable=False)  # Token expiration timestamp
+    expires_at = Column(TIMESTAMP, nullable=False, index=True)  # Token expiration timestamp (indexed for the reaper)
+
+# RateLimit model: token buckets shared by all workers (RATE_LIMIT_BACKEND=db)
+class RateLimit(Base):
+    __tablename__ = 'rate_limit'
+    key = Column(String(255), primary_key=True)  # "<limiter>:<ip or email>"
+    tokens = Column(Float, nullable=False)  # Tokens left at updated_at
+    updated_at = Column(Float, nullable=False, index=True)  # Unix time of the last refill
+
+# ChangeLog model: latest change per (entity, id), ordered by the user's data version
+class ChangeLog(Base):
+    __tablename__ = 'change_log'
+    clid = Column(Integer, primary_key=True, autoincrement=True)  # Change log ID
+    uid = Column(Integer, ForeignKey('auth.uid'), nullable=False)  # Foreign key to user ID
+    seq = Column(BigInteger, nullable=False)  # Auth.data_version of the write
+    entity = Column(String(16), nullable=False)  # "transaction" or "branch"
+    entity_id = Column(Integer, nullable=False)  # tid or bid
+    op = Column(String(8), nullable=False)  # "upsert" or "delete" (tombstone)
+    __table_args__ = (
+        UniqueConstraint('uid', 'entity', 'entity_id'),
+        Index('ix_change_log_uid_seq', 'uid', 'seq'),
+    )
+
+# SyncClient model: last change log cursor acknowledged by each syncing client
+class SyncClient(Base):
+    __tablename__ = 'sync_client'
+    scid = Column(Integer, primary_key=True, autoincrement=True)  # Sync client ID
+    uid = Column(Integer, ForeignKey('auth.uid'), nullable=False)  # Foreign key to user ID
+    client_id = Column(String(64), nullable=False)  # Opaque id chosen by the client
+    last_seq = Column(BigInteger, nullable=False)  # Cursor the client already holds
+    updated_at = Column(TIMESTAMP, default=datetime.utcnow, index=True)  # Last sync (idle clients expire)
+    __table_args__ = (UniqueConstraint('uid', 'client_id'),)
@@ -1,21 +1,79 @@
 # app/firebase/storage.py
 
+import asyncio
 import base64
 import hashlib
+import mimetypes
+import os
 from pathlib import Path
 import secrets
-from uuid import uuid4
+from typing import Dict, List, Optional, Tuple
 
+from cachetools import LRUCache, TTLCache
+from dotenv import load_dotenv
 from fastapi import UploadFile
 from firebase_admin import storage
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from app.db.crud import (
+    acquire_existing_receipt_ref,
+    acquire_receipt_ref,
+    claim_unreferenced_receipts,
+    drop_receipt_claims,
+    release_receipt_refs,
+)
+from app.lib.archive import ARCHIVE_PREFIX
+from app.lib.receipt_image import (
+    VARIANT_CONTENT_TYPE,
+    VARIANT_SIDES,
+    build_variants,
+    detect_content_type,
+    pick_variant,
+)
+
+load_dotenv()
+
+# Signed receipt URLs: minted locally from the service-account key and cached
+# until SIGNED_URL_REFRESH_MARGIN_MINUTES before they expire.
+SIGNED_URL_EXPIRE_MINUTES = int(os.getenv("SIGNED_URL_EXPIRE_MINUTES", "60"))
+SIGNED_URL_REFRESH_MARGIN_MINUTES = int(os.getenv("SIGNED_URL_REFRESH_MARGIN_MINUTES", "5"))
+SIGNED_URL_CACHE_SIZE = int(os.getenv("SIGNED_URL_CACHE_SIZE", "10000"))
+# An upload that meets an older copy of its blob being deleted waits for the delete
+RECEIPT_UPLOAD_ATTEMPTS = 5
+RECEIPT_UPLOAD_RETRY_SECONDS = 0.5
+
+_signed_url_cache = TTLCache(
+    maxsize=SIGNED_URL_CACHE_SIZE,
+    ttl=max(60, (SIGNED_URL_EXPIRE_MINUTES - SIGNED_URL_REFRESH_MARGIN_MINUTES) * 60),
+)
+
+# Variants known to exist, so their names are signed without a GCS lookup.
+# Variants are only removed together with their original, which clears the entries.
+_known_variants = LRUCache(maxsize=SIGNED_URL_CACHE_SIZE)
+
+# Keep references to fire-and-forget storage jobs so they are not garbage collected
+_background_jobs = set()
+_regenerating = set()
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_jobs.add(task)
+    task.add_done_callback(_background_jobs.discard)
+    return task
+
+# Blob name of a resized variant, e.g. "abc.png" -> "abc.thumb.webp"
+def get_variant_name(file_name: str, variant: str) -> str:
+    return f"{Path(file_name).stem}.{variant}.webp"
+
+def is_variant_name(file_name: str) -> bool:
+    return any(file_name.endswith(f".{variant}.webp") for variant in VARIANT_SIDES)
 
 def get_hashed_uid(uid: str) -> str:
     # Hash UID with SHA256 to make it unique and not exposed
     hash_object = hashlib.sha256(uid.encode())
     return hash_object.hexdigest()
 
-async def delete_storage_uid(uid: str):
+def _delete_storage_uid(uid: str):
     # Get File Name Format
     hashed_uid = get_hashed_uid(uid)
     basic_file_format = f'{hashed_uid}_'
@@ -28,55 +86,265 @@ async def delete_storage_uid(uid: str):
             blob.delete()
             print(f'File {blob.name} deleted')
 
-async def save_image(uid: str, receipt: UploadFile) -> str:
-    # Extract file extension
-    file_extension = Path(receipt.filename).suffix
-    file_name = f"{uuid4()}{file_extension}"
-    dir_path = f"{uid}/{file_name}"
+async def delete_storage_uid(uid: str):
+    await asyncio.to_thread(_delete_storage_uid, uid)
 
+# Generate and upload thumbnail/preview variants (blocking, run on a worker thread)
+def _upload_variants(uid: str, file_name: str, content: bytes):
+    bucket = storage.bucket()
+    for variant, data in build_variants(content).items():
+        blob = bucket.blob(f"{uid}/{get_variant_name(file_name, variant)}")
+        blob.upload_from_string(data, content_type=VARIANT_CONTENT_TYPE)
+
+async def generate_variants(uid: str, file_name: str, content: bytes) -> bool:
+    try:
+        await asyncio.to_thread(_upload_variants, uid, file_name, content)
+        for variant in VARIANT_SIDES:
+            _known_variants[(str(uid), file_name, variant)] = True
+        return True
+    except Exception as e:
+        print(f"Failed to generate receipt variants for {uid}/{file_name}\n{str(e)}")
+        return False
+
+# Download the original and (re)build its variants; False if that failed
+async def regenerate_variants(uid: str, file_name: str) -> bool:
+    key = f"{uid}/{file_name}"
+    if key in _regenerating:
+        return True
+    _regenerating.add(key)
     try:
         bucket = storage.bucket()
-        blob = bucket.blob(dir_path)
-        blob.upload_from_string(receipt.file.read(), content_type='image/png')
-        return file_name
+        blob = bucket.blob(key)
+        content = await asyncio.to_thread(blob.download_as_bytes)
+        return await generate_variants(uid, file_name, content)
+    except Exception as e:
+        print(f"Failed to download receipt for variant backfill {key}\n{str(e)}")
+        return False
+    finally:
+        _regenerating.discard(key)
+
+# Content-addressed file name: same bytes -> same name for a given user
+def get_content_file_name(content: bytes, content_type: str, original_name: str = None) -> str:
+    digest = hashlib.sha256(content).hexdigest()
+    file_extension = mimetypes.guess_extension(content_type) or ""
+    if not file_extension and original_name:
+        file_extension = Path(original_name).suffix.lower()
+    return f"{digest}{file_extension}"
+
+async def save_image(uid: str, receipt: UploadFile) -> str:
+    try:
+        content = await receipt.read()
+        content_type = detect_content_type(content, receipt.filename)
+        file_name = get_content_file_name(content, content_type, receipt.filename)
+        dir_path = f"{uid}/{file_name}"
+
+        for _ in range(RECEIPT_UPLOAD_ATTEMPTS):
+            # Duplicate upload: the blob and its variants are already stored
+            if await acquire_existing_receipt_ref(uid, file_name) is not None:
+                return file_name
+
+            # Upload before taking the reference, so a referenced row always has its blob
+            bucket = storage.bucket()
+            blob = bucket.blob(dir_path)
+            await asyncio.to_thread(blob.upload_from_string, content, content_type=content_type)
+
+            try:
+                ref_count = await acquire_receipt_ref(uid, file_name)
+            except Exception:
+                await _delete_unreferenced(uid, [file_name])
+                raise
+
+            if ref_count is not None:
+                # Another upload of the same bytes may have won the race and built them already
+                if ref_count == 1:
+                    # Variants are built off the request path; reads fall back to the original meanwhile
+                    _spawn(generate_variants(uid, file_name, content))
+                return file_name
+
+            # An older copy is being deleted (maybe including what was just uploaded): wait, then upload again
+            await asyncio.sleep(RECEIPT_UPLOAD_RETRY_SECONDS)
+        raise RuntimeError(f"Receipt {dir_path} is still being deleted")
     except Exception as e:
         print(f"Failed to upload image to Firebase Storage\n{str(e)}")
         return None
 
+# Drop one reference per file name and delete blobs nobody references any more
+async def release_images(uid: str, file_names: list):
+    await _delete_claimed(uid, await release_receipt_refs(uid, file_names))
+
+# Delete blobs without a live reference (e.g. an upload whose reference failed)
+async def _delete_unreferenced(uid: str, file_names: list):
+    await _delete_claimed(uid, await claim_unreferenced_receipts(uid, file_names))
+
+# Blobs claimed for deletion take no new references, so deleting them cannot race an upload;
+# their rows go afterwards, letting uploads of the same bytes store them again
+async def _delete_claimed(uid: str, file_names: list):
+    try:
+        for file_name in file_names:
+            await delete_image(uid, file_name)
+    finally:
+        if file_names:
+            await drop_receipt_claims(uid, file_names)
+
+# Delete the original and its variants (blocking, run on a worker thread)
+def _delete_blobs(uid: str, file_name: str):
+    bucket = storage.bucket()
+    blob = bucket.blob(f"{uid}/{file_name}")
+    blob.delete()
+
+    for variant in VARIANT_SIDES:
+        variant_blob = bucket.get_blob(f"{uid}/{get_variant_name(file_name, variant)}")
+        if variant_blob is not None:
+            variant_blob.delete()
+
 async def delete_image(uid: str, file_name: str) -> str:
+    invalidate_signed_urls(uid, file_name)
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(f"{uid}/{file_name}")
-        blob.delete()
+        await asyncio.to_thread(_delete_blobs, uid, file_name)
         return {"status": True, "message": "Image deleted successfully."}
     except Exception as e:
         print(f"Failed to delete image from Firebase Storage\n{str(e)}")
         return None
 
-async def get_image_url(uid: str, file_name: str) -> str:
+# Resolve the blob to serve for a requested size, falling back to the original
+async def _resolve_blob(uid: str, file_name: str, size: Optional[int] = None):
+    bucket = storage.bucket()
+    variant = pick_variant(size)
+    if variant:
+        variant_name = f"{uid}/{get_variant_name(file_name, variant)}"
+        if (str(uid), file_name, variant) in _known_variants:
+            return bucket.blob(variant_name)
+        blob = await asyncio.to_thread(bucket.get_blob, variant_name)
+        if blob is not None:
+            _known_variants[(str(uid), file_name, variant)] = True
+            return blob
+        # Old receipt without variants: serve the original and backfill it
+        _spawn(regenerate_variants(uid, file_name))
+    return bucket.blob(f"{uid}/{file_name}")
+
+# Signed URL for a receipt, served from cache while it is still fresh
+async def _get_signed_url(uid: str, file_name: str, size: Optional[int] = None) -> str:
+    variant = pick_variant(size)
+    key = (str(uid), file_name, variant)
+    url = _signed_url_cache.get(key)
+    if url is not None:
+        return url
+
+    blob = await _resolve_blob(uid, file_name, size)
+    url = blob.generate_signed_url(
+        version="v4",
+        expiration=timedelta(minutes=SIGNED_URL_EXPIRE_MINUTES),
+        method="GET",
+    )
+
+    # Don't pin the original's URL for a variant request that is being backfilled
+    if variant is None or blob.name != f"{uid}/{file_name}":
+        _signed_url_cache[key] = url
+    return url
+
+def invalidate_signed_urls(uid: str, file_name: str):
+    for variant in [None, *VARIANT_SIDES]:
+        _signed_url_cache.pop((str(uid), file_name, variant), None)
+        _known_variants.pop((str(uid), file_name, variant), None)
+
+async def get_image_url(uid: str, file_name: str, size: Optional[int] = None) -> str:
     try:
-        bucket = storage.bucket()
-        blob = bucket.blob(f"{uid}/{file_name}")
-        blob.make_public()
-        return blob.public_url
+        return await _get_signed_url(uid, file_name, size)
     except Exception as e:
         print(f"Failed to get image from Firebase Storage\n{str(e)}")
         return None
-    
-async def get_image(uid: str, file_name: str) -> str:
-    file_path = f"{uid}/{file_name}"
-    bucket = storage.bucket()
-    blob = bucket.blob(file_path)
-    image = blob.download_as_bytes()
+
+# Signed URLs for many receipts at once, keyed by the caller's id (e.g. tid)
+async def get_image_urls(uid: str, files: List[Tuple[int, str]], size: Optional[int] = None) -> Dict[int, str]:
+    async def sign(file_name: str):
+        try:
+            return await _get_signed_url(uid, file_name, size)
+        except Exception as e:
+            print(f"Failed to get image from Firebase Storage\n{str(e)}")
+            return None
+
+    signed = await asyncio.gather(*(sign(file_name) for _, file_name in files))
+    return {key: url for (key, _), url in zip(files, signed) if url is not None}
+
+async def get_image(uid: str, file_name: str, size: Optional[int] = None) -> str:
+    blob = await _resolve_blob(uid, file_name, size)
+    image = await asyncio.to_thread(blob.download_as_bytes)
     return base64.b64encode(image).decode('utf-8')
 
-async def delete_directory(uid: str):
+# Outcome of the last variant backfill run; an admin starts it on demand, one run at a time
+BACKFILL_FAILURE_SAMPLE = 100
+BACKFILL_STATUS = {
+    "state": "idle",
+    "started_at": None,
+    "finished_at": None,
+    "processed": 0,
+    "failed": 0,
+    "failed_receipts": [],
+}
+
+# Build missing variants for every receipt already in the bucket
+async def backfill_variants():
+    BACKFILL_STATUS.update(
+        state="running", started_at=datetime.utcnow().isoformat(), finished_at=None,
+        processed=0, failed=0, failed_receipts=[],
+    )
+    try:
+        bucket = storage.bucket()
+        names = {blob.name for blob in await asyncio.to_thread(lambda: list(bucket.list_blobs()))}
+    except Exception as e:
+        print(f"Failed to list receipts for variant backfill\n{str(e)}")
+        BACKFILL_STATUS.update(state="failed", finished_at=datetime.utcnow().isoformat())
+        return
+
+    for name in sorted(names):
+        # Yearly transaction archives share the bucket; they are not receipts
+        if "/" not in name or name.startswith(f"{ARCHIVE_PREFIX}/"):
+            continue
+        uid, file_name = name.split("/", 1)
+        if not file_name or is_variant_name(file_name):
+            continue
+        missing = any(
+            f"{uid}/{get_variant_name(file_name, variant)}" not in names
+            for variant in VARIANT_SIDES
+        )
+        if not missing:
+            continue
+        if await regenerate_variants(uid, file_name):
+            BACKFILL_STATUS["processed"] += 1
+        else:
+            BACKFILL_STATUS["failed"] += 1
+            if len(BACKFILL_STATUS["failed_receipts"]) < BACKFILL_FAILURE_SAMPLE:
+                BACKFILL_STATUS["failed_receipts"].append(name)
+
+    BACKFILL_STATUS.update(state="finished", finished_at=datetime.utcnow().isoformat())
+    print(f"Receipt variant backfill finished: {BACKFILL_STATUS['processed']} receipts processed, {BACKFILL_STATUS['failed']} failed")
+
+# Start a backfill run; None when one is already running
+def start_variant_backfill():
+    if BACKFILL_STATUS["state"] == "running":
+        return None
+    BACKFILL_STATUS["state"] = "running"
+    return _spawn(backfill_variants())
+
+# Delete blobs in GCS batch requests (up to STORAGE_BATCH_SIZE per HTTP call)
+STORAGE_BATCH_SIZE = 100
+
+def _delete_directory(uid: str) -> int:
     directory_path = f"{uid}/"
     bucket = storage.bucket()
-    blobs = bucket.list_blobs(prefix=directory_path)
+    blobs = list(bucket.list_blobs(prefix=directory_path))
 
-    for blob in blobs:
-        print(f'Deleting file: {blob.name}')
-        blob.delete()
+    for i in range(0, len(blobs), STORAGE_BATCH_SIZE):
+        with bucket.client.batch():
+            for blob in blobs[i:i + STORAGE_BATCH_SIZE]:
+                blob.delete()
+
+    print(f'Directory {directory_path} and its {len(blobs)} files have been deleted.')
+    return len(blobs)
 
-    print(f'Directory {directory_path} and its contents have been deleted.')
+async def delete_directory(uid: str) -> int:
+    for key in [key for key in list(_signed_url_cache.keys()) if key[0] == str(uid)]:
+        _signed_url_cache.pop(key, None)
+    for key in [key for key in list(_known_variants.keys()) if key[0] == str(uid)]:
+        _known_variants.pop(key, None)
+    return await asyncio.to_thread(_delete_directory, uid)
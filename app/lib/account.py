@@ -0,0 +1,68 @@
+# app/lib/account.py
+
+import asyncio
+import time
+from typing import Dict, Optional
+from uuid import uuid4
+
+from app.firebase.storage import delete_directory
+
+PURGE_MAX_RETRIES = 3
+PURGE_RETRY_BASE_SECONDS = 2.0
+# Finished purge jobs stay queryable for a day
+PURGE_JOB_TTL_SECONDS = 24 * 60 * 60
+
+_purge_jobs: Dict[str, dict] = {}
+_purge_tasks = set()
+
+
+def _purge_expired():
+    now = time.time()
+    expired = [
+        job_id for job_id, job in _purge_jobs.items()
+        if job["finished_at"] is not None and now - job["finished_at"] > PURGE_JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        _purge_jobs.pop(job_id, None)
+
+
+async def _run_storage_purge(job: dict, uid: int):
+    job["status"] = "running"
+    for attempt in range(PURGE_MAX_RETRIES + 1):
+        try:
+            job["deleted_files"] = await delete_directory(uid)
+            job["status"] = "done"
+            job["error"] = None
+            break
+        except Exception as e:
+            print(f"Failed to delete user images (attempt {attempt + 1})\n{str(e)}")
+            job["error"] = str(e)
+            if attempt < PURGE_MAX_RETRIES:
+                await asyncio.sleep(PURGE_RETRY_BASE_SECONDS * (2 ** attempt))
+    else:
+        job["status"] = "failed"
+    job["finished_at"] = time.time()
+
+
+# Purge the user's storage directory in the background; returns the tracking job
+def start_storage_purge(uid: int) -> dict:
+    _purge_expired()
+    job = {
+        "job_id": str(uuid4()),
+        "status": "queued",
+        "deleted_files": None,
+        "error": None,
+        "created_at": time.time(),
+        "finished_at": None,
+    }
+    _purge_jobs[job["job_id"]] = job
+
+    task = asyncio.create_task(_run_storage_purge(job, uid))
+    _purge_tasks.add(task)
+    task.add_done_callback(_purge_tasks.discard)
+    return job
+
+
+def get_storage_purge(job_id: str) -> Optional[dict]:
+    _purge_expired()
+    return _purge_jobs.get(job_id)
@@ -1,19 +1,22 @@
 # app/lib/ai_receipt.py
 
+import asyncio
 import re
+import threading
 import time
 from datetime import datetime
 from difflib import SequenceMatcher
 from io import BytesIO
-from typing import Any, List, Optional, Tuple
+from typing import Any, BinaryIO, Callable, List, Optional, Tuple, Union
 
 import numpy as np
 from fastapi import UploadFile
-from PIL import Image, ImageOps
+from PIL import Image
 from paddleocr import PaddleOCR
 
 
 DEFAULT_MAX_OCR_SIDE = 1100
+LOW_MAX_OCR_SIDE = 800
 DEBUG_TIMING = True
 
 TOP_CROP_RATIO = 0.22
@@ -21,6 +24,10 @@ MIDDLE_START_RATIO = 0.38
 MIDDLE_END_RATIO = 0.82
 BOTTOM_CROP_RATIO = 0.25
 
+# Upper bound on the decoded frame (RGB, so x3 bytes); long receipts are decoded smaller
+MAX_DECODED_PIXELS = DEFAULT_MAX_OCR_SIDE * DEFAULT_MAX_OCR_SIDE * 4
+_EXIF_ORIENTATION_TAG = 0x0112
+
 KNOWN_MERCHANTS = [
     "Walmart", "Walmart Supercentre", "Costco", "Costco Wholesale",
     "Loblaws", "Real Canadian Superstore", "No Frills", "FreshCo", "Metro",
@@ -161,10 +168,32 @@ DATE_HINT_KEYWORDS = [
     "date", "transaction date", "order date", "invoice date", "purchase date",
 ]
 
+# Early-exit pass schedule: (band, fields the pass can resolve, max side, fallback).
+# Cheapest, most likely band first; resolution only escalates for unresolved fields.
+# Fallback passes only run when a field is still missing, not merely unconfident.
+OCR_PASS_SCHEDULE = [
+    ("bottom", ("cashflow",), LOW_MAX_OCR_SIDE, False),
+    ("top", ("date", "description"), LOW_MAX_OCR_SIDE, False),
+    ("middle", ("cashflow",), LOW_MAX_OCR_SIDE, False),
+    ("bottom", ("cashflow",), DEFAULT_MAX_OCR_SIDE, False),
+    ("top", ("date", "description"), DEFAULT_MAX_OCR_SIDE, False),
+    ("full", ("cashflow", "date", "description"), DEFAULT_MAX_OCR_SIDE, True),
+]
+CONFIDENT_DATE_SCORE = 7
+
+SUPPORTED_RECEIPT_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp", ".bmp")
+
+# Progress hook: called with (stage, pass label); stages are "detection" (preparing
+# the band), "recognition" (the OCR model run) and "field_extraction"
+ProgressCallback = Callable[[str, str], None]
+
 _AMOUNT_PATTERN = re.compile(r"(?<![\d%])(\d{1,6}\.\d{2})(?![\d%])")
 
 _OCR_ENGINE: Optional[PaddleOCR] = None
+# PaddleOCR predictors are not thread-safe; every caller (job pool, test route) takes this
+_OCR_ENGINE_LOCK = threading.Lock()
 KNOWN_MERCHANTS_CANON: List[Tuple[str, str]] = []
+OCR_COST_STATS = {"receipts": 0, "passes": 0, "pixels": 0}
 BANNED_MERCHANT_PHRASES_CANON = set()
 
 
@@ -191,16 +220,17 @@ def _init_caches() -> None:
 def _get_ocr_engine() -> PaddleOCR:
     global _OCR_ENGINE
 
-    if _OCR_ENGINE is None:
-        t0 = time.perf_counter()
-        _OCR_ENGINE = PaddleOCR(
-            text_detection_model_name="PP-OCRv5_mobile_det",
-            text_recognition_model_name="en_PP-OCRv5_mobile_rec",
-            use_doc_orientation_classify=False,
-            use_doc_unwarping=False,
-            use_textline_orientation=False,
-        )
-        _log_timing("ocr_engine_init", t0)
+    with _OCR_ENGINE_LOCK:
+        if _OCR_ENGINE is None:
+            t0 = time.perf_counter()
+            _OCR_ENGINE = PaddleOCR(
+                text_detection_model_name="PP-OCRv5_mobile_det",
+                text_recognition_model_name="en_PP-OCRv5_mobile_rec",
+                use_doc_orientation_classify=False,
+                use_doc_unwarping=False,
+                use_textline_orientation=False,
+            )
+            _log_timing("ocr_engine_init", t0)
 
     return _OCR_ENGINE
 
@@ -290,62 +320,113 @@ def _extract_texts_from_ocr_result(result: Any) -> List[str]:
     return found
 
 
-def _image_bytes_to_pil(image_bytes: bytes) -> Image.Image:
-    img = Image.open(BytesIO(image_bytes))
-    img = ImageOps.exif_transpose(img)
-    if img.mode != "RGB":
-        img = img.convert("RGB")
-    return img
-
-
-def _resize_if_needed(img: Image.Image, max_side: int = DEFAULT_MAX_OCR_SIDE) -> Image.Image:
-    w, h = img.size
+# EXIF orientation -> numpy view ops (rot90/flip return views, never copies)
+def _apply_orientation(arr: np.ndarray, orientation: int) -> np.ndarray:
+    if orientation == 2:
+        return arr[:, ::-1]
+    if orientation == 3:
+        return arr[::-1, ::-1]
+    if orientation == 4:
+        return arr[::-1]
+    if orientation == 5:
+        return np.swapaxes(arr, 0, 1)
+    if orientation == 6:
+        return np.rot90(arr, -1)
+    if orientation == 7:
+        return np.rot90(arr, -1)[::-1]
+    if orientation == 8:
+        return np.rot90(arr, 1)
+    return arr
+
+
+def _decode_receipt(source: Union[bytes, BinaryIO], target_width: int = DEFAULT_MAX_OCR_SIDE) -> np.ndarray:
+    if isinstance(source, (bytes, bytearray)):
+        source = BytesIO(source)
+
+    with Image.open(source) as img:
+        orientation = img.getexif().get(_EXIF_ORIENTATION_TAG, 1)
+        w, h = img.size
+        rotated = orientation in (5, 6, 7, 8)
+        display_w, display_h = (h, w) if rotated else (w, h)
+
+        # Decode only as many pixels as the widest OCR pass needs, capped for very long receipts
+        scale = min(1.0, target_width / float(display_w))
+        scale = min(scale, (MAX_DECODED_PIXELS / float(display_w * display_h)) ** 0.5)
+        want = (max(1, int(w * scale)), max(1, int(h * scale)))
+
+        # JPEG: DCT-domain reduce while decoding (1/2, 1/4, 1/8), never below `want`
+        if img.format == "JPEG":
+            img.draft("RGB", want)
+
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        if img.size[0] > want[0]:
+            img = img.resize(want, Image.BILINEAR, reducing_gap=2.0)
+
+        arr = np.asarray(img)
+
+    return _apply_orientation(arr, orientation)
+
+
+def _resize_array(arr: np.ndarray, max_side: int) -> np.ndarray:
+    h, w = arr.shape[:2]
     longest = max(w, h)
 
     if longest <= max_side:
-        return img
+        # PaddleOCR wants a contiguous buffer; this only copies rotated/flipped views
+        return np.ascontiguousarray(arr)
 
     scale = max_side / float(longest)
     new_size = (max(1, int(w * scale)), max(1, int(h * scale)))
-    return img.resize(new_size, Image.LANCZOS)
-
-
-def _pil_to_numpy(img: Image.Image) -> np.ndarray:
-    return np.array(img)
-
-
-def _crop_top(img: Image.Image, ratio: float = TOP_CROP_RATIO) -> Image.Image:
-    w, h = img.size
-    return img.crop((0, 0, w, max(1, int(h * ratio))))
-
-
-def _crop_middle(img: Image.Image, start_ratio: float = MIDDLE_START_RATIO, end_ratio: float = MIDDLE_END_RATIO) -> Image.Image:
-    w, h = img.size
-    y1 = max(0, int(h * start_ratio))
-    y2 = min(h, int(h * end_ratio))
-    if y2 <= y1:
-        y1, y2 = 0, h
-    return img.crop((0, y1, w, y2))
-
-
-def _crop_bottom(img: Image.Image, ratio: float = BOTTOM_CROP_RATIO) -> Image.Image:
-    w, h = img.size
-    start_y = max(0, int(h * (1.0 - ratio)))
-    return img.crop((0, start_y, w, h))
-
-
-def _run_ocr_on_pil(img: Image.Image, label: str) -> List[str]:
+    return np.asarray(Image.fromarray(np.ascontiguousarray(arr)).resize(new_size, Image.BILINEAR))
+
+
+# Horizontal bands are row slices, i.e. views into the decoded buffer
+def _crop_band(arr: np.ndarray, band: str) -> np.ndarray:
+    h = arr.shape[0]
+    if band == "top":
+        return arr[:max(1, int(h * TOP_CROP_RATIO))]
+    if band == "middle":
+        y1 = max(0, int(h * MIDDLE_START_RATIO))
+        y2 = min(h, int(h * MIDDLE_END_RATIO))
+        if y2 <= y1:
+            y1, y2 = 0, h
+        return arr[y1:y2]
+    if band == "bottom":
+        return arr[max(0, int(h * (1.0 - BOTTOM_CROP_RATIO))):]
+    return arr
+
+
+def _report(progress: Optional[ProgressCallback], stage: str, label: str) -> None:
+    if progress is not None:
+        progress(stage, label)
+
+
+def _run_ocr_on_array(
+    image: np.ndarray,
+    label: str,
+    progress: Optional[ProgressCallback] = None,
+    max_side: int = DEFAULT_MAX_OCR_SIDE,
+    stats: Optional[dict] = None,
+) -> List[str]:
     t0 = time.perf_counter()
     ocr = _get_ocr_engine()
     _log_timing(f"{label}_get_ocr_engine", t0)
 
     t1 = time.perf_counter()
-    resized = _resize_if_needed(img)
-    image_np = _pil_to_numpy(resized)
+    _report(progress, "detection", label)
+    image_np = _resize_array(image, max_side)
     _log_timing(f"{label}_prepare_image", t1)
 
+    if stats is not None:
+        stats["passes"] += 1
+        stats["pixels"] += image_np.shape[0] * image_np.shape[1]
+        stats["peak_bytes"] = max(stats["peak_bytes"], stats["decoded_bytes"] + image_np.nbytes)
+
     t2 = time.perf_counter()
-    result = ocr.predict(image_np)
+    _report(progress, "recognition", label)
+    with _OCR_ENGINE_LOCK:
+        result = ocr.predict(image_np)
     _log_timing(f"{label}_ocr_predict", t2)
 
     t3 = time.perf_counter()
@@ -356,6 +437,11 @@ def _run_ocr_on_pil(img: Image.Image, label: str) -> List[str]:
 
 
 def _score_category(lines: List[str]) -> str:
+    return _score_category_scored(lines)[0]
+
+
+# Best category and its keyword score; 0 means no keyword matched (default category)
+def _score_category_scored(lines: List[str]) -> Tuple[str, int]:
     blob = _canonicalize_for_match(" ".join(lines))
     best_category = "General Retail"
     best_score = 0
@@ -370,7 +456,7 @@ def _score_category(lines: List[str]) -> str:
             best_score = score
             best_category = category
 
-    return best_category
+    return best_category, best_score
 
 
 def _normalize_merchant_name(candidate: str) -> Optional[str]:
@@ -455,12 +541,21 @@ def _extract_merchant(lines: List[str]) -> Optional[str]:
 
 
 def _extract_description(lines: List[str]) -> Optional[str]:
+    return _extract_description_scored(lines)[0]
+
+
+# Description plus whether it is good enough to stop OCR: a known merchant, or a
+# category that matched at least one keyword (not the default fallback)
+def _extract_description_scored(lines: List[str]) -> Tuple[Optional[str], bool]:
+    if not lines:
+        return None, False
+
     merchant = _extract_merchant(lines)
     if merchant:
-        return merchant
+        return merchant, True
 
-    category = _score_category(lines)
-    return category if category else None
+    category, score = _score_category_scored(lines)
+    return category, score > 0
 
 
 def _normalize_line_for_amount(line: str) -> str:
@@ -564,8 +659,12 @@ def _score_date_candidate(raw: str, line_idx: int) -> int:
 
 
 def _extract_date(lines: List[str]) -> Optional[str]:
+    return _extract_date_scored(lines)[0]
+
+
+def _extract_date_scored(lines: List[str]) -> Tuple[Optional[str], int]:
     if not lines:
-        return None
+        return None, 0
 
     numeric_patterns = [
         r"\b(20\d{2}[/-]\d{1,2}[/-]\d{1,2}(?:\s+\d{1,2}:\d{2}(?::\d{2})?)?)\b",
@@ -598,15 +697,19 @@ def _extract_date(lines: List[str]) -> Optional[str]:
                     candidates.append((_score_date_candidate(match, idx), parsed))
 
     if not candidates:
-        return None
+        return None, 0
 
     candidates.sort(key=lambda x: x[0], reverse=True)
-    return candidates[0][1]
+    return candidates[0][1], candidates[0][0]
 
 
 def _extract_cashflow(lines: List[str]) -> Optional[float]:
+    return _extract_cashflow_scored(lines)[0]
+
+
+def _extract_cashflow_scored(lines: List[str]) -> Tuple[Optional[float], bool]:
     if not lines:
-        return None
+        return None, False
 
     candidates: List[Tuple[int, float, int, str]] = []
     subtotal_hits: List[Tuple[int, float]] = []
@@ -674,7 +777,7 @@ def _extract_cashflow(lines: List[str]) -> Optional[float]:
     strong = [x for x in candidates if x[2] >= 80]
     if strong:
         strong.sort(key=lambda x: (x[2], x[0], x[1]), reverse=True)
-        return strong[0][1]
+        return strong[0][1], True
 
     if subtotal_hits and tax_hits:
         subtotal = subtotal_hits[-1][1]
@@ -687,15 +790,15 @@ def _extract_cashflow(lines: List[str]) -> Optional[float]:
         ]
         if near_combined:
             near_combined.sort(key=lambda x: (x[2], x[0]), reverse=True)
-            return near_combined[0][1]
+            return near_combined[0][1], True
 
-        return combined
+        return combined, True
 
     if candidates:
         candidates.sort(key=lambda x: (x[2], x[0], x[1]), reverse=True)
         best = candidates[0]
         if best[2] >= 20:
-            return best[1]
+            return best[1], False
 
     fallback_vals: List[Tuple[int, float]] = []
     for idx, line in enumerate(lines):
@@ -707,9 +810,9 @@ def _extract_cashflow(lines: List[str]) -> Optional[float]:
 
     if fallback_vals:
         fallback_vals.sort(key=lambda x: (x[0], x[1]), reverse=True)
-        return fallback_vals[0][1]
+        return fallback_vals[0][1], False
 
-    return None
+    return None, False
 
 
 def _merge_unique_lines(*groups: List[str]) -> List[str]:
@@ -726,79 +829,120 @@ def _merge_unique_lines(*groups: List[str]) -> List[str]:
     return result
 
 
-async def extract_receipt_info(receipt: UploadFile) -> Optional[dict]:
-    print("version_3")
+def is_supported_receipt(filename: Optional[str]) -> bool:
+    return bool(filename) and filename.lower().endswith(SUPPORTED_RECEIPT_EXTENSIONS)
+
+
+def _resolve_fields(band_lines: dict) -> dict:
+    top_lines = band_lines.get("top", [])
+    full_lines = band_lines.get("full", [])
+    merged_lines = _merge_unique_lines(top_lines, band_lines.get("middle", []), band_lines.get("bottom", []), full_lines)
+    cashflow_lines = _merge_unique_lines(band_lines.get("middle", []), band_lines.get("bottom", []))
+
+    cashflow_value, cashflow_confident = _extract_cashflow_scored(cashflow_lines)
+    if not cashflow_confident and full_lines:
+        full_value, full_confident = _extract_cashflow_scored(full_lines)
+        if full_value is not None and (full_confident or cashflow_value is None):
+            cashflow_value, cashflow_confident = full_value, full_confident
+
+    date_value, date_score = _extract_date_scored(top_lines)
+    if date_score < CONFIDENT_DATE_SCORE:
+        merged_date, merged_score = _extract_date_scored(merged_lines)
+        if merged_date and merged_score > date_score:
+            date_value, date_score = merged_date, merged_score
+
+    merchant_value = _extract_merchant(top_lines) or _extract_merchant(merged_lines)
+    if merchant_value:
+        description = (merchant_value, True)
+    else:
+        description = _extract_description_scored(merged_lines)
+
+    return {
+        "cashflow": (cashflow_value, cashflow_confident),
+        "date": (date_value, date_score >= CONFIDENT_DATE_SCORE),
+        "description": description,
+        "merged_lines": merged_lines,
+    }
+
+
+def get_ocr_cost_stats() -> dict:
+    receipts = OCR_COST_STATS["receipts"] or 1
+    return {
+        **OCR_COST_STATS,
+        "avg_passes": OCR_COST_STATS["passes"] / receipts,
+        "avg_pixels": OCR_COST_STATS["pixels"] / receipts,
+    }
+
+
+def extract_receipt_info_from_bytes(content: Union[bytes, BinaryIO], progress: Optional[ProgressCallback] = None) -> Optional[dict]:
     total_t0 = time.perf_counter()
 
-    if not receipt or not receipt.filename:
+    if not content:
         return None
 
-    lower_name = receipt.filename.lower()
-    if not lower_name.endswith((".jpg", ".jpeg", ".png", ".webp", ".bmp")):
-        return None
+    t1 = time.perf_counter()
+    original_img = _decode_receipt(content)
+    _log_timing("open_image", t1)
+
+    decoded_bytes = original_img.nbytes
+    stats = {"passes": 0, "pixels": 0, "decoded_bytes": decoded_bytes, "peak_bytes": decoded_bytes}
+    band_lines: dict = {}
+    fields = _resolve_fields(band_lines)
+
+    for band, pass_fields, max_side, fallback in OCR_PASS_SCHEDULE:
+        if fallback:
+            if all(fields[name][0] is not None for name in pass_fields):
+                continue
+        elif all(fields[name][1] for name in pass_fields):
+            continue
 
-    print("DEFAULT_MAX_OCR_SIDE", DEFAULT_MAX_OCR_SIDE)
+        label = f"{band}_{max_side}"
+        lines = _run_ocr_on_array(_crop_band(original_img, band), label, progress, max_side, stats)
+        print(f"{label.upper()}_LINES =", lines)
+        # A re-run of a band at a higher resolution adds to the earlier pass, higher resolution first
+        band_lines[band] = _merge_unique_lines(lines, band_lines.get(band, []))
 
-    try:
-        t0 = time.perf_counter()
-        content = await receipt.read()
-        _log_timing("read_upload", t0)
-
-        if not content:
-            return None
-
-        t1 = time.perf_counter()
-        original_img = _image_bytes_to_pil(content)
-        _log_timing("open_image", t1)
-
-        t2 = time.perf_counter()
-        top_img = _crop_top(original_img)
-        middle_img = _crop_middle(original_img)
-        bottom_img = _crop_bottom(original_img)
-        _log_timing("crop_image", t2)
-
-        top_lines = _run_ocr_on_pil(top_img, "top")
-        middle_lines = _run_ocr_on_pil(middle_img, "middle")
-        bottom_lines = _run_ocr_on_pil(bottom_img, "bottom")
-
-        merged_lines = _merge_unique_lines(top_lines, middle_lines, bottom_lines)
-        cashflow_lines = _merge_unique_lines(middle_lines, bottom_lines)
-
-        print("TOP_LINES =", top_lines)
-        print("MIDDLE_LINES =", middle_lines)
-        print("BOTTOM_LINES =", bottom_lines)
-        print("MERGED_LINES =", merged_lines)
-        print("CASHFLOW_LINES =", cashflow_lines)
-
-        date_value = _extract_date(top_lines) or _extract_date(merged_lines)
-        description_value = _extract_description(top_lines) or _extract_description(merged_lines)
-
-        full_lines: List[str] = []
-
-        cashflow_value = _extract_cashflow(middle_lines)
-        if cashflow_value is None:
-            cashflow_value = _extract_cashflow(cashflow_lines)
-        if cashflow_value is None:
-            full_lines = _run_ocr_on_pil(original_img, "full_cashflow_fallback")
-            print("FULL_CASHFLOW_LINES =", full_lines)
-            cashflow_value = _extract_cashflow(full_lines)
-
-        if not date_value and not description_value:
-            if not full_lines:
-                full_lines = _run_ocr_on_pil(original_img, "full_header_fallback")
-            date_value = date_value or _extract_date(full_lines)
-            description_value = description_value or _extract_description(full_lines)
-
-        t3 = time.perf_counter()
-        result = {
-            "date": date_value,
-            "cashflow": cashflow_value,
-            "description": description_value,
-        }
-        _log_timing("post_process", t3)
-        _log_timing("extract_receipt_info_total", total_t0)
+        _report(progress, "field_extraction", label)
+        fields = _resolve_fields(band_lines)
+
+        # Early exit once every field is resolved with enough confidence
+        if all(fields[name][1] for name in ("cashflow", "date", "description")):
+            break
+
+    date_value = fields["date"][0]
+    description_value = fields["description"][0]
+
+    t3 = time.perf_counter()
+    result = {
+        "date": date_value,
+        "cashflow": fields["cashflow"][0],
+        "description": description_value,
+        "ocr_passes": stats["passes"],
+        "ocr_pixels": stats["pixels"],
+        "ocr_peak_bytes": stats["peak_bytes"],
+    }
+    _log_timing("post_process", t3)
+    _log_timing("extract_receipt_info_total", total_t0)
+
+    OCR_COST_STATS["receipts"] += 1
+    OCR_COST_STATS["passes"] += stats["passes"]
+    OCR_COST_STATS["pixels"] += stats["pixels"]
+    print(f"[ai_receipt] ocr_cost: passes={stats['passes']} pixels={stats['pixels']} peak_bytes={stats['peak_bytes']}")
+
+    return result
 
-        return result
+
+async def extract_receipt_info(receipt: UploadFile) -> Optional[dict]:
+    print("version_3")
+
+    if not receipt or not is_supported_receipt(receipt.filename):
+        return None
+
+    try:
+        # Decode straight from the spooled upload file instead of copying it into bytes;
+        # OCR runs on a worker thread so waiting for the engine lock doesn't block the loop
+        await receipt.seek(0)
+        return await asyncio.to_thread(extract_receipt_info_from_bytes, receipt.file)
 
     except Exception as e:
         print(f"Failed to extract receipt info: {e}")
@@ -808,4 +952,4 @@ async def extract_receipt_info(receipt: UploadFile) -> Optional[dict]:
         try:
             await receipt.seek(0)
         except Exception:
-            pass
\ No newline at end of file
+            pass
@@ -0,0 +1,232 @@
+# app/lib/analytics.py
+
+import asyncio
+import os
+import socket
+import threading
+import uuid
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from app.db.crud import get_branch_monthly_postgre
+from app.db.init import database
+from app.db.model import Auth, SyncClient, Transaction
+from app.lib.archive import get_archived_branch_monthly
+from app.lib.change_log import TRANSACTION, UPSERT, get_changes
+
+try:
+    import duckdb
+except ImportError:  # optional; reports read the primary database without it
+    duckdb = None
+
+# Load environment variables
+load_dotenv()
+
+ANALYTICS_REPLICA = os.getenv("ANALYTICS_REPLICA", "false").lower() == "true"
+ANALYTICS_DB_PATH = os.getenv("ANALYTICS_DB_PATH", ":memory:")
+ANALYTICS_REFRESH_SECONDS = int(os.getenv("ANALYTICS_REFRESH_SECONDS", "30"))
+ANALYTICS_INSERT_CHUNK = 1000
+# Registered as a sync client so the change log is not compacted past the replica. Each
+# process holds its own in-memory replica, so each needs its own cursor (hostnames repeat
+# across Cloud Run instances, hence the random suffix).
+ANALYTICS_CLIENT_ID = f"analytics-{socket.gethostname()[:24]}-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+
+_COLUMNS = ("tid", "uid", "t_date", "branch", "cashflow", "currency")
+
+_BRANCH_MONTHLY_SQL = """
+    SELECT branch,
+           strftime(t_date, '%Y-%m') AS monthly,
+           currency,
+           SUM(CASE WHEN cashflow > 0 THEN cashflow ELSE 0 END) AS income,
+           SUM(CASE WHEN cashflow < 0 THEN cashflow ELSE 0 END) AS expenditure
+    FROM transactions
+    WHERE uid = ? AND t_date BETWEEN ? AND ?
+    GROUP BY branch, monthly, currency
+"""
+
+ANALYTICS_STATS = {"refreshes": 0, "reloads": 0, "applied_changes": 0, "replica_reads": 0, "primary_reads": 0}
+
+
+# Columnar copy of the transaction table in DuckDB. One connection guarded by a lock;
+# every call runs on a worker thread so the event loop never blocks on DuckDB.
+class AnalyticsReplica:
+    def __init__(self, path: str = ANALYTICS_DB_PATH):
+        self._con = duckdb.connect(path)
+        self._lock = threading.Lock()
+        self._con.execute("""
+            CREATE TABLE IF NOT EXISTS transactions (
+                tid INTEGER, uid INTEGER, t_date DATE, branch VARCHAR, cashflow BIGINT, currency VARCHAR
+            )
+        """)
+        # uid -> data version the replica holds for that user
+        self.cursors: Dict[int, int] = {}
+
+    def _insert(self, rows: List[tuple]):
+        for start in range(0, len(rows), ANALYTICS_INSERT_CHUNK):
+            chunk = rows[start:start + ANALYTICS_INSERT_CHUNK]
+            placeholders = ", ".join(["(?, ?, ?, ?, ?, ?)"] * len(chunk))
+            self._con.execute(
+                f"INSERT INTO transactions VALUES {placeholders}",
+                [value for row in chunk for value in row],
+            )
+
+    def replace_rows(self, uid: Optional[int], delete_tids: List[int], rows: List[tuple]):
+        with self._lock:
+            self._con.execute("BEGIN")
+            try:
+                if uid is not None:
+                    self._con.execute("DELETE FROM transactions WHERE uid = ?", [uid])
+                if delete_tids:
+                    self._con.execute(
+                        f"DELETE FROM transactions WHERE tid IN ({', '.join(['?'] * len(delete_tids))})",
+                        delete_tids,
+                    )
+                self._insert(rows)
+                self._con.execute("COMMIT")
+            except Exception:
+                self._con.execute("ROLLBACK")
+                raise
+
+    def drop_users(self, uids: List[int]):
+        with self._lock:
+            for uid in uids:
+                self._con.execute("DELETE FROM transactions WHERE uid = ?", [uid])
+                self.cursors.pop(uid, None)
+
+    def branch_monthly(self, uid: int, begin_date, end_date) -> List[dict]:
+        with self._lock:
+            result = self._con.execute(_BRANCH_MONTHLY_SQL, [uid, begin_date, end_date]).fetchall()
+        keys = ("branch", "monthly", "currency", "income", "expenditure")
+        return [dict(zip(keys, row)) for row in result]
+
+
+_replica: Optional[AnalyticsReplica] = None
+_refresh_task: Optional[asyncio.Task] = None
+
+
+def _row_tuple(row) -> tuple:
+    return tuple(row[column] for column in _COLUMNS)
+
+
+# Full copy of one user's transactions, streamed from the primary in chunks
+async def _reload_user(uid: int):
+    query = select(*[Transaction.__table__.c[column] for column in _COLUMNS]).where(Transaction.uid == uid)
+    first = True
+    chunk = []
+    async for row in database.iterate(query):
+        chunk.append(_row_tuple(row))
+        if len(chunk) >= ANALYTICS_INSERT_CHUNK * 10:
+            await asyncio.to_thread(_replica.replace_rows, uid if first else None, [], chunk)
+            first, chunk = False, []
+    await asyncio.to_thread(_replica.replace_rows, uid if first else None, [], chunk)
+    ANALYTICS_STATS["reloads"] += 1
+
+
+# Bring one user up to date from the change log (reloading when the cursor was compacted)
+async def _refresh_user(uid: int):
+    cursor = _replica.cursors.get(uid)
+    while True:
+        changes = await get_changes(uid, ANALYTICS_CLIENT_ID, cursor)
+        if changes["reset"]:
+            await _reload_user(uid)
+            cursor = changes["version"]
+            _replica.cursors[uid] = cursor
+            continue
+
+        upserts, deletes = [], []
+        for change in changes["changes"]:
+            if change["entity"] != TRANSACTION:
+                continue
+            deletes.append(change["id"])
+            if change["op"] == UPSERT:
+                upserts.append(_row_tuple(change["data"]))
+        if deletes:
+            await asyncio.to_thread(_replica.replace_rows, None, deletes, upserts)
+            ANALYTICS_STATS["applied_changes"] += len(deletes)
+
+        cursor = changes["version"]
+        _replica.cursors[uid] = cursor
+        if not changes["has_more"]:
+            return
+
+
+async def refresh_replica():
+    versions = {row["uid"]: row["data_version"] for row in await database.fetch_all(select(Auth.uid, Auth.data_version))}
+    for uid, version in versions.items():
+        if _replica.cursors.get(uid) != version:
+            await _refresh_user(uid)
+
+    gone = [uid for uid in _replica.cursors if uid not in versions]
+    if gone:
+        await asyncio.to_thread(_replica.drop_users, gone)
+    ANALYTICS_STATS["refreshes"] += 1
+
+
+async def _run_refresh():
+    while True:
+        try:
+            await refresh_replica()
+        except Exception as e:
+            print(f"Failed to refresh the analytics replica\n{str(e)}")
+        await asyncio.sleep(ANALYTICS_REFRESH_SECONDS)
+
+
+def start_analytics_replica():
+    global _replica, _refresh_task
+
+    if not ANALYTICS_REPLICA:
+        return None
+    if duckdb is None:
+        print("ANALYTICS_REPLICA is set but duckdb is not installed; reports use the primary database")
+        return None
+    if _replica is None:
+        _replica = AnalyticsReplica()
+    if _refresh_task is None or _refresh_task.done():
+        _refresh_task = asyncio.create_task(_run_refresh())
+    return _refresh_task
+
+
+async def stop_analytics_replica():
+    global _refresh_task
+
+    if _refresh_task is not None:
+        _refresh_task.cancel()
+        try:
+            await _refresh_task
+        except asyncio.CancelledError:
+            pass
+        _refresh_task = None
+
+    # The replica dies with the process; its cursors would only hold back compaction
+    if _replica is not None:
+        await database.execute(
+            SyncClient.__table__.delete().where(SyncClient.client_id == ANALYTICS_CLIENT_ID)
+        )
+
+
+async def _hot_branch_monthly(uid: int, begin_date: str, end_date: str):
+    if _replica is not None:
+        version = await database.fetch_val(select(Auth.data_version).where(Auth.uid == uid))
+        if _replica.cursors.get(uid) == version:
+            begin = datetime.strptime(begin_date, "%Y-%m-%d").date()
+            end = datetime.strptime(end_date, "%Y-%m-%d").date()
+            ANALYTICS_STATS["replica_reads"] += 1
+            return await asyncio.to_thread(_replica.branch_monthly, uid, begin, end)
+
+    ANALYTICS_STATS["primary_reads"] += 1
+    return await get_branch_monthly_postgre(uid, begin_date, end_date)
+
+
+# (branch, month, currency) sums: from the replica when it already holds the user's current
+# data version, otherwise from the primary database, so answers are never staler than the ETag.
+# Archived years are added from the archive files (the replica only mirrors the table).
+# Rows may repeat a (branch, month, currency) key; consumers sum them.
+async def get_branch_monthly(uid: int, begin_date: str, end_date: str):
+    rows = await _hot_branch_monthly(uid, begin_date, end_date)
+    archived = await get_archived_branch_monthly(uid, begin_date, end_date)
+    if archived:
+        rows = [row if isinstance(row, dict) else dict(row._mapping) for row in rows] + archived
+    return rows
@@ -0,0 +1,571 @@
+# app/lib/archive.py
+
+import asyncio
+import os
+import shutil
+import uuid
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from cachetools import LRUCache
+from dotenv import load_dotenv
+from firebase_admin import storage
+from sqlalchemy import func, select
+
+from app.db.crud import dialect_insert, subtree_of
+from app.db.init import DIALECT, POSTGRESQL, database
+from app.db.model import ArchivePartition, Auth, Transaction
+from app.lib.data_version import bump_data_version
+from app.lib.ledger import get_opening_balance
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # optional; every year stays in the transaction table without it
+    pa = pc = pq = None
+
+# Load environment variables
+load_dotenv()
+
+ARCHIVE_ENABLED = os.getenv("ARCHIVE_ENABLED", "false").lower() == "true"
+# Archive files live in the Firebase Storage bucket under ARCHIVE_PREFIX, which every
+# instance shares and which outlives them. ARCHIVE_DIR keeps them in a local directory
+# instead: for development, or a volume mounted on every instance.
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR") or None
+ARCHIVE_PREFIX = os.getenv("ARCHIVE_PREFIX", "archive")
+# The current year and the years before it that stay in the transaction table
+ARCHIVE_HOT_YEARS = int(os.getenv("ARCHIVE_HOT_YEARS", "2"))
+ARCHIVE_INTERVAL_SECONDS = int(os.getenv("ARCHIVE_INTERVAL_SECONDS", str(24 * 60 * 60)))
+ARCHIVE_COMPRESSION = os.getenv("ARCHIVE_COMPRESSION", "zstd")
+# PostgreSQL yearly partitions are created this many years ahead
+PARTITION_YEARS_AHEAD = 1
+ARCHIVE_DELETE_CHUNK = 500
+ARCHIVE_CONTENT_TYPE = "application/vnd.apache.parquet"
+# Archive files whose tid -> receipt maps are kept in memory; names change on every
+# rewrite, so an entry never goes stale
+ARCHIVE_TID_CACHE_SIZE = int(os.getenv("ARCHIVE_TID_CACHE_SIZE", "256"))
+
+_COLUMNS = ("tid", "t_date", "branch", "cashflow", "currency", "description", "c_date", "receipt")
+
+_PARTITIONED_SQL = """
+    SELECT 1 FROM pg_partitioned_table p
+    JOIN pg_class c ON c.oid = p.partrelid
+    WHERE c.relname = 'transaction'
+"""
+
+ARCHIVE_STATS = {"runs": 0, "archived_users": 0, "archived_rows": 0, "archive_reads": 0, "last_run_at": None}
+
+_archive_task: Optional[asyncio.Task] = None
+# file name -> {tid: receipt} of the rows it holds
+_tid_receipts = LRUCache(maxsize=ARCHIVE_TID_CACHE_SIZE)
+
+
+# Column layout of archive files and dataset exports
+def transaction_arrow_schema():
+    return pa.schema([
+        ("tid", pa.int64()),
+        ("t_date", pa.date32()),
+        ("branch", pa.string()),
+        ("cashflow", pa.int64()),
+        ("currency", pa.string()),
+        ("description", pa.string()),
+        ("c_date", pa.timestamp("us")),
+        ("receipt", pa.string()),
+    ])
+
+
+def _require_pyarrow():
+    if pq is None:
+        raise RuntimeError("pyarrow is required to read or change archived years")
+
+
+def _as_date(value) -> date:
+    if isinstance(value, str):
+        return datetime.strptime(value, "%Y-%m-%d").date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+# Years older than the ARCHIVE_HOT_YEARS most recent ones are closed
+def archive_cutoff(today: date) -> date:
+    return date(today.year - ARCHIVE_HOT_YEARS + 1, 1, 1)
+
+
+def _subtree_mask(table, branch: str):
+    column = table.column("branch")
+    return pc.or_(pc.equal(column, branch), pc.starts_with(column, pattern=f"{branch}/"))
+
+
+def _sorted(table):
+    return table.sort_by([("t_date", "ascending"), ("tid", "ascending")])
+
+
+# Name of a new archive file. Files are never overwritten: every change writes a file
+# under a fresh name and points the year's manifest row at it.
+def _new_file_name(uid: int, year: int) -> str:
+    return f"{uid}/{year}-{uuid.uuid4().hex[:12]}.parquet"
+
+
+# Manifest rows written before file names were recorded point at "<uid>/<year>.parquet"
+def _file_name(uid: int, year: int, file: Optional[str]) -> str:
+    return file or f"{uid}/{year}.parquet"
+
+
+def _parquet_bytes(table) -> bytes:
+    sink = pa.BufferOutputStream()
+    pq.write_table(table, sink, compression=ARCHIVE_COMPRESSION)
+    return sink.getvalue().to_pybytes()
+
+
+# Store a file and confirm it is complete before the caller deletes any row it holds
+def _write_file(name: str, data: bytes):
+    if ARCHIVE_DIR:
+        path = os.path.join(ARCHIVE_DIR, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        return
+
+    bucket = storage.bucket()
+    bucket.blob(f"{ARCHIVE_PREFIX}/{name}").upload_from_string(data, content_type=ARCHIVE_CONTENT_TYPE)
+    stored = bucket.get_blob(f"{ARCHIVE_PREFIX}/{name}")
+    if stored is None or stored.size != len(data):
+        raise RuntimeError(f"Upload of archive file {name} could not be confirmed")
+
+
+# A path or an in-memory buffer pyarrow can read the file from
+def open_archive_file(name: str):
+    if ARCHIVE_DIR:
+        return os.path.join(ARCHIVE_DIR, name)
+    return pa.BufferReader(storage.bucket().blob(f"{ARCHIVE_PREFIX}/{name}").download_as_bytes())
+
+
+def _remove_files(names: Iterable[str]):
+    for name in names:
+        try:
+            if ARCHIVE_DIR:
+                os.remove(os.path.join(ARCHIVE_DIR, name))
+            else:
+                storage.bucket().blob(f"{ARCHIVE_PREFIX}/{name}").delete()
+        except Exception as e:
+            print(f"Failed to delete archive file {name}\n{str(e)}")
+
+
+# Write a year's new file; staged collects (new file, replaced file) pairs
+def _stage(staged: List[Tuple[str, Optional[str]]], uid: int, year: int, table, old_file: Optional[str]) -> str:
+    name = _new_file_name(uid, year)
+    _write_file(name, _parquet_bytes(table))
+    staged.append((name, old_file))
+    return name
+
+
+# DB transaction that points manifest rows at newly written files. If it fails the new
+# files are deleted; once it commits, the files they replaced are.
+@asynccontextmanager
+async def archive_transaction():
+    staged: List[Tuple[str, Optional[str]]] = []
+    try:
+        async with database.transaction():
+            yield staged
+    except BaseException:
+        await asyncio.to_thread(_remove_files, [new for new, _ in staged])
+        raise
+    await asyncio.to_thread(_remove_files, [old for _, old in staged if old])
+
+
+# Bump the data version and raise the change floor to it, so every sync client reloads.
+# Used when archived rows change: they have no table rows the change log could point at.
+async def reset_sync_clients(uid: int):
+    version = await bump_data_version(uid)
+    await database.execute(Auth.__table__.update().where(Auth.uid == uid).values(change_floor=version))
+
+
+# Start of the first hot year for the user (None if nothing is archived). Checkpoints exist there.
+async def get_archive_boundary(uid: int) -> Optional[date]:
+    query = select(func.max(ArchivePartition.sealed_before)).where(ArchivePartition.uid == uid)
+    return await database.fetch_val(query)
+
+
+# {year: file name} of the user's archived years, optionally only those overlapping [begin, end].
+# for_share (PostgreSQL) keeps the rows from being repointed, and so their files from being
+# deleted, until the caller's DB transaction ends.
+async def get_archived_files(uid: int, begin: Optional[date] = None, end: Optional[date] = None, for_share: bool = False) -> Dict[int, str]:
+    query = select(ArchivePartition.year, ArchivePartition.file).where(ArchivePartition.uid == uid).order_by(ArchivePartition.year)
+    if begin is not None:
+        query = query.where(ArchivePartition.year.between(begin.year, end.year))
+    if for_share and DIALECT == POSTGRESQL:
+        query = query.with_for_update(read=True)
+    return {row["year"]: _file_name(uid, row["year"], row["file"]) for row in await database.fetch_all(query)}
+
+
+def _read_files(files: Dict[int, str], filters, branch: Optional[str] = None):
+    tables = []
+    for name in files.values():
+        table = pq.read_table(open_archive_file(name), filters=filters)
+        if branch is not None:
+            table = table.filter(_subtree_mask(table, branch))
+        tables.append(table)
+    return pa.concat_tables(tables)
+
+
+# Read archived rows matching the filters. A file replaced (and deleted) by a commit between
+# the manifest read and the file read is retried once against the new manifest.
+async def _read_archived(uid: int, filters, begin: Optional[date] = None, end: Optional[date] = None, branch: Optional[str] = None):
+    files = await get_archived_files(uid, begin, end)
+    if not files:
+        return None
+    _require_pyarrow()
+    ARCHIVE_STATS["archive_reads"] += 1
+    try:
+        return await asyncio.to_thread(_read_files, files, filters, branch)
+    except Exception:
+        current = await get_archived_files(uid, begin, end)
+        if current == files:
+            raise
+        return await asyncio.to_thread(_read_files, current, filters, branch) if current else None
+
+
+async def _archived_table(uid: int, begin: date, end: date, branch: Optional[str] = None):
+    filters = [("t_date", ">=", begin), ("t_date", "<=", end)]
+    return await _read_archived(uid, filters, begin, end, branch)
+
+
+def _read_tid_receipts(name: str) -> Dict[int, Optional[str]]:
+    table = pq.read_table(open_archive_file(name), columns=["tid", "receipt"])
+    return dict(zip(table.column("tid").to_pylist(), table.column("receipt").to_pylist()))
+
+
+# {tid: receipt} for the given tids that live in the user's archive files rather than the
+# transaction table. Only files whose manifest tid range covers one of them are opened, each
+# at most once per file version, so unknown tids cannot make every request download the archive.
+async def get_archived_receipts(uid: int, tids: List[int]) -> Dict[int, Optional[str]]:
+    if not tids:
+        return {}
+    query = select(
+        ArchivePartition.year, ArchivePartition.file, ArchivePartition.row_count,
+        ArchivePartition.min_tid, ArchivePartition.max_tid,
+    ).where(ArchivePartition.uid == uid)
+    found = {}
+    for row in await database.fetch_all(query):
+        if row["row_count"] == 0:
+            continue
+        # Rows written before the range was recorded have none; their files are always checked
+        if row["min_tid"] is not None and not any(row["min_tid"] <= tid <= row["max_tid"] for tid in tids):
+            continue
+        name = _file_name(uid, row["year"], row["file"])
+        held = _tid_receipts.get(name)
+        if held is None:
+            _require_pyarrow()
+            ARCHIVE_STATS["archive_reads"] += 1
+            held = await asyncio.to_thread(_read_tid_receipts, name)
+            _tid_receipts[name] = held
+        found.update({tid: held[tid] for tid in tids if tid in held})
+    return found
+
+
+async def get_archived_tids(uid: int, tids: List[int]) -> Set[int]:
+    return set(await get_archived_receipts(uid, tids))
+
+
+# Archived rows of a branch subtree within [begin, end], ordered by (t_date, tid)
+async def get_archived_rows(uid: int, branch: str, begin, end) -> List[dict]:
+    table = await _archived_table(uid, _as_date(begin), _as_date(end), branch)
+    if table is None:
+        return []
+    return [dict(row, uid=uid) for row in _sorted(table).to_pylist()]
+
+
+# (branch, month, currency) income/expenditure sums of an Arrow table of transactions
+def arrow_branch_monthly(table) -> List[dict]:
+    cashflow = table.column("cashflow")
+    zero = pa.scalar(0, pa.int64())
+    grouped = pa.table({
+        "branch": table.column("branch"),
+        "monthly": pc.strftime(pc.cast(table.column("t_date"), pa.timestamp("s")), format="%Y-%m"),
+        "currency": table.column("currency"),
+        "income": pc.if_else(pc.greater(cashflow, 0), cashflow, zero),
+        "expenditure": pc.if_else(pc.less(cashflow, 0), cashflow, zero),
+    }).group_by(["branch", "monthly", "currency"]).aggregate([("income", "sum"), ("expenditure", "sum")])
+    return [
+        {
+            "branch": row["branch"],
+            "monthly": row["monthly"],
+            "currency": row["currency"],
+            "income": row["income_sum"],
+            "expenditure": row["expenditure_sum"],
+        }
+        for row in grouped.to_pylist()
+    ]
+
+
+# (branch, month, currency) sums of the archived rows within [begin, end]
+async def get_archived_branch_monthly(uid: int, begin, end) -> List[dict]:
+    table = await _archived_table(uid, _as_date(begin), _as_date(end))
+    if table is None or table.num_rows == 0:
+        return []
+    return await asyncio.to_thread(arrow_branch_monthly, table)
+
+
+# Subtree balance per currency before `begin`. A range starting inside the archived years is
+# walked back from the checkpoints sealed at the boundary: hot and archived rows in
+# [begin, boundary) are subtracted, so balances never need a full scan of the archive.
+async def get_opening_balance_with_archive(uid: int, branch: str, begin) -> Dict[str, int]:
+    begin = _as_date(begin)
+    boundary = await get_archive_boundary(uid)
+    if boundary is None or begin >= boundary:
+        return await get_opening_balance(uid, branch, begin)
+
+    balances = defaultdict(int, await get_opening_balance(uid, branch, boundary))
+    query = (
+        select(Transaction.currency, func.sum(Transaction.cashflow).label("amount"))
+        .where(
+            (Transaction.uid == uid) &
+            subtree_of(Transaction.branch, branch) &
+            (Transaction.t_date >= begin) &
+            (Transaction.t_date < boundary)
+        )
+        .group_by(Transaction.currency)
+    )
+    for row in await database.fetch_all(query):
+        balances[row["currency"]] -= row["amount"] or 0
+
+    table = await _archived_table(uid, begin, boundary - timedelta(days=1), branch)
+    if table is not None and table.num_rows:
+        grouped = table.group_by("currency").aggregate([("cashflow", "sum")])
+        for row in grouped.to_pylist():
+            balances[row["currency"]] -= row["cashflow_sum"]
+    return dict(balances)
+
+
+# Manifest columns of a newly written file
+def _manifest_entry(table, name: str) -> dict:
+    tids = pc.min_max(table.column("tid")).as_py() if table.num_rows else {"min": None, "max": None}
+    return {"row_count": table.num_rows, "file": name, "min_tid": tids["min"], "max_tid": tids["max"]}
+
+
+# Write each year's rows (joined with the year's existing file, if any); returns
+# {year: manifest entry}
+def _stage_years(staged, uid: int, rows_by_year: Dict[int, List[dict]], files: Dict[int, str]) -> Dict[int, dict]:
+    written = {}
+    for year, rows in rows_by_year.items():
+        table = pa.Table.from_pylist(rows, schema=transaction_arrow_schema())
+        if year in files:
+            # Rows written into a closed year after it was archived join the existing file
+            existing = pq.read_table(open_archive_file(files[year])).cast(transaction_arrow_schema())
+            table = pa.concat_tables([existing, table])
+        table = _sorted(table)
+        written[year] = _manifest_entry(table, _stage(staged, uid, year, table, files.get(year)))
+    return written
+
+
+async def _point_manifest(uid: int, written: Dict[int, dict]):
+    for year, entry in written.items():
+        query = ArchivePartition.__table__.update().where(
+            (ArchivePartition.uid == uid) & (ArchivePartition.year == year)
+        ).values(**entry)
+        await database.execute(query)
+
+
+# Move the user's transactions dated before `cutoff` into per-year Parquet files, in one DB
+# transaction: balances are sealed into checkpoints at the cutoff first, the files are written
+# and confirmed, then the rows are deleted, the manifest updated and sync clients reset.
+# Returns the number of rows archived.
+async def archive_user(uid: int, cutoff: date) -> int:
+    _require_pyarrow()
+    async with archive_transaction() as staged:
+        query = Transaction.__table__.select().where(
+            (Transaction.uid == uid) & (Transaction.t_date < cutoff)
+        ).with_for_update()
+        rows = await database.fetch_all(query)
+        if not rows:
+            return 0
+
+        for root in {row["branch"].split("/")[0] for row in rows}:
+            await get_opening_balance(uid, root, cutoff)
+
+        rows_by_year = defaultdict(list)
+        for row in rows:
+            rows_by_year[row["t_date"].year].append({column: row[column] for column in _COLUMNS})
+        files = await get_archived_files(uid)
+        written = await asyncio.to_thread(_stage_years, staged, uid, rows_by_year, files)
+
+        # Deleted without balance deltas: the rows still count, the checkpoints already hold them
+        tids = [row["tid"] for row in rows]
+        for start in range(0, len(tids), ARCHIVE_DELETE_CHUNK):
+            query = Transaction.__table__.delete().where(
+                (Transaction.uid == uid) & Transaction.tid.in_(tids[start:start + ARCHIVE_DELETE_CHUNK])
+            )
+            await database.execute(query)
+
+        now = datetime.utcnow()
+        for year, entry in written.items():
+            query = dialect_insert(ArchivePartition).values(
+                uid=uid, year=year, sealed_before=cutoff, archived_at=now, **entry
+            ).on_conflict_do_update(
+                index_elements=['uid', 'year'],
+                set_={**entry, 'sealed_before': cutoff, 'archived_at': now}
+            )
+            await database.execute(query)
+
+        await reset_sync_clients(uid)
+
+    return len(rows)
+
+
+async def archive_closed_years() -> dict:
+    cutoff = archive_cutoff(date.today())
+    query = select(Transaction.uid).where(Transaction.t_date < cutoff).distinct()
+    uids = [row["uid"] for row in await database.fetch_all(query)]
+
+    archived_users, archived_rows = 0, 0
+    for uid in uids:
+        try:
+            archived_rows += await archive_user(uid, cutoff)
+            archived_users += 1
+        except Exception as e:
+            print(f"Failed to archive closed years of user {uid}\n{str(e)}")
+
+    ARCHIVE_STATS["runs"] += 1
+    ARCHIVE_STATS["archived_users"] += archived_users
+    ARCHIVE_STATS["archived_rows"] += archived_rows
+    ARCHIVE_STATS["last_run_at"] = datetime.utcnow().isoformat()
+    print(f"[archive] cutoff={cutoff} users={archived_users} rows={archived_rows}")
+    return ARCHIVE_STATS
+
+
+# Rewrite every archive file with rows in the branch subtree. transform(table, mask) returns
+# the new table; returns {year: manifest entry} for the rewritten years.
+def _stage_subtree_rewrite(staged, uid: int, files: Dict[int, str], branch: str, transform: Callable) -> Dict[int, dict]:
+    written = {}
+    for year, old_file in files.items():
+        table = pq.read_table(open_archive_file(old_file))
+        mask = _subtree_mask(table, branch)
+        if not pc.any(mask).as_py():
+            continue
+        table = transform(table, mask)
+        written[year] = _manifest_entry(table, _stage(staged, uid, year, table, old_file))
+    return written
+
+
+def _renamed(table, mask, source: str, target: str):
+    branches = [
+        target + path[len(source):] if hit else path
+        for path, hit in zip(table.column("branch").to_pylist(), mask.to_pylist())
+    ]
+    return table.set_column(table.schema.get_field_index("branch"), "branch", pa.array(branches, pa.string()))
+
+
+# Inside archive_transaction(): rename a branch subtree in the archive files.
+# Returns True if any archived row moved (sync clients are reset then).
+async def stage_archived_branch_move(staged, uid: int, source: str, target: str) -> bool:
+    files = await get_archived_files(uid)
+    if not files:
+        return False
+    _require_pyarrow()
+    written = await asyncio.to_thread(
+        _stage_subtree_rewrite, staged, uid, files, source,
+        lambda table, mask: _renamed(table, mask, source, target),
+    )
+    await _point_manifest(uid, written)
+    if written:
+        await reset_sync_clients(uid)
+    return bool(written)
+
+
+# Delete a branch subtree's archived rows; returns them as {tid, receipt} dicts
+async def delete_archived_branch(uid: int, branch: str) -> List[dict]:
+    files = await get_archived_files(uid)
+    if not files:
+        return []
+    _require_pyarrow()
+
+    removed = []
+
+    def transform(table, mask):
+        removed.extend(table.filter(mask).select(["tid", "receipt"]).to_pylist())
+        return table.filter(pc.invert(mask))
+
+    async with archive_transaction() as staged:
+        written = await asyncio.to_thread(_stage_subtree_rewrite, staged, uid, files, branch, transform)
+        await _point_manifest(uid, written)
+    return removed
+
+
+def _delete_user_files(uid: int):
+    if ARCHIVE_DIR:
+        shutil.rmtree(os.path.join(ARCHIVE_DIR, str(uid)), True)
+        return
+    for blob in storage.bucket().list_blobs(prefix=f"{ARCHIVE_PREFIX}/{uid}/"):
+        blob.delete()
+
+
+# Remove a deleted account's archive files (manifest rows go with the account's DB rows)
+async def delete_user_archive(uid: int):
+    try:
+        await asyncio.to_thread(_delete_user_files, uid)
+    except Exception as e:
+        print(f"Failed to delete the archive files of user {uid}\n{str(e)}")
+
+
+# PostgreSQL: create the coming years' partitions when "transaction" is range-partitioned
+# (see query/partition_transaction_by_year.sql); a no-op on plain tables and SQLite
+async def ensure_year_partitions():
+    if DIALECT != POSTGRESQL:
+        return
+    if await database.fetch_val(_PARTITIONED_SQL) is None:
+        return
+
+    this_year = date.today().year
+    for year in range(this_year, this_year + PARTITION_YEARS_AHEAD + 1):
+        try:
+            await database.execute(
+                f'CREATE TABLE IF NOT EXISTS transaction_y{year} PARTITION OF "transaction" '
+                f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+            )
+        except Exception as e:
+            # e.g. the default partition already holds rows of that year
+            print(f"Failed to create the {year} transaction partition\n{str(e)}")
+
+
+async def _run_archiver():
+    while True:
+        try:
+            await archive_closed_years()
+        except Exception as e:
+            print(f"Failed to archive closed years\n{str(e)}")
+        await asyncio.sleep(ARCHIVE_INTERVAL_SECONDS)
+
+
+def start_archiver():
+    global _archive_task
+
+    if not ARCHIVE_ENABLED:
+        return None
+    if pq is None:
+        print("ARCHIVE_ENABLED is set but pyarrow is not installed; closed years stay in the transaction table")
+        return None
+    if not ARCHIVE_DIR and not os.getenv("FIREBASE_STORAGE_BUCKET"):
+        print("ARCHIVE_ENABLED is set but neither FIREBASE_STORAGE_BUCKET nor ARCHIVE_DIR is; closed years stay in the transaction table")
+        return None
+    if _archive_task is None or _archive_task.done():
+        _archive_task = asyncio.create_task(_run_archiver())
+    return _archive_task
+
+
+async def stop_archiver():
+    global _archive_task
+
+    if _archive_task is not None:
+        _archive_task.cancel()
+        try:
+            await _archive_task
+        except asyncio.CancelledError:
+            pass
+        _archive_task = None
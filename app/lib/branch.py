@@ -1,7 +1,12 @@
 # app/lib/branch.py
 
+from sqlalchemy import func, literal, select
+
+from app.db.crud import subtree_of
 from app.db.init import database
-from app.db.model import Branch
+from app.db.model import BalanceCheckpoint, Branch, Transaction
+from app.lib.archive import archive_transaction, stage_archived_branch_move
+from app.lib.change_log import BRANCH, TRANSACTION, UPSERT, record_changes
 
 # Check if the branch exists
 async def is_exist_branch(uid: str, branch: str):
@@ -19,3 +24,48 @@ async def delete_branch_bid(uid: str, bid_list: list):
         return await database.fetch_all(delete_query)
     except Exception as e:
         raise Exception(f"Failed to delete branch from PostgreSQL: {str(e)}")
+
+# True if any branch or transaction already lives at path or under it
+async def is_subtree_occupied(uid: str, path: str):
+    query = select(Branch.bid).where((Branch.uid == uid) & subtree_of(Branch.path, path)).limit(1)
+    if await database.fetch_one(query) is not None:
+        return True
+    query = select(Transaction.tid).where((Transaction.uid == uid) & subtree_of(Transaction.branch, path)).limit(1)
+    return await database.fetch_one(query) is not None
+
+# Rewrite the prefix of every path in a subtree with one UPDATE per table, in one DB transaction
+async def move_branch_subtree(uid: str, source: str, target: str):
+    def rewrite(column):
+        # target + the remainder after the source prefix ("" for the branch itself)
+        return literal(target) + func.substr(column, len(source) + 1)
+
+    branch_filter = (Branch.uid == uid) & subtree_of(Branch.path, source)
+    transaction_filter = (Transaction.uid == uid) & subtree_of(Transaction.branch, source)
+
+    async with archive_transaction() as staged:
+        # Counted up front instead of RETURNING so large subtrees don't ship every id back
+        branches = await database.fetch_val(select(func.count()).select_from(Branch).where(branch_filter))
+        transactions = await database.fetch_val(select(func.count()).select_from(Transaction).where(transaction_filter))
+
+        query = Branch.__table__.update().where(branch_filter).values(path=rewrite(Branch.path))
+        await database.execute(query)
+
+        query = Transaction.__table__.update().where(transaction_filter).values(branch=rewrite(Transaction.branch))
+        await database.execute(query)
+
+        # Checkpoints are per exact branch path, so they stay valid under the new name
+        query = BalanceCheckpoint.__table__.update().where(
+            (BalanceCheckpoint.uid == uid) & subtree_of(BalanceCheckpoint.branch, source)
+        ).values(branch=rewrite(BalanceCheckpoint.branch))
+        await database.execute(query)
+
+        # Archived years carry branch paths too; their files are swapped in at commit
+        await stage_archived_branch_move(staged, uid, source, target)
+
+        await record_changes(
+            uid,
+            (BRANCH, UPSERT, select(Branch.bid).where((Branch.uid == uid) & subtree_of(Branch.path, target))),
+            (TRANSACTION, UPSERT, select(Transaction.tid).where((Transaction.uid == uid) & subtree_of(Transaction.branch, target))),
+        )
+
+    return {"branches": branches, "transactions": transactions}
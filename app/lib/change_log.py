@@ -0,0 +1,165 @@
+# app/lib/change_log.py
+
+import os
+from datetime import datetime, timedelta
+from typing import Iterable, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+from sqlalchemy import BigInteger, Integer, String, and_, cast, func, literal, select
+from sqlalchemy.sql import Select
+
+from app.db.crud import dialect_insert
+from app.db.init import database
+from app.db.model import Auth, Branch, ChangeLog, SyncClient, Transaction
+from app.lib.data_version import bump_data_version
+
+# Load environment variables
+load_dotenv()
+
+# Clients that have not synced for this long lose their cursor and must reload
+SYNC_CLIENT_TTL_DAYS = int(os.getenv("SYNC_CLIENT_TTL_DAYS", "30"))
+SYNC_MAX_CHANGES = 1000
+
+TRANSACTION, BRANCH = "transaction", "branch"
+UPSERT, DELETE = "upsert", "delete"
+
+_ENTITY_TABLES = {
+    TRANSACTION: (Transaction.__table__, Transaction.__table__.c.tid),
+    BRANCH: (Branch.__table__, Branch.__table__.c.bid),
+}
+
+
+def _upsert_change(query):
+    # One row per (uid, entity, id): a newer change replaces the older one
+    return query.on_conflict_do_update(
+        index_elements=['uid', 'entity', 'entity_id'],
+        set_={'seq': query.excluded.seq, 'op': query.excluded.op}
+    )
+
+
+# Bump the user's data version and log each (entity, op, ids) entry at the new version.
+# ids is a list of ids or a SELECT of ids for set-based writes. The auth row stays locked
+# until the surrounding DB transaction commits, so sequences become visible in order.
+async def record_changes(uid: int, *entries: Tuple[str, str, Union[Iterable[int], Select]]) -> int:
+    async with database.transaction():
+        seq = await bump_data_version(uid)
+
+        for entity, op, ids in entries:
+            if isinstance(ids, Select):
+                # INSERT .. SELECT; casts keep PostgreSQL from typing the constants as text,
+                # and the WHERE avoids SQLite's ON CONFLICT parsing ambiguity
+                source = ids.subquery()
+                rows = select(
+                    cast(literal(uid), Integer),
+                    cast(literal(seq), BigInteger),
+                    cast(literal(entity), String),
+                    source.c[0],
+                    cast(literal(op), String),
+                ).where(source.c[0].isnot(None))
+                query = dialect_insert(ChangeLog).from_select(['uid', 'seq', 'entity', 'entity_id', 'op'], rows)
+                await database.execute(_upsert_change(query))
+                continue
+
+            values = [
+                {"uid": uid, "seq": seq, "entity": entity, "entity_id": entity_id, "op": op}
+                for entity_id in dict.fromkeys(ids)
+            ]
+            if values:
+                await database.execute_many(query=_upsert_change(dialect_insert(ChangeLog)), values=values)
+
+    return seq
+
+
+async def _remember_cursor(uid: int, client_id: str, cursor: int):
+    now = datetime.utcnow()
+    query = dialect_insert(SyncClient).values(uid=uid, client_id=client_id, last_seq=cursor, updated_at=now)
+    query = query.on_conflict_do_update(
+        index_elements=['uid', 'client_id'],
+        set_={'last_seq': cursor, 'updated_at': now}
+    )
+    await database.execute(query)
+
+
+# Changes after `since`, whole sequences at a time, with the current rows for upserts.
+# since=None (first sync), a compacted cursor, or a single write with more than `limit`
+# changes (e.g. a large branch move) answers reset=True: reload, then sync from `version`.
+async def get_changes(uid: int, client_id: str, since: Optional[int], limit: int = SYNC_MAX_CHANGES) -> dict:
+    # Read before the log so the returned cursor never runs ahead of the rows
+    auth = await database.fetch_one(select(Auth.data_version, Auth.change_floor).where(Auth.uid == uid))
+    version, floor = auth["data_version"], auth["change_floor"]
+
+    def reset():
+        return {"version": version, "reset": True, "has_more": False, "changes": []}
+
+    if since is None or since < floor:
+        await _remember_cursor(uid, client_id, version)
+        return reset()
+
+    after = (ChangeLog.uid == uid) & (ChangeLog.seq > since)
+    # Seq of the first change past `limit`: every earlier seq fits on the page whole,
+    # this one may not. The page never splits one write's changes.
+    boundary = await database.fetch_val(
+        select(ChangeLog.seq).where(after).order_by(ChangeLog.seq).offset(limit).limit(1)
+    )
+    condition = after if boundary is None else and_(after, ChangeLog.seq < boundary)
+    rows = await database.fetch_all(
+        select(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id, ChangeLog.op)
+        .where(condition)
+        .order_by(ChangeLog.seq, ChangeLog.entity, ChangeLog.entity_id)
+    )
+    if boundary is not None and not rows:
+        # The next write alone is larger than a page
+        await _remember_cursor(uid, client_id, version)
+        return reset()
+    await _remember_cursor(uid, client_id, since)
+
+    # Current state of every upserted entity, joined to the page's log rows so the
+    # query carries no per-id bind parameters
+    data = {}
+    for entity, (table, key) in _ENTITY_TABLES.items():
+        if not any(row["entity"] == entity and row["op"] == UPSERT for row in rows):
+            continue
+        query = (
+            select(table)
+            .join(ChangeLog, (ChangeLog.entity_id == key) & (ChangeLog.entity == entity))
+            .where(condition & (ChangeLog.op == UPSERT) & (table.c.uid == uid))
+        )
+        data[entity] = {item[key.name]: item for item in await database.fetch_all(query)}
+
+    changes = []
+    for row in rows:
+        item = data.get(row["entity"], {}).get(row["entity_id"]) if row["op"] == UPSERT else None
+        changes.append({
+            "seq": row["seq"],
+            "entity": row["entity"],
+            "id": row["entity_id"],
+            # An upsert whose row is already gone is reported as a tombstone
+            "op": UPSERT if item is not None else DELETE,
+            "data": item,
+        })
+
+    has_more = boundary is not None
+    if has_more:
+        version = rows[-1]["seq"]
+    elif rows:
+        version = max(version, rows[-1]["seq"])
+    return {"version": version, "reset": False, "has_more": has_more, "changes": changes}
+
+
+# Drop idle clients and raise each user's floor to the oldest live cursor (or the current
+# version when nobody is syncing); log rows at or below the floor can then be deleted.
+async def advance_change_floors(now: datetime):
+    await database.execute(
+        SyncClient.__table__.delete().where(SyncClient.updated_at < now - timedelta(days=SYNC_CLIENT_TTL_DAYS))
+    )
+
+    oldest_cursor = select(func.min(SyncClient.last_seq)).where(SyncClient.uid == Auth.uid).scalar_subquery()
+    new_floor = func.coalesce(oldest_cursor, Auth.data_version)
+    await database.execute(
+        Auth.__table__.update().where(new_floor > Auth.change_floor).values(change_floor=new_floor)
+    )
+
+
+def compacted_condition():
+    floor = select(Auth.change_floor).where(Auth.uid == ChangeLog.uid).scalar_subquery()
+    return ChangeLog.seq <= floor
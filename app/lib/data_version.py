@@ -0,0 +1,68 @@
+# app/lib/data_version.py
+
+import hashlib
+
+from fastapi import HTTPException, Request, status
+from sqlalchemy import select
+
+from app.db.init import database
+from app.db.model import Auth, FxRateVersion
+from app.lib.fx import sync_fx_version
+
+# Clients may keep the body but must revalidate it with If-None-Match
+ETAG_CACHE_CONTROL = "private, no-cache"
+
+
+async def get_data_version(uid: int) -> int:
+    query = select(Auth.data_version).where(Auth.uid == uid)
+    return await database.fetch_val(query) or 0
+
+
+# Called for every write once its change is stored (entity writes go through record_changes)
+async def bump_data_version(uid: int) -> int:
+    query = Auth.__table__.update().where(Auth.uid == uid).values(
+        data_version=Auth.data_version + 1
+    ).returning(Auth.data_version)
+    return await database.fetch_val(query)
+
+
+# The user's data version and the FX rate version in one read; responses convert
+# amounts, so a rate import has to change their ETags too
+async def get_etag_version(uid: int) -> str:
+    fx_version = select(FxRateVersion.version).where(FxRateVersion.id == 1).scalar_subquery()
+    query = select(Auth.data_version, fx_version.label("fx_version")).where(Auth.uid == uid)
+    row = await database.fetch_one(query)
+    if row is None:
+        return "0.0"
+    sync_fx_version(row["fx_version"] or 0)
+    return f"{row['data_version'] or 0}.{row['fx_version'] or 0}"
+
+
+# Weak ETag from the user's data and FX versions and the exact request (path + query string)
+def make_etag(uid: int, version: str, request: Request) -> str:
+    key = f"{uid}:{request.url.path}?{request.url.query}".encode("utf-8")
+    return f'W/"{version}-{hashlib.sha1(key).hexdigest()[:16]}"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison: W/ prefixes are ignored on both sides
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag.removeprefix("W/") in candidates
+
+
+def etag_headers(etag: str) -> dict:
+    return {"ETag": etag, "Cache-Control": ETAG_CACHE_CONTROL}
+
+
+# Answer If-None-Match with 304 from the versions alone; otherwise return the ETag for the response.
+# The versions are read before the data, so a concurrent write can only make the ETag older, never newer.
+async def check_etag(request: Request, uid: int) -> str:
+    version = await get_etag_version(uid)
+    etag = make_etag(uid, version, request)
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        raise HTTPException(status_code=status.HTTP_304_NOT_MODIFIED, headers=etag_headers(etag))
+    return etag
@@ -0,0 +1,367 @@
+# app/lib/dataset.py
+
+import asyncio
+import json
+import os
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import AsyncIterator, BinaryIO, Dict, List
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from sqlalchemy import select
+
+from app.db.crud import get_tree_postgre
+from app.db.init import DIALECT, POSTGRESQL, database
+from app.db.model import BalanceCheckpoint, Branch, ReceiptBlob, Transaction
+from app.lib.archive import (
+    arrow_branch_monthly,
+    get_archived_files,
+    open_archive_file,
+    reset_sync_clients,
+    transaction_arrow_schema,
+)
+from app.lib.data_version import get_data_version
+from app.lib.fx import get_display_currency
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+except ImportError:  # optional; export and import answer 501 without it
+    pa = pc = pq = None
+
+# Load environment variables
+load_dotenv()
+
+DATASET_BATCH_ROWS = int(os.getenv("DATASET_BATCH_ROWS", "50000"))
+DATASET_INSERT_CHUNK = 1000
+DATASET_COMPRESSION = os.getenv("DATASET_COMPRESSION", "zstd")
+
+# format -> (media type, file suffix)
+DATASET_FORMATS = {
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.stream", "arrows"),
+}
+
+# Schema metadata keys
+BRANCHES_KEY = "finance_tree.branches"
+VERSION_KEY = "finance_tree.data_version"
+
+_PATH_PATTERN = r"^[^/]+(/[^/]+)*$"
+_CURRENCY_PATTERN = r"^[A-Z]{3}$"
+BRANCH_MAX_LENGTH = 255
+# transaction.cashflow is a 32-bit INTEGER column
+CASHFLOW_MIN, CASHFLOW_MAX = -(2 ** 31), 2 ** 31 - 1
+
+
+def ensure_dataset_support():
+    if pq is None:
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Dataset export and import need pyarrow installed on the server.",
+        )
+
+
+# File-like sink that hands written bytes back in pieces; tell() keeps counting across drains
+# because the Parquet writer records absolute offsets in its footer.
+class _ChunkSink:
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._chunks.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _open_writer(sink: _ChunkSink, schema, fmt: str):
+    if fmt == "parquet":
+        return pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema, compression=DATASET_COMPRESSION)
+    options = pa.ipc.IpcWriteOptions(compression=DATASET_COMPRESSION)
+    return pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema, options=options)
+
+
+async def _archived_batches(files: Dict[int, str], schema) -> AsyncIterator:
+    for name in files.values():
+        parquet = await asyncio.to_thread(lambda: pq.ParquetFile(open_archive_file(name)))
+        batches = parquet.iter_batches(batch_size=DATASET_BATCH_ROWS)
+        while True:
+            batch = await asyncio.to_thread(next, batches, None)
+            if batch is None:
+                break
+            yield pa.Table.from_batches([batch]).cast(schema)
+
+
+async def _hot_batches(uid: int, schema) -> AsyncIterator:
+    names = schema.names
+    table = Transaction.__table__
+    query = (
+        select(*[table.c[name] for name in names])
+        .where(table.c.uid == uid)
+        .order_by(table.c.t_date, table.c.tid)
+    )
+    columns = {name: [] for name in names}
+    count = 0
+    async for row in database.iterate(query):
+        for name in names:
+            columns[name].append(row[name])
+        count += 1
+        if count >= DATASET_BATCH_ROWS:
+            yield pa.Table.from_pydict(columns, schema=schema)
+            columns = {name: [] for name in names}
+            count = 0
+    if count:
+        yield pa.Table.from_pydict(columns, schema=schema)
+
+
+# Stream the user's transactions (archived years first) as Parquet or an Arrow IPC stream,
+# DATASET_BATCH_ROWS at a time. Branch paths and the data version ride in the schema metadata.
+# Everything is read in one DB transaction (one snapshot on PostgreSQL), so an archive run
+# moving rows into the files meanwhile can neither duplicate nor drop any.
+async def export_dataset(uid: int, fmt: str) -> AsyncIterator[bytes]:
+    options = {"isolation": "repeatable_read"} if DIALECT == POSTGRESQL else {}
+    async with database.transaction(**options):
+        # Manifest first: it starts the snapshot and locks the files it names in place
+        files = await get_archived_files(uid, for_share=True)
+        branches = [row["path"] for row in await get_tree_postgre(uid)]
+        version = await get_data_version(uid)
+        schema = transaction_arrow_schema().with_metadata({
+            BRANCHES_KEY: json.dumps(branches),
+            VERSION_KEY: str(version),
+        })
+
+        sink = _ChunkSink()
+        writer = await asyncio.to_thread(_open_writer, sink, schema, fmt)
+        for source in (_archived_batches(files, schema), _hot_batches(uid, schema)):
+            async for table in source:
+                await asyncio.to_thread(writer.write_table, table)
+                yield sink.drain()
+        await asyncio.to_thread(writer.close)
+        yield sink.drain()
+
+
+# Parquet, Arrow IPC file or Arrow IPC stream, told apart by their magic bytes
+def _open_reader(file: BinaryIO):
+    magic = file.read(6)
+    file.seek(0)
+    if magic[:4] == b"PAR1":
+        parquet = pq.ParquetFile(file)
+        return parquet.schema_arrow, parquet.iter_batches(batch_size=DATASET_BATCH_ROWS)
+    if magic == b"ARROW1":
+        reader = pa.ipc.open_file(file)
+        return reader.schema, (reader.get_batch(i) for i in range(reader.num_record_batches))
+    reader = pa.ipc.open_stream(file)
+    return reader.schema, iter(reader)
+
+
+def _fail_rows(mask, offset: int, message: str):
+    mask = pc.fill_null(mask, True)
+    if pc.any(mask).as_py():
+        raise ValueError(f"Row {offset + pc.index(mask, True).as_py()}: {message}")
+
+
+def _optional_column(table, name: str, type_):
+    if name not in table.column_names:
+        return pa.nulls(table.num_rows, type_)
+    return pc.cast(table.column(name), type_)
+
+
+# Validate and normalise one batch with Arrow kernels; raises ValueError naming the first bad row.
+# tid is ignored (rows get new ids); currency defaults to the user's display currency.
+def _validate_batch(batch, offset: int, default_currency: str):
+    table = pa.Table.from_batches([batch])
+    for name in ("t_date", "branch", "cashflow"):
+        if name not in table.column_names:
+            raise ValueError(f"Missing column: {name}")
+
+    try:
+        t_date = table.column("t_date")
+        if pa.types.is_string(t_date.type) or pa.types.is_large_string(t_date.type):
+            t_date = pc.strptime(t_date, format="%Y-%m-%d", unit="s", error_is_null=True)
+        t_date = pc.cast(t_date, pa.date32())
+        cashflow = pc.cast(table.column("cashflow"), pa.int64())
+        branch = pc.cast(table.column("branch"), pa.string())
+        currency = _optional_column(table, "currency", pa.string())
+        description = _optional_column(table, "description", pa.string())
+        receipt = _optional_column(table, "receipt", pa.string())
+        c_date = _optional_column(table, "c_date", pa.timestamp("us"))
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+        raise ValueError(f"Unsupported column type ({str(e)})")
+
+    _fail_rows(pc.is_null(t_date), offset, "t_date is missing or not a YYYY-MM-DD date.")
+    _fail_rows(
+        pc.or_(pc.less(cashflow, CASHFLOW_MIN), pc.greater(cashflow, CASHFLOW_MAX)),
+        offset, "cashflow is missing or out of range.",
+    )
+    _fail_rows(pc.invert(pc.match_substring_regex(branch, _PATH_PATTERN)), offset, "branch is not a valid path.")
+    _fail_rows(pc.greater(pc.utf8_length(branch), BRANCH_MAX_LENGTH), offset, "branch is too long.")
+
+    currency = pc.fill_null(pc.utf8_upper(pc.utf8_trim_whitespace(currency)), default_currency)
+    _fail_rows(
+        pc.invert(pc.match_substring_regex(currency, _CURRENCY_PATTERN)),
+        offset, "currency must be a 3-letter ISO 4217 code.",
+    )
+
+    return pa.table({
+        "t_date": t_date,
+        "branch": branch,
+        "cashflow": cashflow,
+        "currency": currency,
+        "description": description,
+        "receipt": receipt,
+        "c_date": pc.fill_null(c_date, pa.scalar(datetime.utcnow(), pa.timestamp("us"))),
+    })
+
+
+# Keep receipts the user still owns (taking a reference per row); others are dropped,
+# since a file name from another account or a purged blob points at nothing
+async def _claim_receipts(uid: int, table):
+    receipts = table.column("receipt")
+    names = [name for name in pc.unique(receipts).to_pylist() if name]
+    if not names:
+        return table
+
+    owned = []
+    for start in range(0, len(names), DATASET_INSERT_CHUNK):
+        query = select(ReceiptBlob.file_name).where(
+            (ReceiptBlob.uid == uid) &
+            ReceiptBlob.file_name.in_(names[start:start + DATASET_INSERT_CHUNK]) &
+            (ReceiptBlob.ref_count > 0)
+        )
+        owned += [row["file_name"] for row in await database.fetch_all(query)]
+    receipts = pc.if_else(
+        pc.is_in(receipts, value_set=pa.array(owned, pa.string())),
+        receipts,
+        pa.scalar(None, pa.string()),
+    )
+
+    by_amount = defaultdict(list)
+    for name, amount in Counter(name for name in receipts.to_pylist() if name).items():
+        by_amount[amount].append(name)
+    for amount, group in by_amount.items():
+        query = ReceiptBlob.__table__.update().where(
+            (ReceiptBlob.uid == uid) & ReceiptBlob.file_name.in_(group)
+        ).values(ref_count=ReceiptBlob.ref_count + amount)
+        await database.execute(query)
+
+    return table.set_column(table.schema.get_field_index("receipt"), "receipt", receipts)
+
+
+async def _insert_rows(uid: int, table):
+    rows = table.to_pylist()
+    for start in range(0, len(rows), DATASET_INSERT_CHUNK):
+        chunk = [dict(row, uid=uid) for row in rows[start:start + DATASET_INSERT_CHUNK]]
+        await database.execute(Transaction.__table__.insert().values(chunk))
+
+
+def _with_ancestors(paths) -> set:
+    result = set()
+    for path in paths:
+        parts = path.split("/")
+        result.update("/".join(parts[:depth]) for depth in range(1, len(parts) + 1))
+    return result
+
+
+# Shift each existing checkpoint by the imported rows before its period, one UPDATE per checkpoint.
+# monthly: (branch, currency, month start) -> imported sum
+async def _shift_checkpoints(checkpoints, monthly: Dict[tuple, int]):
+    by_key = defaultdict(list)
+    for (branch, currency, month), amount in monthly.items():
+        by_key[(branch, currency)].append((month, amount))
+
+    for checkpoint in checkpoints:
+        delta = sum(
+            amount for month, amount in by_key.get((checkpoint["branch"], checkpoint["currency"]), ())
+            if month < checkpoint["period"]
+        )
+        if delta:
+            query = BalanceCheckpoint.__table__.update().where(
+                BalanceCheckpoint.cpid == checkpoint["cpid"]
+            ).values(balance=BalanceCheckpoint.balance + delta)
+            await database.execute(query)
+
+
+# Append every row of an exported dataset to the user's account in one DB transaction:
+# batches are validated with Arrow kernels and inserted DATASET_INSERT_CHUNK rows per statement,
+# missing branches (and their parents) are created under the user's existing roots, and
+# checkpoints are shifted once at the end. Sync clients reload afterwards.
+async def import_dataset(uid: int, file: BinaryIO) -> dict:
+    try:
+        schema, batches = await asyncio.to_thread(_open_reader, file)
+    except pa.ArrowException as e:
+        raise ValueError(f"Not a Parquet or Arrow file ({str(e)})")
+
+    try:
+        listed = json.loads((schema.metadata or {}).get(BRANCHES_KEY.encode(), b"[]"))
+    except ValueError:
+        raise ValueError("Invalid branch list in the file metadata.")
+    if not isinstance(listed, list) or not all(isinstance(path, str) for path in listed):
+        raise ValueError("Invalid branch list in the file metadata.")
+
+    default_currency = await get_display_currency(uid)
+    existing = {row["path"] for row in await get_tree_postgre(uid)}
+    roots = {path.split("/")[0] for path in existing}
+    checkpoints = await database.fetch_all(
+        select(BalanceCheckpoint.cpid, BalanceCheckpoint.branch, BalanceCheckpoint.currency, BalanceCheckpoint.period)
+        .where(BalanceCheckpoint.uid == uid)
+    )
+
+    paths = set(listed)
+    monthly = defaultdict(int)
+    imported = 0
+    async with database.transaction():
+        while True:
+            try:
+                batch = await asyncio.to_thread(next, batches, None)
+            except pa.ArrowException as e:
+                raise ValueError(f"Corrupt batch after row {imported} ({str(e)})")
+            if batch is None:
+                break
+
+            table = await asyncio.to_thread(_validate_batch, batch, imported, default_currency)
+            batch_paths = set(pc.unique(table.column("branch")).to_pylist())
+            unknown_roots = {path.split("/")[0] for path in batch_paths} - roots
+            if unknown_roots:
+                raise ValueError(f"Unknown root branch - {sorted(unknown_roots)[0]}")
+            paths.update(batch_paths)
+
+            table = await _claim_receipts(uid, table)
+            await _insert_rows(uid, table)
+            if checkpoints:
+                for row in await asyncio.to_thread(arrow_branch_monthly, table):
+                    month = datetime.strptime(row["monthly"], "%Y-%m").date()
+                    monthly[(row["branch"], row["currency"], month)] += row["income"] + row["expenditure"]
+            imported += table.num_rows
+
+        for path in paths:
+            if len(path) > BRANCH_MAX_LENGTH or any(not part for part in path.split("/")):
+                raise ValueError(f"Invalid branch path - {path}")
+            if path.split("/")[0] not in roots:
+                raise ValueError(f"Unknown root branch - {path.split('/')[0]}")
+        missing = sorted(_with_ancestors(paths) - existing)
+        if missing:
+            await database.execute(Branch.__table__.insert().values([{"uid": uid, "path": path} for path in missing]))
+
+        await _shift_checkpoints(checkpoints, monthly)
+        # One version bump instead of a change log entry per imported row
+        await reset_sync_clients(uid)
+
+    return {"transactions": imported, "branches": len(missing)}
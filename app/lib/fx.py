@@ -0,0 +1,254 @@
+# app/lib/fx.py
+
+import calendar
+import csv
+import io
+import os
+import re
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+from cachetools import TTLCache
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+from sqlalchemy import select
+
+from app.db.crud import dialect_insert
+from app.db.init import database
+from app.db.model import Auth, FxRate, FxRateVersion
+
+# Load environment variables
+load_dotenv()
+
+# Rates are stored per currency against one base currency; a pair is the ratio of two rates
+FX_BASE_CURRENCY = os.getenv("FX_BASE_CURRENCY", "USD")
+# Days without a rate (weekends, holidays) use the latest earlier rate up to this age
+FX_MAX_STALE_DAYS = int(os.getenv("FX_MAX_STALE_DAYS", "7"))
+FX_CACHE_SIZE = int(os.getenv("FX_CACHE_SIZE", "100000"))
+FX_CACHE_TTL_SECONDS = int(os.getenv("FX_CACHE_TTL_SECONDS", "3600"))
+# Optional CSV (date,currency,rate) loaded into fx_rate on startup
+FX_RATES_FILE = os.getenv("FX_RATES_FILE")
+
+# (date, from_currency, to_currency) -> multiplier
+_pair_cache: TTLCache = TTLCache(maxsize=FX_CACHE_SIZE, ttl=FX_CACHE_TTL_SECONDS)
+# fx_rate_version the pair cache was filled under; an import on another instance clears it
+_pair_cache_version = None
+
+
+def normalize_currency(code: str) -> str:
+    code = (code or "").strip().upper()
+    if not re.fullmatch(r"[A-Z]{3}", code):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid currency code. Must be a 3-letter ISO 4217 code.",
+        )
+    return code
+
+
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+async def get_display_currency(uid: int) -> str:
+    query = select(Auth.display_currency).where(Auth.uid == uid)
+    return await database.fetch_val(query) or "CAD"
+
+
+# Upsert daily rates; rows: (rate_date, currency, units of currency per base unit)
+async def import_fx_rates(rows: Iterable[Tuple[date, str, float]]) -> int:
+    values = [
+        {"rate_date": _as_date(rate_date), "currency": normalize_currency(currency), "rate": float(rate)}
+        for rate_date, currency, rate in rows
+    ]
+    if not values:
+        return 0
+
+    query = dialect_insert(FxRate)
+    query = query.on_conflict_do_update(
+        index_elements=['currency', 'rate_date'],
+        set_={'rate': query.excluded.rate}
+    )
+    async with database.transaction():
+        await database.execute_many(query=query, values=values)
+        sync_fx_version(await bump_fx_version())
+    return len(values)
+
+
+async def bump_fx_version() -> int:
+    query = dialect_insert(FxRateVersion).values(id=1, version=1).on_conflict_do_update(
+        index_elements=['id'],
+        set_={'version': FxRateVersion.version + 1}
+    ).returning(FxRateVersion.version)
+    return await database.fetch_val(query)
+
+
+# Drop cached pairs once the rate tables have changed (version read alongside the ETag)
+def sync_fx_version(version: int):
+    global _pair_cache_version
+    if version != _pair_cache_version:
+        _pair_cache.clear()
+        _pair_cache_version = version
+
+
+def parse_fx_csv(text: str) -> List[Tuple[date, str, float]]:
+    rows = []
+    for record in csv.reader(io.StringIO(text)):
+        if not record or record[0].strip().lower() in ("date", "rate_date"):
+            continue
+        rows.append((
+            datetime.strptime(record[0].strip(), "%Y-%m-%d").date(),
+            record[1],
+            float(record[2]),
+        ))
+    return rows
+
+
+async def load_fx_rates_file(path: str = FX_RATES_FILE) -> int:
+    if not path or not os.path.exists(path):
+        return 0
+    with open(path, "r", encoding="utf-8") as fp:
+        return await import_fx_rates(parse_fx_csv(fp.read()))
+
+
+# Per-currency (day ordinals, rates) series covering [begin - FX_MAX_STALE_DAYS, end], one query
+async def _load_series(currencies: Sequence[str], begin: date, end: date) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    query = (
+        select(FxRate.currency, FxRate.rate_date, FxRate.rate)
+        .where(
+            (FxRate.currency.in_(list(currencies))) &
+            (FxRate.rate_date.between(begin - timedelta(days=FX_MAX_STALE_DAYS), end))
+        )
+        .order_by(FxRate.currency, FxRate.rate_date)
+    )
+    grouped: Dict[str, Tuple[list, list]] = {}
+    for row in await database.fetch_all(query):
+        days, rates = grouped.setdefault(row['currency'], ([], []))
+        days.append(_as_date(row['rate_date']).toordinal())
+        rates.append(row['rate'])
+
+    return {
+        currency: (np.asarray(days, dtype=np.int64), np.asarray(rates, dtype=np.float64))
+        for currency, (days, rates) in grouped.items()
+    }
+
+
+# Rate in effect on each day (latest at or before it, within FX_MAX_STALE_DAYS); NaN when missing
+def _rates_as_of(series, days: np.ndarray) -> np.ndarray:
+    if series is None or series[0].size == 0:
+        return np.full(days.shape, np.nan)
+    series_days, series_rates = series
+    idx = np.searchsorted(series_days, days, side="right") - 1
+    found = idx >= 0
+    idx = np.where(found, idx, 0)
+    rates = series_rates[idx]
+    fresh = found & (days - series_days[idx] <= FX_MAX_STALE_DAYS)
+    return np.where(fresh, rates, np.nan)
+
+
+# Multipliers for (day ordinal, from currency) keys into to_currency; NaN where no rate
+# exists. Only resolved pairs go into the pair cache.
+async def _resolve_factors(days: np.ndarray, from_currencies: np.ndarray, to_currency: str) -> np.ndarray:
+    factors = np.empty(days.shape[0], dtype=np.float64)
+    missing = []
+    for i, (day, currency) in enumerate(zip(days.tolist(), from_currencies.tolist())):
+        cached = _pair_cache.get((day, currency, to_currency))
+        if cached is None:
+            missing.append(i)
+        else:
+            factors[i] = cached
+
+    if missing:
+        missing = np.asarray(missing, dtype=np.int64)
+        miss_days = days[missing]
+        miss_currencies = from_currencies[missing]
+        needed = (set(miss_currencies.tolist()) | {to_currency}) - {FX_BASE_CURRENCY}
+        series = await _load_series(
+            sorted(needed),
+            date.fromordinal(int(miss_days.min())),
+            date.fromordinal(int(miss_days.max())),
+        )
+
+        def base_rates(currency: str, at: np.ndarray) -> np.ndarray:
+            if currency == FX_BASE_CURRENCY:
+                return np.ones(at.shape)
+            return _rates_as_of(series.get(currency), at)
+
+        to_rates = base_rates(to_currency, miss_days)
+        for currency in set(miss_currencies.tolist()):
+            mask = miss_currencies == currency
+            factors[missing[mask]] = to_rates[mask] / base_rates(currency, miss_days[mask])
+
+        for day, currency, factor in zip(miss_days.tolist(), miss_currencies.tolist(), factors[missing].tolist()):
+            if not np.isnan(factor):
+                _pair_cache[(day, currency, to_currency)] = factor
+
+    return factors
+
+
+# Convert integer amounts into to_currency at each row's date; one cache/DB pass per distinct (date, currency).
+# Returns (amounts, missing): amounts without a rate are left in their stored currency and flagged in missing.
+async def convert_amounts(amounts, currencies, dates, to_currency: str) -> Tuple[np.ndarray, np.ndarray]:
+    amounts = np.asarray(amounts, dtype=np.int64)
+    currencies = np.asarray(currencies, dtype=object)
+    missing = np.zeros(amounts.shape[0], dtype=bool)
+    foreign = np.nonzero(currencies != to_currency)[0]
+    if foreign.size == 0:
+        return amounts, missing
+
+    days = np.fromiter((_as_date(dates[i]).toordinal() for i in foreign), dtype=np.int64, count=foreign.size)
+    codes, code_idx = np.unique(currencies[foreign].astype(str), return_inverse=True)
+    keys, inverse = np.unique(days * len(codes) + code_idx, return_inverse=True)
+
+    factors = await _resolve_factors(keys // len(codes), codes[keys % len(codes)], to_currency)
+    row_factors = factors[inverse]
+    unresolved = np.isnan(row_factors)
+    missing[foreign] = unresolved
+
+    converted = amounts.copy()
+    converted[foreign] = np.where(
+        unresolved, amounts[foreign], np.rint(amounts[foreign] * np.nan_to_num(row_factors))
+    ).astype(np.int64)
+    return converted, missing
+
+
+# Transaction rows as dicts with cashflow in to_currency; the stored amount is kept as original_*.
+# Rows without a rate keep their stored currency and carry fx_missing=True instead of failing the read.
+async def convert_rows(rows, to_currency: str) -> List[dict]:
+    items = [dict(row._mapping) if hasattr(row, "_mapping") else dict(row) for row in rows]
+    if not items:
+        return items
+
+    currencies = [item['currency'] for item in items]
+    amounts = [item['cashflow'] for item in items]
+    converted, missing = await convert_amounts(amounts, currencies, [item['t_date'] for item in items], to_currency)
+
+    for item, cashflow, fx_missing in zip(items, converted.tolist(), missing.tolist()):
+        item['original_cashflow'] = item['cashflow']
+        item['original_currency'] = item['currency']
+        item['cashflow'] = cashflow
+        item['currency'] = item['currency'] if fx_missing else to_currency
+        item['fx_missing'] = fx_missing
+    return items
+
+
+# Per-currency balances summed in to_currency at the rate of `at`.
+# Returns (total, unconverted): balances without a rate are left out of the total and returned as-is.
+async def convert_balances(balances: Dict[str, int], at, to_currency: str) -> Tuple[int, Dict[str, int]]:
+    if not balances:
+        return 0, {}
+    currencies = list(balances)
+    converted, missing = await convert_amounts(
+        [balances[currency] for currency in currencies], currencies, [at] * len(currencies), to_currency
+    )
+    unconverted = {currency: balances[currency] for currency, flag in zip(currencies, missing.tolist()) if flag}
+    return int(converted[~missing].sum()), unconverted
+
+
+# Last day of a 'YYYY-MM' period, capped at `end`
+def period_end(monthly: str, end: date) -> date:
+    year, month = (int(part) for part in monthly.split("-"))
+    last = date(year, month, calendar.monthrange(year, month)[1])
+    return min(last, end)
@@ -0,0 +1,148 @@
+# app/lib/ledger.py
+
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Tuple
+
+from sqlalchemy import and_, func, or_, select
+
+from app.db.crud import dialect_insert
+from app.db.init import database
+from app.db.model import BalanceCheckpoint, Transaction
+
+
+def _as_date(value) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+def _month_start(value: date) -> date:
+    return value.replace(day=1)
+
+
+def _subtree(column, branch: str):
+    return or_(column == branch, column.like(f"{branch}/%"))
+
+
+# Shift every checkpoint after t_date by the cashflow change of a write.
+# items: (branch, currency, t_date, delta); one set-based UPDATE per distinct (branch, currency, date).
+async def apply_balance_deltas(uid: int, items: Iterable[Tuple[str, str, date, int]]):
+    grouped = defaultdict(int)
+    for branch, currency, t_date, delta in items:
+        if branch and delta:
+            grouped[(branch, currency, _as_date(t_date))] += delta
+
+    for (branch, currency, t_date), delta in grouped.items():
+        if not delta:
+            continue
+        query = BalanceCheckpoint.__table__.update().where(
+            (BalanceCheckpoint.uid == uid) &
+            (BalanceCheckpoint.branch == branch) &
+            (BalanceCheckpoint.currency == currency) &
+            (BalanceCheckpoint.period > t_date)
+        ).values(balance=BalanceCheckpoint.balance + delta)
+        await database.execute(query)
+
+
+# Drop checkpoints of branches that no longer exist
+async def delete_branch_checkpoints(uid: int, branches: List[str]):
+    if not branches:
+        return
+    query = BalanceCheckpoint.__table__.delete().where(
+        (BalanceCheckpoint.uid == uid) &
+        (BalanceCheckpoint.branch.in_(branches))
+    )
+    await database.execute(query)
+
+
+# Subtree balance per currency before `begin`: latest checkpoint per (branch, currency) plus
+# the rows after it. A checkpoint for begin's month is stored on the way so the next read starts there.
+async def get_opening_balance(uid: int, branch: str, begin) -> Dict[str, int]:
+    begin = _as_date(begin)
+    period = _month_start(begin)
+    c = BalanceCheckpoint.__table__
+    t = Transaction.__table__
+
+    async with database.transaction():
+        latest_period = (
+            select(c.c.branch, c.c.currency, func.max(c.c.period).label('period'))
+            .where((c.c.uid == uid) & _subtree(c.c.branch, branch) & (c.c.period <= period))
+            .group_by(c.c.branch, c.c.currency)
+            .subquery()
+        )
+        latest = (
+            select(c.c.branch, c.c.currency, c.c.period, c.c.balance)
+            .select_from(c.join(latest_period, and_(
+                c.c.branch == latest_period.c.branch,
+                c.c.currency == latest_period.c.currency,
+                c.c.period == latest_period.c.period,
+            )))
+            .where(c.c.uid == uid)
+        )
+        balances = {
+            (row['branch'], row['currency']): row['balance']
+            for row in await database.fetch_all(latest)
+        }
+
+        # Rows between each checkpoint (or the beginning of time) and the month start
+        latest_sub = latest.subquery()
+        uncovered = (
+            select(t.c.branch, t.c.currency, func.sum(t.c.cashflow).label('amount'))
+            .select_from(t.outerjoin(latest_sub, and_(
+                t.c.branch == latest_sub.c.branch,
+                t.c.currency == latest_sub.c.currency,
+            )))
+            .where(
+                (t.c.uid == uid) &
+                _subtree(t.c.branch, branch) &
+                (t.c.t_date < period) &
+                or_(latest_sub.c.period.is_(None), t.c.t_date >= latest_sub.c.period)
+            )
+            .group_by(t.c.branch, t.c.currency)
+        )
+        for row in await database.fetch_all(uncovered):
+            key = (row['branch'], row['currency'])
+            balances[key] = balances.get(key, 0) + (row['amount'] or 0)
+
+            query = dialect_insert(BalanceCheckpoint).values(
+                uid=uid, branch=row['branch'], currency=row['currency'], period=period, balance=balances[key]
+            ).on_conflict_do_update(
+                index_elements=['uid', 'branch', 'currency', 'period'],
+                set_={'balance': balances[key]}
+            )
+            await database.execute(query)
+
+        # Rows of begin's month before begin
+        head = (
+            select(t.c.currency, func.sum(t.c.cashflow).label('amount'))
+            .where(
+                (t.c.uid == uid) &
+                _subtree(t.c.branch, branch) &
+                (t.c.t_date >= period) &
+                (t.c.t_date < begin)
+            )
+            .group_by(t.c.currency)
+        )
+        head_rows = await database.fetch_all(head)
+
+    by_currency = defaultdict(int)
+    for (_, currency), balance in balances.items():
+        by_currency[currency] += balance
+    for row in head_rows:
+        by_currency[row['currency']] += row['amount'] or 0
+    return dict(by_currency)
+
+
+# Attach a running balance to row dicts already ordered by (t_date, tid).
+# Rows left in another currency (fx_missing) don't move the balance.
+def with_running_balance(rows: List[dict], opening_balance: int) -> List[dict]:
+    balance = opening_balance
+    result = []
+    for row in rows:
+        item = dict(row)
+        if not item.get('fx_missing'):
+            balance += item['cashflow']
+        item['balance'] = balance
+        result.append(item)
+    return result
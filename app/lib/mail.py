@@ -0,0 +1,192 @@
+# app/lib/mail.py
+
+import asyncio
+import os
+import smtplib
+from datetime import datetime
+from email.mime.text import MIMEText
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+MAIN_EMAIL = os.getenv("MAIN_EMAIL")
+MAIN_EMAIL_PASSWORD = os.getenv("MAIN_EMAIL_PASSWORD")
+SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
+SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
+
+MAIL_BACKEND = os.getenv("MAIL_BACKEND", "smtp")  # smtp / memory / file
+MAIL_FILE_PATH = os.getenv("MAIL_FILE_PATH", "mail_outbox.txt")
+MAIL_BATCH_SIZE = int(os.getenv("MAIL_BATCH_SIZE", "20"))
+MAIL_MAX_RETRIES = int(os.getenv("MAIL_MAX_RETRIES", "3"))
+MAIL_RETRY_BASE_SECONDS = float(os.getenv("MAIL_RETRY_BASE_SECONDS", "1.0"))
+
+
+# SMTP backend keeping one authenticated connection open between sends
+class SmtpBackend:
+    def __init__(self, host: str = SMTP_HOST, port: int = SMTP_PORT):
+        self.host = host
+        self.port = port
+        self._server: Optional[smtplib.SMTP] = None
+
+    def _connect(self) -> smtplib.SMTP:
+        server = smtplib.SMTP(self.host, self.port, timeout=30)
+        server.starttls()
+        server.login(MAIN_EMAIL, MAIN_EMAIL_PASSWORD)
+        return server
+
+    def _ensure_connected(self) -> smtplib.SMTP:
+        if self._server is not None:
+            try:
+                if self._server.noop()[0] == 250:
+                    return self._server
+            except smtplib.SMTPException:
+                pass
+            self.close()
+        self._server = self._connect()
+        return self._server
+
+    def send(self, msg: MIMEText):
+        server = self._ensure_connected()
+        try:
+            server.sendmail(msg["From"], [msg["To"]], msg.as_string())
+        except (smtplib.SMTPServerDisconnected, OSError):
+            # Drop the broken connection so the retry reconnects
+            self.close()
+            raise
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+
+# In-memory backend for tests and benchmarks
+class MemoryBackend:
+    def __init__(self):
+        self.outbox: List[MIMEText] = []
+
+    def send(self, msg: MIMEText):
+        self.outbox.append(msg)
+
+    def close(self):
+        pass
+
+
+# Local file sink, one message per block
+class FileBackend:
+    def __init__(self, path: str = MAIL_FILE_PATH):
+        self.path = path
+
+    def send(self, msg: MIMEText):
+        with open(self.path, "a", encoding="utf-8") as fp:
+            fp.write(f"From {msg['From']} {datetime.utcnow().isoformat()}\n")
+            fp.write(msg.as_string())
+            fp.write("\n\n")
+
+    def close(self):
+        pass
+
+
+def _create_backend(name: str):
+    if name == "memory":
+        return MemoryBackend()
+    if name == "file":
+        return FileBackend()
+    return SmtpBackend()
+
+
+# Queue-backed sender: one worker task drains batches on a thread, off the event loop
+class MailSender:
+    def __init__(self, backend):
+        self.backend = backend
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    def _ensure_worker(self):
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+    async def send(self, to: str, subject: str, body: str):
+        # Resolves once delivered; raises the last error after all retries
+        self._ensure_worker()
+        msg = MIMEText(body)
+        msg["Subject"] = subject
+        msg["From"] = MAIN_EMAIL
+        msg["To"] = to
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((msg, future))
+        return await future
+
+    def _send_batch(self, batch: list) -> list:
+        errors = []
+        for msg, _ in batch:
+            try:
+                self.backend.send(msg)
+                errors.append(None)
+            except Exception as e:
+                errors.append(e)
+        return errors
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < MAIL_BATCH_SIZE and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            attempt = 0
+            while batch:
+                errors = await asyncio.to_thread(self._send_batch, batch)
+                failed = []
+                for (msg, future), error in zip(batch, errors):
+                    if future.done():
+                        continue
+                    if error is None:
+                        future.set_result(True)
+                    elif attempt >= MAIL_MAX_RETRIES:
+                        print(f"Failed to send email to {msg['To']}\n{str(error)}")
+                        future.set_exception(error)
+                    else:
+                        failed.append((msg, future))
+
+                batch = failed
+                if batch:
+                    await asyncio.sleep(MAIL_RETRY_BASE_SECONDS * (2 ** attempt))
+                    attempt += 1
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await asyncio.to_thread(self.backend.close)
+
+
+_MAIL_SENDER: Optional[MailSender] = None
+
+
+def get_mail_sender() -> MailSender:
+    global _MAIL_SENDER
+
+    if _MAIL_SENDER is None:
+        _MAIL_SENDER = MailSender(_create_backend(MAIL_BACKEND))
+    return _MAIL_SENDER
+
+
+async def send_email(to: str, subject: str, body: str):
+    return await get_mail_sender().send(to, subject, body)
+
+
+async def close_mail_sender():
+    if _MAIL_SENDER is not None:
+        await _MAIL_SENDER.close()
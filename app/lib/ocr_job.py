@@ -0,0 +1,165 @@
+# app/lib/ocr_job.py
+
+import asyncio
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+from uuid import uuid4
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, status
+
+from app.lib.ai_receipt import extract_receipt_info_from_bytes
+
+load_dotenv()
+
+# Finished jobs are kept this long for polling, then dropped
+OCR_JOB_TTL_SECONDS = int(os.getenv("OCR_JOB_TTL_SECONDS", "300"))
+# OCR is CPU bound; run jobs on a small dedicated pool instead of the event loop
+OCR_JOB_WORKERS = int(os.getenv("OCR_JOB_WORKERS", "1"))
+# Queued + running jobs allowed at once; further submissions get 429
+OCR_JOB_MAX_PENDING = int(os.getenv("OCR_JOB_MAX_PENDING", "16"))
+# Queued + running jobs one user may hold, so a single account cannot fill the queue
+OCR_JOB_MAX_PENDING_PER_USER = int(os.getenv("OCR_JOB_MAX_PENDING_PER_USER", "2"))
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+_executor = ThreadPoolExecutor(max_workers=OCR_JOB_WORKERS, thread_name_prefix="ocr-job")
+_jobs: Dict[str, "OcrJob"] = {}
+
+
+class OcrJobCancelled(Exception):
+    pass
+
+
+class OcrJob:
+    def __init__(self, job_id: str, uid: int):
+        self.job_id = job_id
+        self.uid = uid
+        self.status = QUEUED
+        self.stage: Optional[str] = None
+        self.ocr_pass: Optional[str] = None
+        self.result: Optional[dict] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = False
+        self.version = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "stage": self.stage,
+            "pass": self.ocr_pass,
+            "error": self.error,
+        }
+
+    # Wake everyone waiting on this job (must run on the event loop)
+    def _notify(self):
+        self.version += 1
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def _set_status(self, status: str):
+        self.status = status
+        self._notify()
+
+    def _set_stage(self, stage: str, ocr_pass: str):
+        self.stage = stage
+        self.ocr_pass = ocr_pass
+        self._notify()
+
+    def _finish(self, status: str, result: Optional[dict] = None, error: Optional[str] = None):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.finished_at = time.time()
+        self._notify()
+
+    async def wait_for_change(self, version: int, timeout: float):
+        if self.version != version:
+            return
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+
+# Drop finished jobs whose TTL has passed
+def _purge_expired():
+    now = time.time()
+    expired = [
+        job_id for job_id, job in _jobs.items()
+        if job.finished_at is not None and now - job.finished_at > OCR_JOB_TTL_SECONDS
+    ]
+    for job_id in expired:
+        _jobs.pop(job_id, None)
+
+
+async def _run_job(job: OcrJob, content: bytes):
+    loop = asyncio.get_running_loop()
+
+    # Called from the worker thread between OCR passes
+    def progress(stage: str, ocr_pass: str):
+        if job.cancel_requested:
+            raise OcrJobCancelled()
+        loop.call_soon_threadsafe(job._set_stage, stage, ocr_pass)
+
+    def run():
+        if job.cancel_requested:
+            raise OcrJobCancelled()
+        loop.call_soon_threadsafe(job._set_status, RUNNING)
+        return extract_receipt_info_from_bytes(content, progress)
+
+    try:
+        result = await loop.run_in_executor(_executor, run)
+        job._finish(DONE, result=result)
+    except (OcrJobCancelled, asyncio.CancelledError):
+        job._finish(CANCELLED)
+    except Exception as e:
+        print(f"Failed to extract receipt info: {e}")
+        job._finish(FAILED, error=f"{type(e).__name__}: {e}")
+
+
+def submit_job(uid: int, content: bytes) -> OcrJob:
+    _purge_expired()
+    pending = [job for job in _jobs.values() if job.status not in FINISHED_STATES]
+    if sum(1 for job in pending if job.uid == uid) >= OCR_JOB_MAX_PENDING_PER_USER:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many receipts in progress. Please wait for one to finish.",
+            headers={"Retry-After": "5"},
+        )
+    if len(pending) >= OCR_JOB_MAX_PENDING:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Receipt queue is full. Please try again later.",
+            headers={"Retry-After": "5"},
+        )
+
+    job = OcrJob(str(uuid4()), uid)
+    _jobs[job.job_id] = job
+    job.task = asyncio.create_task(_run_job(job, content))
+    return job
+
+
+# Jobs are only visible to the user who submitted them
+def get_job(uid: int, job_id: str) -> Optional[OcrJob]:
+    _purge_expired()
+    job = _jobs.get(job_id)
+    if job is None or job.uid != uid:
+        return None
+    return job
+
+
+# Cooperative cancel: a queued job never starts, a running one stops at the next pass
+def cancel_job(uid: int, job_id: str) -> Optional[OcrJob]:
+    job = get_job(uid, job_id)
+    if job is not None and job.status not in FINISHED_STATES:
+        job.cancel_requested = True
+    return job
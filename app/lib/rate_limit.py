@@ -0,0 +1,130 @@
+# app/lib/rate_limit.py
+
+import math
+import os
+import random
+import time
+from typing import Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import HTTPException, Request, status
+from sqlalchemy import select
+
+from app.db.crud import dialect_insert
+from app.db.init import database, DIALECT, POSTGRESQL
+from app.db.model import RateLimit
+
+# Load environment variables
+load_dotenv()
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")  # memory / db
+# Only trust X-Forwarded-For behind a known proxy chain; RATE_LIMIT_PROXY_HOPS is the
+# number of trusted proxies that append to it (Cloud Run's front end is one)
+RATE_LIMIT_TRUST_PROXY = os.getenv("RATE_LIMIT_TRUST_PROXY", "false").lower() == "true"
+RATE_LIMIT_PROXY_HOPS = max(1, int(os.getenv("RATE_LIMIT_PROXY_HOPS", "1")))
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_DB_PURGE_PROBABILITY = 0.01
+
+
+# "capacity/seconds" -> (capacity, seconds), e.g. "10/60" = 10 requests per minute
+def _parse_limit(value: str) -> Tuple[int, float]:
+    capacity, seconds = value.split("/")
+    return int(capacity), float(seconds)
+
+
+# Token bucket per key. In memory each key is one (tokens, updated_at) tuple, kept in
+# least recently hit order so idle keys (full again anyway) are dropped from the front.
+class TokenBucketLimiter:
+    def __init__(self, name: str, limit: str):
+        self.name = name
+        self.capacity, self.period = _parse_limit(limit)
+        self.rate = self.capacity / self.period
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+
+    # Refill and take one token; returns (tokens left, seconds to wait if denied)
+    def _take(self, tokens: float, updated_at: float, now: float) -> Tuple[float, float]:
+        tokens = min(self.capacity, tokens + (now - updated_at) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    # Only looks at the oldest keys, so each key is visited once: amortised O(1) per hit.
+    # Past RATE_LIMIT_MAX_KEYS the least recently hit keys are evicted even if not idle.
+    def _purge_idle(self, now: float):
+        while self._buckets:
+            key = next(iter(self._buckets))
+            _, updated_at = self._buckets[key]
+            if now - updated_at < self.period and len(self._buckets) <= RATE_LIMIT_MAX_KEYS:
+                break
+            del self._buckets[key]
+
+    def _hit_memory(self, key: str, now: float) -> float:
+        tokens, updated_at = self._buckets.pop(key, (self.capacity, now))
+        tokens, retry_after = self._take(tokens, updated_at, now)
+        self._buckets[key] = (tokens, now)
+
+        self._purge_idle(now)
+        return retry_after
+
+    async def _hit_db(self, key: str, now: float) -> float:
+        db_key = f"{self.name}:{key}"
+        async with database.transaction():
+            query = select(RateLimit.tokens, RateLimit.updated_at).where(RateLimit.key == db_key)
+            if DIALECT == POSTGRESQL:
+                query = query.with_for_update()
+            row = await database.fetch_one(query)
+
+            tokens, updated_at = (row["tokens"], row["updated_at"]) if row else (self.capacity, now)
+            tokens, retry_after = self._take(tokens, updated_at, now)
+
+            query = dialect_insert(RateLimit).values(key=db_key, tokens=tokens, updated_at=now)
+            query = query.on_conflict_do_update(
+                index_elements=['key'],
+                set_={'tokens': tokens, 'updated_at': now}
+            )
+            await database.execute(query)
+
+        if random.random() < RATE_LIMIT_DB_PURGE_PROBABILITY:
+            await database.execute(
+                RateLimit.__table__.delete().where(
+                    RateLimit.key.like(f"{self.name}:%") &
+                    (RateLimit.updated_at < now - self.period)
+                )
+            )
+        return retry_after
+
+    async def hit(self, key: str) -> float:
+        now = time.time()
+        if RATE_LIMIT_BACKEND == "db":
+            return await self._hit_db(key, now)
+        return self._hit_memory(key, now)
+
+
+signin_ip_limiter = TokenBucketLimiter("signin_ip", os.getenv("RATE_LIMIT_SIGNIN_IP", "20/60"))
+signin_email_limiter = TokenBucketLimiter("signin_email", os.getenv("RATE_LIMIT_SIGNIN_EMAIL", "5/60"))
+email_ip_limiter = TokenBucketLimiter("email_ip", os.getenv("RATE_LIMIT_EMAIL_IP", "5/600"))
+email_address_limiter = TokenBucketLimiter("email_address", os.getenv("RATE_LIMIT_EMAIL_ADDRESS", "3/600"))
+
+
+# Client address as seen by the outermost trusted proxy. Entries left of that are
+# supplied by the client and can be anything, so they are never used.
+def get_client_ip(request: Request) -> str:
+    if RATE_LIMIT_TRUST_PROXY:
+        forwarded = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+        if forwarded:
+            return forwarded[-min(RATE_LIMIT_PROXY_HOPS, len(forwarded))]
+    return request.client.host if request.client else "unknown"
+
+
+# Raise 429 with Retry-After when any of the (limiter, key) buckets is empty
+async def enforce_rate_limit(*checks: Tuple[TokenBucketLimiter, Optional[str]]):
+    for limiter, key in checks:
+        if not key:
+            continue
+        retry_after = await limiter.hit(key)
+        if retry_after > 0:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many requests. Please try again later.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
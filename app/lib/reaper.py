@@ -0,0 +1,112 @@
+# app/lib/reaper.py
+
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from app.db.init import database
+from app.db.model import ChangeLog, EmailVerification, Token
+from app.lib.change_log import advance_change_floors, compacted_condition
+
+# Load environment variables
+load_dotenv()
+
+REAPER_INTERVAL_SECONDS = int(os.getenv("REAPER_INTERVAL_SECONDS", "600"))
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "500"))
+# How long rows are kept after they stop being useful
+TOKEN_RETENTION_MINUTES = int(os.getenv("TOKEN_RETENTION_MINUTES", "0"))
+EMAIL_VERIFICATION_RETENTION_MINUTES = int(os.getenv("EMAIL_VERIFICATION_RETENTION_MINUTES", "1440"))
+
+REAPER_STATS = {
+    "runs": 0,
+    "token_rows": 0,
+    "email_verification_rows": 0,
+    "change_log_rows": 0,
+    "last_run_at": None,
+    "last_run_token_rows": 0,
+    "last_run_email_verification_rows": 0,
+    "last_run_change_log_rows": 0,
+}
+
+_reaper_task: Optional[asyncio.Task] = None
+
+
+# Delete rows matching `condition` in batches of REAPER_BATCH_SIZE; returns rows deleted
+async def _delete_in_batches(table, key_column, condition) -> int:
+    total = 0
+    while True:
+        batch = select(key_column).where(condition).limit(REAPER_BATCH_SIZE)
+        query = table.delete().where(key_column.in_(batch.scalar_subquery())).returning(key_column)
+        deleted = len(await database.fetch_all(query))
+        total += deleted
+        if deleted < REAPER_BATCH_SIZE:
+            return total
+        # Yield between batches so request handlers are not starved
+        await asyncio.sleep(0)
+
+
+async def reap_expired() -> dict:
+    now = datetime.utcnow()
+
+    token_rows = await _delete_in_batches(
+        Token.__table__,
+        Token.__table__.c.token_id,
+        Token.expires_at < now - timedelta(minutes=TOKEN_RETENTION_MINUTES),
+    )
+    email_rows = await _delete_in_batches(
+        EmailVerification.__table__,
+        EmailVerification.__table__.c.code,
+        EmailVerification.created_at < now - timedelta(minutes=EMAIL_VERIFICATION_RETENTION_MINUTES),
+    )
+
+    # Change log entries every syncing client has already moved past
+    await advance_change_floors(now)
+    change_log_rows = await _delete_in_batches(
+        ChangeLog.__table__,
+        ChangeLog.__table__.c.clid,
+        compacted_condition(),
+    )
+
+    REAPER_STATS["runs"] += 1
+    REAPER_STATS["token_rows"] += token_rows
+    REAPER_STATS["email_verification_rows"] += email_rows
+    REAPER_STATS["change_log_rows"] += change_log_rows
+    REAPER_STATS["last_run_at"] = now.isoformat()
+    REAPER_STATS["last_run_token_rows"] = token_rows
+    REAPER_STATS["last_run_email_verification_rows"] = email_rows
+    REAPER_STATS["last_run_change_log_rows"] = change_log_rows
+    print(f"[reaper] token={token_rows} email_verification={email_rows} change_log={change_log_rows}")
+    return REAPER_STATS
+
+
+async def _run_reaper():
+    while True:
+        try:
+            await reap_expired()
+        except Exception as e:
+            print(f"Failed to reap expired rows\n{str(e)}")
+        await asyncio.sleep(REAPER_INTERVAL_SECONDS)
+
+
+def start_reaper():
+    global _reaper_task
+
+    if _reaper_task is None or _reaper_task.done():
+        _reaper_task = asyncio.create_task(_run_reaper())
+    return _reaper_task
+
+
+async def stop_reaper():
+    global _reaper_task
+
+    if _reaper_task is not None:
+        _reaper_task.cancel()
+        try:
+            await _reaper_task
+        except asyncio.CancelledError:
+            pass
+        _reaper_task = None
@@ -0,0 +1,65 @@
+# app/lib/receipt_image.py
+
+import mimetypes
+from io import BytesIO
+from typing import Dict, Optional
+
+from PIL import Image, ImageOps
+
+# Longest side (px) of each resized receipt variant, smallest first
+VARIANT_SIDES = {
+    "thumb": 256,
+    "preview": 1024,
+}
+VARIANT_FORMAT = "WEBP"
+VARIANT_CONTENT_TYPE = "image/webp"
+VARIANT_QUALITY = 80
+
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+
+# Detect the MIME type from the image bytes, falling back to the file name
+def detect_content_type(content: bytes, file_name: Optional[str] = None) -> str:
+    try:
+        with Image.open(BytesIO(content)) as img:
+            mime = Image.MIME.get(img.format)
+            if mime:
+                return mime
+    except Exception:
+        pass
+
+    if file_name:
+        guessed, _ = mimetypes.guess_type(file_name)
+        if guessed:
+            return guessed
+    return DEFAULT_CONTENT_TYPE
+
+
+# Build WebP thumbnail/preview variants from the original image bytes
+def build_variants(content: bytes) -> Dict[str, bytes]:
+    with Image.open(BytesIO(content)) as opened:
+        img = ImageOps.exif_transpose(opened)
+        if img.mode not in ("RGB", "RGBA"):
+            img = img.convert("RGB")
+
+        variants = {}
+        for name, side in VARIANT_SIDES.items():
+            resized = img.copy()
+            resized.thumbnail((side, side), Image.LANCZOS)
+
+            out = BytesIO()
+            resized.save(out, format=VARIANT_FORMAT, quality=VARIANT_QUALITY, method=4)
+            variants[name] = out.getvalue()
+
+    return variants
+
+
+# Smallest variant whose longest side still covers the requested size (None = original)
+def pick_variant(size: Optional[int]) -> Optional[str]:
+    if not size or size <= 0:
+        return None
+
+    for name, side in sorted(VARIANT_SIDES.items(), key=lambda item: item[1]):
+        if side >= size:
+            return name
+    return None
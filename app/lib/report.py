@@ -0,0 +1,84 @@
+# app/lib/report.py
+
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import or_
+
+from app.db.init import database
+from app.db.model import Transaction
+from app.lib.analytics import get_branch_monthly
+from app.lib.archive import get_archived_rows, get_opening_balance_with_archive
+from app.lib.fx import convert_balances, convert_rows, get_display_currency
+from app.lib.ledger import with_running_balance
+from app.lib.tree_summary import convert_monthly_rows
+
+
+# Transactions of a branch subtree within [begin, end] in the user's display currency
+async def get_daily_report(uid: int, branch: str, begin_date: datetime, end_date: datetime, running_balance: bool = False) -> dict:
+    query = (
+        Transaction.__table__
+        .select()
+        .where(
+            (Transaction.uid == uid)
+            & (or_(Transaction.branch == branch, Transaction.branch.like(f"{branch + '/'}%")))
+            & (Transaction.t_date >= begin_date)
+            & (Transaction.t_date <= end_date)
+        )
+        .order_by(Transaction.t_date, Transaction.tid)
+    )
+    transactions = await database.fetch_all(query)
+
+    # Ranges reaching into archived years read those rows from the archive files
+    archived = await get_archived_rows(uid, branch, begin_date, end_date)
+    if archived:
+        transactions = sorted(
+            [dict(row._mapping) for row in transactions] + archived,
+            key=lambda row: (row["t_date"], row["tid"]),
+        )
+
+    # Amounts are returned in the user's display currency
+    display_currency = await get_display_currency(uid)
+    transactions = await convert_rows(transactions, display_currency)
+
+    if running_balance:
+        opening_balances = await get_opening_balance_with_archive(uid, branch, begin_date)
+        opening_balance, unconverted = await convert_balances(opening_balances, begin_date, display_currency)
+        return {
+            "message": with_running_balance(transactions, opening_balance),
+            "opening_balance": opening_balance,
+            "unconverted_opening_balance": unconverted,
+            "currency": display_currency,
+        }
+    return {"message": transactions, "currency": display_currency}
+
+
+def _change(current: int, previous):
+    if not previous:
+        return None
+    return round((current - previous) / previous, 4)
+
+
+# Income/expenditure per branch cut at `level` (0 = root) and per month or year, in to_currency.
+# Yearly rows also carry the change against the same branch's previous year.
+async def get_level_report(uid: int, begin_date: str, end_date: str, level: int, period: str, to_currency: str) -> dict:
+    rows = await get_branch_monthly(uid, begin_date, end_date)
+    rows, unconverted = await convert_monthly_rows(rows, end_date, to_currency)
+
+    totals = defaultdict(lambda: [0, 0])
+    for row in rows:
+        path = "/".join(row["branch"].split("/")[:level + 1])
+        key = (path, row["monthly"][:4] if period == "year" else row["monthly"])
+        totals[key][0] += row["income"]
+        totals[key][1] += abs(row["expenditure"])
+
+    report = []
+    for (path, key), (income, expenditure) in sorted(totals.items()):
+        item = {"path": path, "period": key, "income": income, "expenditure": expenditure}
+        if period == "year":
+            previous = totals.get((path, str(int(key) - 1)))
+            item["income_change"] = _change(income, previous[0] if previous else None)
+            item["expenditure_change"] = _change(expenditure, previous[1] if previous else None)
+        report.append(item)
+
+    return {"currency": to_currency, "level": level, "period": period, "rows": report, "unconverted": unconverted}
@@ -0,0 +1,179 @@
+# app/lib/search.py
+
+import re
+from datetime import date, timedelta
+from typing import List, Optional
+
+from app.db.init import database, DIALECT, SQLITE
+from app.lib.archive import get_archive_boundary, get_archived_rows
+
+SEARCH_MAX_LIMIT = 500
+_RESULT_COLUMNS = ("tid", "t_date", "branch", "cashflow", "currency", "description", "receipt", "c_date")
+
+# SQLite: external-content FTS5 table kept in sync with "transaction" by triggers
+_SQLITE_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS transaction_fts USING fts5(
+        description, content='transaction', content_rowid='tid', tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS transaction_fts_ai AFTER INSERT ON "transaction" BEGIN
+        INSERT INTO transaction_fts(rowid, description) VALUES (new.tid, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS transaction_fts_ad AFTER DELETE ON "transaction" BEGIN
+        INSERT INTO transaction_fts(transaction_fts, rowid, description) VALUES ('delete', old.tid, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS transaction_fts_au AFTER UPDATE OF description ON "transaction" BEGIN
+        INSERT INTO transaction_fts(transaction_fts, rowid, description) VALUES ('delete', old.tid, old.description);
+        INSERT INTO transaction_fts(rowid, description) VALUES (new.tid, new.description);
+    END
+    """,
+]
+
+# PostgreSQL: expression GIN index on the tsvector plus a trigram index for substrings
+_POSTGRES_FTS_DDL = [
+    """
+    CREATE INDEX IF NOT EXISTS ix_transaction_description_tsv
+    ON "transaction" USING GIN (to_tsvector('simple', coalesce(description, '')))
+    """,
+]
+_POSTGRES_TRGM_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE INDEX IF NOT EXISTS ix_transaction_description_trgm
+    ON "transaction" USING GIN (description gin_trgm_ops)
+    """,
+]
+
+_trigram_enabled = False
+
+
+# Create the dialect's search structures (idempotent; run on startup)
+async def ensure_search_index():
+    global _trigram_enabled
+
+    if DIALECT == SQLITE:
+        exists = await database.fetch_val(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transaction_fts'"
+        )
+        for ddl in _SQLITE_FTS_DDL:
+            await database.execute(ddl)
+        if not exists:
+            # Index the rows written before the FTS table existed
+            await database.execute("INSERT INTO transaction_fts(transaction_fts) VALUES ('rebuild')")
+        return
+
+    for ddl in _POSTGRES_FTS_DDL:
+        await database.execute(ddl)
+    try:
+        for ddl in _POSTGRES_TRGM_DDL:
+            await database.execute(ddl)
+        _trigram_enabled = True
+    except Exception as e:
+        print(f"pg_trgm unavailable, substring search disabled\n{str(e)}")
+
+
+def tokenize_query(q: str) -> List[str]:
+    return re.findall(r"\w+", q.lower())
+
+
+# Archived rows whose description matches every token as a word prefix (the FTS semantics),
+# newest first
+async def _search_archive(uid: int, tokens: List[str], branch: str, begin_date: Optional[date], end_date: Optional[date]):
+    boundary = await get_archive_boundary(uid)
+    if boundary is None or (begin_date and begin_date >= boundary):
+        return []
+    end = boundary - timedelta(days=1)
+    if end_date and end_date < end:
+        end = end_date
+    rows = await get_archived_rows(uid, branch, begin_date or date.min, end)
+
+    matches = []
+    for row in rows:
+        words = tokenize_query(row["description"] or "")
+        if all(any(word.startswith(token) for word in words) for token in tokens):
+            matches.append({column: row[column] for column in _RESULT_COLUMNS} | {"rank": None})
+    matches.sort(key=lambda row: (row["t_date"], row["tid"]), reverse=True)
+    return matches
+
+
+# Matching transactions ranked by relevance, followed by matches in archived years (read
+# from the archive files when the date range reaches into them), newest first
+async def search_transactions(
+    uid: int,
+    q: str,
+    branch: str,
+    begin_date: Optional[date] = None,
+    end_date: Optional[date] = None,
+    limit: int = 50,
+    offset: int = 0,
+):
+    tokens = tokenize_query(q)
+    if not tokens:
+        return []
+
+    limit = min(limit, SEARCH_MAX_LIMIT)
+    values = {
+        "uid": uid,
+        "branch": branch,
+        "branch_prefix": f"{branch}/%",
+    }
+    filters = ["t.uid = :uid", "(t.branch = :branch OR t.branch LIKE :branch_prefix)"]
+    if begin_date:
+        filters.append("t.t_date >= :begin_date")
+        values["begin_date"] = begin_date
+    if end_date:
+        filters.append("t.t_date <= :end_date")
+        values["end_date"] = end_date
+
+    if DIALECT == SQLITE:
+        # Every token must match, each as a prefix; bm25 is lower-is-better
+        values["match"] = " ".join(f'"{token}"*' for token in tokens)
+        rank = "bm25(transaction_fts)"
+        order = "rank, t.t_date DESC"
+        source = f"""
+            FROM transaction_fts
+            JOIN "transaction" t ON t.tid = transaction_fts.rowid
+            WHERE transaction_fts MATCH :match AND {" AND ".join(filters)}
+        """
+    else:
+        values["tsquery"] = " & ".join(f"{token}:*" for token in tokens)
+        match = "to_tsvector('simple', coalesce(t.description, '')) @@ to_tsquery('simple', :tsquery)"
+        rank = "ts_rank(to_tsvector('simple', coalesce(t.description, '')), to_tsquery('simple', :tsquery))"
+        if _trigram_enabled:
+            escaped = q.strip().replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            values["pattern"] = f"%{escaped}%"
+            match = f"({match} OR t.description ILIKE :pattern)"
+            rank = f"{rank} + similarity(coalesce(t.description, ''), :raw)"
+            values["raw"] = q.strip()
+        order = "rank DESC, t.t_date DESC"
+        source = f"""
+            FROM "transaction" t
+            WHERE {match} AND {" AND ".join(filters)}
+        """
+
+    query = f"""
+        SELECT t.tid, t.t_date, t.branch, t.cashflow, t.currency, t.description, t.receipt, t.c_date,
+               {rank} AS rank
+        {source}
+        ORDER BY {order}
+        LIMIT :limit OFFSET :offset
+    """
+    rows = await database.fetch_all(query=query, values={**values, "limit": limit, "offset": offset})
+    if len(rows) == limit:
+        return rows
+
+    # The page runs past the table's matches: continue into the archived years
+    if rows:
+        hot_total = offset + len(rows)
+    else:
+        count_values = {key: value for key, value in values.items() if key != "raw"}
+        hot_total = await database.fetch_val(query=f"SELECT COUNT(*) {source}", values=count_values)
+    archived = await _search_archive(uid, tokens, branch, begin_date, end_date)
+    archived_offset = max(0, offset - hot_total)
+    return list(rows) + archived[archived_offset:archived_offset + limit - len(rows)]
@@ -0,0 +1,59 @@
+# app/lib/single_flight.py
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from cachetools import TTLCache
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+SINGLE_FLIGHT_TTL_SECONDS = float(os.getenv("SINGLE_FLIGHT_TTL_SECONDS", "5"))
+SINGLE_FLIGHT_CACHE_SIZE = int(os.getenv("SINGLE_FLIGHT_CACHE_SIZE", "1024"))
+
+_flights: Dict[str, "SingleFlight"] = {}
+
+
+# Concurrent callers with the same key share one in-flight computation, and its result is
+# kept for a short TTL. Keys must change whenever the answer may (e.g. include the data version).
+class SingleFlight:
+    def __init__(self, name: str, ttl_seconds: float = SINGLE_FLIGHT_TTL_SECONDS, maxsize: int = SINGLE_FLIGHT_CACHE_SIZE):
+        self.name = name
+        self._cache: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"hits": 0, "coalesced": 0, "misses": 0, "errors": 0}
+        _flights[name] = self
+
+    def _finish(self, key: Hashable, task: asyncio.Task):
+        self._inflight.pop(key, None)
+        if task.cancelled():
+            return
+        if task.exception() is not None:
+            self.stats["errors"] += 1
+            return
+        self._cache[key] = task.result()
+
+    async def do(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            result = self._cache[key]
+            self.stats["hits"] += 1
+            return result
+        except KeyError:
+            pass
+
+        task = self._inflight.get(key)
+        if task is not None:
+            self.stats["coalesced"] += 1
+        else:
+            self.stats["misses"] += 1
+            # A task, so one caller disconnecting does not cancel the others' result
+            task = asyncio.create_task(compute())
+            self._inflight[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+
+def get_single_flight_stats() -> dict:
+    return {name: dict(flight.stats, cached=len(flight._cache), inflight=len(flight._inflight)) for name, flight in _flights.items()}
@@ -1,34 +1,223 @@
 # app/lib/transaction.py
 
 import os
-from fastapi import UploadFile, HTTPException
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from fastapi import UploadFile, HTTPException, status
 from uuid import uuid4
 from pathlib import Path
-from app.db.init import database
+from app.db.crud import get_tree_postgre
+from app.db.init import database, DIALECT, POSTGRESQL
 from app.db.model import Transaction
 from dotenv import load_dotenv
 import os
 
-from app.firebase.storage import delete_image
+from app.firebase.storage import release_images
+from app.lib.archive import get_archived_tids
+from app.lib.change_log import DELETE, TRANSACTION, UPSERT, record_changes
+from app.lib.fx import normalize_currency
+from app.lib.ledger import apply_balance_deltas
 
 load_dotenv()
 
-# Delete transactions and associated receipt images
-async def execute_del_transaction(uid: str, tid_list: list):
-    try:
+# Delete transactions and associated receipt images. The rows, their checkpoint deltas and
+# the change entries commit together; receipts are released only after the commit.
+async def execute_del_transaction(uid: str, tid_list: list) -> list:
+    async with database.transaction():
         delete_query = Transaction.__table__.delete().where(
             (Transaction.uid == uid) & 
             (Transaction.tid.in_(tid_list))
         ).returning(Transaction.__table__.c)
-        
+
         delete_data = await database.fetch_all(delete_query)
-        for data in delete_data:
-            file_name = data['receipt']
-            if not file_name:
-                continue
+        await apply_balance_deltas(uid, [
+            (data['branch'], data['currency'], data['t_date'], -data['cashflow']) for data in delete_data
+        ])
+        deleted = [data['tid'] for data in delete_data]
+        if deleted:
+            await record_changes(uid, (TRANSACTION, DELETE, deleted))
 
-            # file_path = f'{uid}/{file_name}'
-            await delete_image(uid, file_name)
-            
+    # Receipts are shared by content hash; only unreferenced blobs are deleted
+    file_names = [data['receipt'] for data in delete_data if data['receipt']]
+    try:
+        await release_images(uid, file_names)
     except Exception as e:
-        print("Failed to delete transaction from PostgreSQL\n" + str(e))
+        print("error deleting image", e)
+    return deleted
+
+
+BULK_MAX_OPERATIONS = int(os.getenv("BULK_MAX_OPERATIONS", "1000"))
+BULK_EDITABLE_FIELDS = ("t_date", "branch", "cashflow", "currency", "description")
+
+
+def _bulk_result(index: int, op, tid, status: str, detail: Optional[str] = None) -> dict:
+    result = {"index": index, "op": op, "tid": tid, "status": status}
+    if detail:
+        result["detail"] = detail
+    return result
+
+
+# Shape and type checks; a malformed operation rejects the whole request with its index
+def _validate_bulk_types(index: int, operation) -> None:
+    def reject(message: str):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"operations[{index}]: {message}")
+
+    if not isinstance(operation, dict):
+        reject("must be an object.")
+    op = operation.get("op")
+    tid = operation.get("tid")
+    if op not in ("delete", "move", "edit"):
+        reject("op must be one of delete, move, edit.")
+    if not isinstance(tid, int) or isinstance(tid, bool):
+        reject("tid must be an integer.")
+    if op == "delete":
+        return
+
+    if op == "move":
+        fields = {"branch": operation.get("branch")}
+    else:
+        fields = operation.get("fields")
+        if not isinstance(fields, dict) or not fields or set(fields) - set(BULK_EDITABLE_FIELDS):
+            reject(f"fields must be a non-empty object with keys from {', '.join(BULK_EDITABLE_FIELDS)}.")
+
+    for name in ("branch", "t_date", "currency"):
+        if name in fields and not isinstance(fields[name], str):
+            reject(f"{name} must be a string.")
+    if "cashflow" in fields and (not isinstance(fields["cashflow"], int) or isinstance(fields["cashflow"], bool)):
+        reject("cashflow must be an integer.")
+    if "description" in fields and fields["description"] is not None and not isinstance(fields["description"], str):
+        reject("description must be a string or null.")
+
+
+# Turn one type-checked operation into (op, tid, patch); raises ValueError with a per-item message
+def _parse_bulk_operation(operation: dict, branches: set) -> Tuple[str, int, dict]:
+    op = operation["op"]
+    tid = operation["tid"]
+    if op == "delete":
+        return op, tid, {}
+    fields = {"branch": operation["branch"]} if op == "move" else operation["fields"]
+
+    patch = {}
+    if "branch" in fields:
+        if fields["branch"] not in branches:
+            raise ValueError(f"Branch not found - {fields['branch']}")
+        patch["branch"] = fields["branch"]
+    if "t_date" in fields:
+        try:
+            patch["t_date"] = datetime.strptime(fields["t_date"], "%Y-%m-%d").date()
+        except ValueError:
+            raise ValueError("Invalid date format. Must be in YYYY-MM-DD format.")
+    if "cashflow" in fields:
+        patch["cashflow"] = fields["cashflow"]
+    if "currency" in fields:
+        try:
+            patch["currency"] = normalize_currency(fields["currency"])
+        except HTTPException as e:
+            raise ValueError(e.detail)
+    if "description" in fields:
+        patch["description"] = fields["description"]
+    return op, tid, patch
+
+
+# Apply delete / move / edit operations in one DB transaction with one statement per
+# operation type (per distinct patch for edits); returns a result per input operation.
+async def execute_bulk_mutation(uid: int, operations: List[dict]) -> List[dict]:
+    for index, operation in enumerate(operations):
+        _validate_bulk_types(index, operation)
+
+    branches = {branch["path"] for branch in await get_tree_postgre(uid)}
+
+    results: List[Optional[dict]] = [None] * len(operations)
+    parsed: Dict[int, Tuple[int, str, dict]] = {}  # tid -> (index, op, patch)
+    for index, operation in enumerate(operations):
+        op, tid = operation["op"], operation["tid"]
+        try:
+            op, tid, patch = _parse_bulk_operation(operation, branches)
+        except ValueError as e:
+            results[index] = _bulk_result(index, op, tid, "error", str(e))
+            continue
+        if tid in parsed:
+            results[index] = _bulk_result(index, op, tid, "error", "tid appears in more than one operation.")
+            continue
+        parsed[tid] = (index, op, patch)
+
+    deltas = []
+    released = []
+    table = Transaction.__table__
+    async with database.transaction():
+        # Target rows are read inside the transaction so the deltas match what gets written
+        rows = {}
+        if parsed:
+            query = table.select().where(
+                (Transaction.uid == uid) & (Transaction.tid.in_(list(parsed)))
+            )
+            if DIALECT == POSTGRESQL:
+                query = query.with_for_update()
+            rows = {row["tid"]: row for row in await database.fetch_all(query)}
+
+        # Rows of archived years are read-only and reported as such, not as missing
+        archived = await get_archived_tids(uid, [tid for tid in parsed if tid not in rows])
+
+        deletes, moves, edits = [], defaultdict(list), defaultdict(list)
+        for tid, (index, op, patch) in parsed.items():
+            if tid in archived:
+                results[index] = _bulk_result(index, op, tid, "archived", "Transaction belongs to an archived year and cannot be changed.")
+                continue
+            if tid not in rows:
+                results[index] = _bulk_result(index, op, tid, "not_found", "Transaction not found.")
+                continue
+            if op == "delete":
+                deletes.append(tid)
+            elif op == "move":
+                moves[patch["branch"]].append(tid)
+            else:
+                edits[tuple(sorted(patch.items()))].append(tid)
+            results[index] = _bulk_result(index, op, tid, "ok")
+
+        if deletes:
+            query = table.delete().where((Transaction.uid == uid) & (Transaction.tid.in_(deletes)))
+            await database.execute(query)
+            for tid in deletes:
+                row = rows[tid]
+                deltas.append((row["branch"], row["currency"], row["t_date"], -row["cashflow"]))
+                if row["receipt"]:
+                    released.append(row["receipt"])
+
+        for branch, tids in moves.items():
+            query = table.update().where((Transaction.uid == uid) & (Transaction.tid.in_(tids))).values(branch=branch)
+            await database.execute(query)
+            for tid in tids:
+                row = rows[tid]
+                deltas.append((row["branch"], row["currency"], row["t_date"], -row["cashflow"]))
+                deltas.append((branch, row["currency"], row["t_date"], row["cashflow"]))
+
+        for patch_items, tids in edits.items():
+            patch = dict(patch_items)
+            query = table.update().where((Transaction.uid == uid) & (Transaction.tid.in_(tids))).values(**patch)
+            await database.execute(query)
+            if not {"t_date", "branch", "cashflow", "currency"} & patch.keys():
+                continue
+            for tid in tids:
+                row = rows[tid]
+                deltas.append((row["branch"], row["currency"], row["t_date"], -row["cashflow"]))
+                deltas.append((
+                    patch.get("branch", row["branch"]),
+                    patch.get("currency", row["currency"]),
+                    patch.get("t_date", row["t_date"]),
+                    patch.get("cashflow", row["cashflow"]),
+                ))
+
+        await apply_balance_deltas(uid, deltas)
+        updated = [tid for tids in list(moves.values()) + list(edits.values()) for tid in tids]
+        if deletes or updated:
+            await record_changes(uid, (TRANSACTION, DELETE, deletes), (TRANSACTION, UPSERT, updated))
+
+    # Receipts are released in one batch once the rows are gone
+    if released:
+        try:
+            await release_images(uid, released)
+        except Exception as e:
+            print("Failed to release receipts\n" + str(e))
+
+    return results
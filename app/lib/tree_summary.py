@@ -0,0 +1,136 @@
+# app/lib/tree_summary.py
+
+from datetime import datetime
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from app.db.crud import get_tree_postgre
+from app.lib.analytics import get_branch_monthly
+from app.lib.fx import convert_amounts, period_end
+
+
+# Parent path of a branch path ("Home/Food/Cafe" -> "Home/Food", "Home" -> None)
+def _parent_path(path: str):
+    if "/" not in path:
+        return None
+    return path.rsplit("/", 1)[0]
+
+
+# Assign array-backed node ids to every path, adding missing ancestors
+def build_node_index(paths: Sequence[str]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    node_paths: List[str] = []
+    node_id: Dict[str, int] = {}
+
+    for path in paths:
+        # Register the path and every ancestor that is not known yet
+        current = path
+        while current is not None and current not in node_id:
+            node_id[current] = len(node_paths)
+            node_paths.append(current)
+            current = _parent_path(current)
+
+    parent = np.full(len(node_paths), -1, dtype=np.int64)
+    depth = np.zeros(len(node_paths), dtype=np.int64)
+    for i, path in enumerate(node_paths):
+        parent_path = _parent_path(path)
+        if parent_path is not None:
+            parent[i] = node_id[parent_path]
+        depth[i] = path.count("/")
+
+    return node_paths, parent, depth
+
+
+# Add every node's sums into its ancestors, one vectorized step per tree level
+def propagate_bottom_up(values: np.ndarray, parent: np.ndarray, depth: np.ndarray) -> np.ndarray:
+    totals = values.copy()
+    if totals.shape[0] == 0:
+        return totals
+
+    for level in range(int(depth.max()), 0, -1):
+        children = np.nonzero(depth == level)[0]
+        if children.size == 0:
+            continue
+        np.add.at(totals, parent[children], totals[children])
+
+    return totals
+
+
+# Aggregate (branch, month) rows into per-node subtree totals for every period
+def aggregate_tree(branch_paths: Sequence[str], rows: Sequence) -> dict:
+    node_paths, parent, depth = build_node_index(
+        list(branch_paths) + [row["branch"] for row in rows]
+    )
+    node_id = {path: i for i, path in enumerate(node_paths)}
+
+    periods = sorted({row["monthly"] for row in rows})
+    period_id = {period: i for i, period in enumerate(periods)}
+
+    # Column 0..P-1 hold per-period sums, column P holds the whole-range sum
+    income = np.zeros((len(node_paths), len(periods) + 1), dtype=np.int64)
+    expenditure = np.zeros((len(node_paths), len(periods) + 1), dtype=np.int64)
+
+    if rows:
+        row_nodes = np.fromiter((node_id[row["branch"]] for row in rows), dtype=np.int64, count=len(rows))
+        row_periods = np.fromiter((period_id[row["monthly"]] for row in rows), dtype=np.int64, count=len(rows))
+        row_income = np.fromiter((row["income"] or 0 for row in rows), dtype=np.int64, count=len(rows))
+        row_expenditure = np.fromiter((row["expenditure"] or 0 for row in rows), dtype=np.int64, count=len(rows))
+
+        np.add.at(income, (row_nodes, row_periods), row_income)
+        np.add.at(expenditure, (row_nodes, row_periods), row_expenditure)
+        income[:, -1] = income[:, :-1].sum(axis=1)
+        expenditure[:, -1] = expenditure[:, :-1].sum(axis=1)
+
+    income = propagate_bottom_up(income, parent, depth)
+    expenditure = np.abs(propagate_bottom_up(expenditure, parent, depth))
+
+    nodes = []
+    for i, path in enumerate(node_paths):
+        nodes.append({
+            "path": path,
+            "income": int(income[i, -1]),
+            "expenditure": int(expenditure[i, -1]),
+            "monthly": [
+                {
+                    "monthly": period,
+                    "income": int(income[i, j]),
+                    "expenditure": int(expenditure[i, j]),
+                }
+                for j, period in enumerate(periods)
+            ],
+        })
+    nodes.sort(key=lambda node: node["path"])
+
+    return {"periods": periods, "nodes": nodes}
+
+
+# Convert monthly sums into to_currency at the rate of each month's last day (capped at end_date).
+# Returns (converted, unconverted): sums without a rate stay in their stored currency, outside the totals.
+async def convert_monthly_rows(rows: Sequence, end_date: str, to_currency: str) -> Tuple[List[dict], List[dict]]:
+    if not rows:
+        return [], []
+    end = datetime.strptime(end_date, "%Y-%m-%d").date()
+    currencies = [row["currency"] for row in rows]
+    dates = [period_end(row["monthly"], end) for row in rows]
+    income, missing = await convert_amounts([row["income"] or 0 for row in rows], currencies, dates, to_currency)
+    expenditure, _ = await convert_amounts([row["expenditure"] or 0 for row in rows], currencies, dates, to_currency)
+
+    converted, unconverted = [], []
+    for row, i, e, fx_missing in zip(rows, income.tolist(), expenditure.tolist(), missing.tolist()):
+        item = {"branch": row["branch"], "monthly": row["monthly"], "income": int(i), "expenditure": int(e)}
+        if fx_missing:
+            unconverted.append({**item, "currency": row["currency"]})
+        else:
+            converted.append(item)
+    return converted, unconverted
+
+
+# Per-node totals for the user's whole tree in to_currency using a single aggregate query
+async def get_tree_summary(uid: int, begin_date: str, end_date: str, to_currency: str) -> dict:
+    branches = await get_tree_postgre(uid)
+    rows = await get_branch_monthly(uid, begin_date, end_date)
+    rows, unconverted = await convert_monthly_rows(rows, end_date, to_currency)
+    summary = aggregate_tree([branch["path"] for branch in branches], rows)
+    summary["currency"] = to_currency
+    summary["unconverted"] = unconverted
+    return summary
@@ -3,10 +3,18 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.db.init import database, engine, Base
+from app.db.migrate import run_migrations
 from app.route import auth, db
 from app.db import model
 from app.route import test
 from app.firebase.init import initialize_firebase
+from app.lib.analytics import start_analytics_replica, stop_analytics_replica
+from app.lib.archive import ensure_year_partitions, start_archiver, stop_archiver
+from app.lib.fx import load_fx_rates_file
+from app.lib.mail import close_mail_sender
+from app.lib.response import CompressionMiddleware
+from app.lib.reaper import start_reaper, stop_reaper
+from app.lib.search import ensure_search_index
 import os
 from dotenv import load_dotenv
 from app.lib.ai_receipt import _get_ocr_engine
@@ -29,9 +37,13 @@ app.add_middleware(
     allow_origins=ALLOWED_ORIGINS,
     allow_credentials=False,  # No cookie-based auth
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
-    allow_headers=["Authorization", "Content-Type"],
+    allow_headers=["Authorization", "Content-Type", "If-None-Match"],
+    expose_headers=["ETag"],
 )
 
+# Compress large JSON responses (brotli when installed, else gzip)
+app.add_middleware(CompressionMiddleware)
+
 # Initialize Firebase
 initialize_firebase()
 
@@ -41,12 +53,23 @@ async def startup():
     print("Connecting to the database")
     Base.metadata.create_all(bind=engine)
     await database.connect()
+    await run_migrations()
+    await ensure_search_index()
+    await ensure_year_partitions()
+    await load_fx_rates_file()
     _get_ocr_engine()
+    start_reaper()
+    start_analytics_replica()
+    start_archiver()
 
 # Disconnect from the database on shutdown
 @app.on_event("shutdown")
 async def shutdown():
     print("Disconnecting from the database")
+    await stop_reaper()
+    await stop_analytics_replica()
+    await stop_archiver()
+    await close_mail_sender()
     await database.disconnect()
 
 # Register routes
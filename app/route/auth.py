@@ -4,17 +4,29 @@ from typing import Optional
 from datetime import datetime, timedelta
 import os
 import secrets
-import smtplib
 
-from email.mime.text import MIMEText
-from fastapi import APIRouter, Body, Depends, Form, HTTPException, Query, status
+from fastapi import APIRouter, Body, Depends, Form, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.dialects.postgresql import insert
 from dotenv import load_dotenv
 
+from app.db.crud import delete_account_postgre, dialect_insert, has_role
 from app.db.init import database
 from app.db.model import Auth, Branch, EmailVerification, Token, Transaction
-from app.firebase.storage import delete_directory
+from app.lib.account import get_storage_purge, start_storage_purge
+from app.lib.archive import delete_user_archive
+from app.lib.change_log import BRANCH, UPSERT, record_changes
+from app.lib.data_version import check_etag, etag_headers
+from app.lib.fx import normalize_currency
+from app.lib.mail import send_email
+from app.lib.response import FastJSONResponse
+from app.lib.rate_limit import (
+    email_address_limiter,
+    email_ip_limiter,
+    enforce_rate_limit,
+    get_client_ip,
+    signin_email_limiter,
+    signin_ip_limiter,
+)
 from app.lib.user import (
     create_access_token,
     create_refresh_token,
@@ -28,8 +40,6 @@ from app.lib.user import (
 # Load environment variables
 load_dotenv()
 
-MAIN_EMAIL = os.getenv("MAIN_EMAIL")
-MAIN_EMAIL_PASSWORD = os.getenv("MAIN_EMAIL_PASSWORD")
 ACCESS_TOKEN_EXPIRE_MINUTES = 60
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/signin/")
@@ -39,12 +49,26 @@ router = APIRouter()
 async def get_current_uid(token: str = Depends(oauth2_scheme)) -> int:
     return decode_access_token(token)
 
+# Get uid of an admin user (Admin)
+async def get_admin_uid(uid: int = Depends(get_current_uid)) -> int:
+    if not await has_role(uid, "admin"):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin role required.")
+    return uid
+
 # Send email verification code
 @router.post("/verify-email/")
-async def verify_email(data: dict = Body(...)):
+async def verify_email(request: Request, data: dict = Body(...)):
     email = data.get('email')
     if not email:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email is required.")
+    if not isinstance(email, str):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email must be a string.")
+
+    # Throttle before any DB or SMTP work
+    await enforce_rate_limit(
+        (email_ip_limiter, get_client_ip(request)),
+        (email_address_limiter, email.lower()),
+    )
 
     # Check for duplicate email
     user = await database.fetch_one(Auth.__table__.select().where(Auth.email == email))
@@ -56,7 +80,7 @@ async def verify_email(data: dict = Body(...)):
     current_time = datetime.utcnow()
 
     # Insert or update code and timestamp in EmailVerification table
-    query = insert(EmailVerification).values(
+    query = dialect_insert(EmailVerification).values(
         code=code,
         email=email,
         created_at=current_time
@@ -68,15 +92,7 @@ async def verify_email(data: dict = Body(...)):
 
     # Send verification email
     try:
-        msg = MIMEText(f'Your verification code is: {code}')
-        msg['Subject'] = 'Verification Code'
-        msg['From'] = MAIN_EMAIL
-        msg['To'] = email
-
-        with smtplib.SMTP('smtp.gmail.com', 587) as server:
-            server.starttls()
-            server.login(MAIN_EMAIL, MAIN_EMAIL_PASSWORD)
-            server.sendmail(MAIN_EMAIL, email, msg.as_string())
+        await send_email(email, 'Verification Code', f'Your verification code is: {code}')
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to send verification email.")
 
@@ -169,8 +185,9 @@ async def signup(data: dict = Body(...)):
     user = await database.fetch_one(Auth.__table__.select().where(Auth.email == email))
 
     # update account detail
-    query = Branch.__table__.insert().values(uid=user["uid"], path="Home")
-    await database.execute(query)
+    query = Branch.__table__.insert().values(uid=user["uid"], path="Home").returning(Branch.__table__.c.bid)
+    bid = await database.fetch_val(query)
+    await record_changes(user["uid"], (BRANCH, UPSERT, [bid]))
 
     query = EmailVerification.__table__.delete().where(EmailVerification.email == email)
     await database.execute(query)
@@ -180,7 +197,7 @@ async def signup(data: dict = Body(...)):
 
 # Signin API
 @router.post("/signin/")
-async def signin(data: dict = Body(...)):
+async def signin(request: Request, data: dict = Body(...)):
     # Get User input datas [EMAIL], [PW].
     email = data.get("email")
     password = data.get("password")
@@ -189,6 +206,17 @@ async def signin(data: dict = Body(...)):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email and password are required.",
         )
+    if not isinstance(email, str) or not isinstance(password, str):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Email and password must be strings.",
+        )
+
+    # Throttle before any DB or bcrypt work
+    await enforce_rate_limit(
+        (signin_ip_limiter, get_client_ip(request)),
+        (signin_email_limiter, email.lower()),
+    )
     
     # Check the validation of user inputed.
     user = await database.fetch_one(Auth.__table__.select().where(Auth.email == email))
@@ -201,26 +229,21 @@ async def signin(data: dict = Body(...)):
             detail="Incorrect password.",
         )
 
-    # DB update: get token
+    # DB update: get token (single upsert on the unique token.uid)
     access_token = create_access_token(data={"sub": str(user["uid"])})
     refresh_token = create_refresh_token(data={"sub": str(user["uid"])})
-    existing_token = await database.fetch_one(
-        Token.__table__.select().where(Token.uid == user["uid"])
+    created_at = datetime.utcnow()
+    expires_at = created_at + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    query = dialect_insert(Token).values(
+        uid=user["uid"],
+        access_token=access_token,
+        refresh_token=refresh_token,
+        created_at=created_at,
+        expires_at=expires_at,
+    ).on_conflict_do_update(
+        index_elements=['uid'],
+        set_={'access_token': access_token, 'created_at': created_at, 'expires_at': expires_at}
     )
-    if existing_token:
-        query = Token.__table__.update().where(Token.uid == user["uid"]).values(
-            access_token=access_token,
-            created_at=datetime.utcnow(),
-            expires_at=datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
-        )
-    else:
-        query = Token.__table__.insert().values(
-            uid=user["uid"],
-            access_token=access_token,
-            refresh_token=refresh_token,
-            created_at=datetime.utcnow(),
-            expires_at=datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES),
-        )
     await database.execute(query)
 
     # Success
@@ -234,66 +257,57 @@ async def signin(data: dict = Body(...)):
 
 # Get user information API with token
 @router.get("/get-user/")
-async def get_user(uid: int = Depends(get_current_uid)):
+async def get_user(request: Request, uid: int = Depends(get_current_uid)):
+    etag = await check_etag(request, uid)
+
     query = Auth.__table__.select().where(Auth.uid == uid)
     user_info = await database.fetch_one(query)
     if not user_info:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND, 
             detail="User information not found.")
-    return {"message": user_info}
+    return FastJSONResponse({"message": user_info}, headers=etag_headers(etag))
 
 
 # Delete account API
 @router.delete("/delete-account/")
 async def delete_account(uid: int = Depends(get_current_uid)):
-    # Delete user token from Token table
+    # Delete token, receipts index, transactions, branches and user in one DB transaction
     try:
-        delete_token_query = Token.__table__.delete().where(Token.uid == uid)
-        await database.execute(delete_token_query)
+        deleted = await delete_account_postgre(uid)
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to delete user token: {str(e)}",
+            detail=f"Failed to delete user account: {str(e)}",
         )
+    if not deleted:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User does not exist.")
 
-    # Delete user-related transactions and images
-    try:
-        delete_transactions_query = Transaction.__table__.delete().where(Transaction.uid == uid)
-        await database.execute(delete_transactions_query)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to delete user transactions: {str(e)}",
-        )
+    await delete_user_archive(uid)
 
-    try:
-        await delete_directory(uid)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to delete user images: {str(e)}",
-        )
+    # Purge receipt images in the background
+    job = start_storage_purge(uid)
 
-    try:
-        delete_branches_query = Branch.__table__.delete().where(Branch.uid == uid)
-        await database.execute(delete_branches_query)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to delete user branches: {str(e)}",
-        )
+    return {
+        "status": "success",
+        "message": "Your account and associated data have been deleted successfully.",
+        "job_id": job["job_id"],
+        "status_url": f"/auth/delete-account/status/{job['job_id']}",
+    }
 
-    try:
-        delete_user_query = Auth.__table__.delete().where(Auth.uid == uid)
-        await database.execute(delete_user_query)
-    except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to delete user account: {str(e)}",
-        )
 
-    return {"status": "success", "message": "Your account and associated data have been deleted successfully."}
+# Storage purge status for a deleted account
+@router.get("/delete-account/status/{job_id}")
+async def delete_account_status(job_id: str):
+    job = get_storage_purge(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Deletion job not found.")
+    return {
+        "job_id": job["job_id"],
+        "status": job["status"],
+        "deleted_files": job["deleted_files"],
+        "error": job["error"],
+    }
 
 
 # Signout API
@@ -332,7 +346,10 @@ async def modify_password(
 
     hashed_password = hash_password(password)
     try:
-        update_query = Auth.__table__.update().where(Auth.uid == uid).values(password=hashed_password)
+        update_query = Auth.__table__.update().where(Auth.uid == uid).values(
+            password=hashed_password,
+            data_version=Auth.data_version + 1,
+        )
         await database.execute(update_query)
     except Exception as e:
         raise HTTPException(
@@ -351,11 +368,15 @@ async def update_user(
     useai: Optional[bool] = Form(None),
     display_currency: Optional[str] = Form(None)
 ):
+    if display_currency:
+        display_currency = normalize_currency(display_currency)
+
     try:
         update_query = Auth.__table__.update().where(Auth.uid == uid).values(
             username=username,
             useai=useai,
             display_currency=display_currency,
+            data_version=Auth.data_version + 1,
         )
         await database.execute(update_query)
     except Exception as e:
@@ -369,10 +390,18 @@ async def update_user(
 
 # Forget Password? -> Update Temporary Password and Send Email
 @router.post("/forget-password/")
-async def forget_password(data: dict = Body(...)):
+async def forget_password(request: Request, data: dict = Body(...)):
     email = data.get("email")
     if not email:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email is required.")
+    if not isinstance(email, str):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Email must be a string.")
+
+    # Throttle before any DB, bcrypt or SMTP work
+    await enforce_rate_limit(
+        (email_ip_limiter, get_client_ip(request)),
+        (email_address_limiter, email.lower()),
+    )
 
     user = await database.fetch_one(Auth.__table__.select().where(Auth.email == email))
     if not user:
@@ -384,7 +413,10 @@ async def forget_password(data: dict = Body(...)):
 
     # Update the password in the Auth table
     try:
-        update_query = Auth.__table__.update().where(Auth.email == email).values(password=hashed_password)
+        update_query = Auth.__table__.update().where(Auth.email == email).values(
+            password=hashed_password,
+            data_version=Auth.data_version + 1,
+        )
         await database.execute(update_query)
     except Exception as e:
         raise HTTPException(
@@ -394,15 +426,7 @@ async def forget_password(data: dict = Body(...)):
 
     # Send temporary password via email
     try:
-        msg = MIMEText(f'Your temporary password is: "{temp_password}"')
-        msg["Subject"] = "Temporary Password"
-        msg["From"] = MAIN_EMAIL
-        msg["To"] = email
-
-        with smtplib.SMTP("smtp.gmail.com", 587) as server:
-            server.starttls()
-            server.login(MAIN_EMAIL, MAIN_EMAIL_PASSWORD)
-            server.sendmail(MAIN_EMAIL, email, msg.as_string())
+        await send_email(email, "Temporary Password", f'Your temporary password is: "{temp_password}"')
     except Exception:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -1,23 +1,43 @@
 # app/route/db.py
 
+import asyncio
+import time
 from datetime import datetime
 from operator import or_
 from typing import List, Optional
-from fastapi import APIRouter, Body, Depends, File, Form, HTTPException, Query, UploadFile, status
-from app.firebase.storage import delete_image, get_image, get_image_url, save_image
-from app.lib.branch import delete_branch_bid
-from app.lib.transaction import execute_del_transaction
-from app.db.crud import is_exist_branch
+from fastapi import APIRouter, Body, Depends, File, Form, HTTPException, Query, Request, UploadFile, status
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from app.firebase.storage import get_image, get_image_url, get_image_urls, release_images, save_image
+from app.lib.archive import delete_archived_branch, get_archived_receipts, get_archived_tids
+from app.lib.change_log import BRANCH, DELETE, SYNC_MAX_CHANGES, TRANSACTION, UPSERT, get_changes, record_changes
+from app.lib.dataset import DATASET_FORMATS, ensure_dataset_support, export_dataset, import_dataset
+from app.lib.data_version import check_etag, etag_headers
+from app.lib.branch import delete_branch_bid, is_subtree_occupied, move_branch_subtree
+from app.lib.fx import convert_rows, get_display_currency, normalize_currency
+from app.lib.search import SEARCH_MAX_LIMIT, search_transactions, tokenize_query
+from app.lib.report import get_daily_report, get_level_report
+from app.lib.response import FastJSONResponse, dumps
+from app.lib.single_flight import SingleFlight
+from app.lib.ledger import apply_balance_deltas, delete_branch_checkpoints
+from app.lib.transaction import BULK_MAX_OPERATIONS, execute_bulk_mutation, execute_del_transaction
+from app.lib.tree_summary import get_tree_summary
+from app.db.crud import get_auth_postgre, get_tree_postgre, is_exist_branch
 from app.db.model import Branch, Transaction
-from app.db.init import database
+from app.db.init import database, DIALECT, POSTGRESQL
 from app.route.auth import get_current_uid
 
 router = APIRouter()
 
+daily_report_flight = SingleFlight("refer_daily_transaction")
+tree_summary_flight = SingleFlight("get_tree_summary")
+
 
 # API to get user's branch information
-@router.get("/get-tree/")
-async def get_user_branches(uid: int = Depends(get_current_uid)):
+@router.get("/get-tree/", response_class=FastJSONResponse)
+async def get_user_branches(request: Request, uid: int = Depends(get_current_uid)):
+    etag = await check_etag(request, uid)
+
     query = Branch.__table__.select().where(Branch.uid == int(uid))
     branches = await database.fetch_all(query)
 
@@ -29,10 +49,11 @@ async def get_user_branches(uid: int = Depends(get_current_uid)):
             .returning(Branch.__table__.c.bid)
         )
         bid = await database.execute(query)
+        await record_changes(uid, (BRANCH, UPSERT, [bid]))
         path = "Home"
         return {"message": [{"bid": bid, "path": path, "uid": uid}]}
 
-    return {"message": branches}
+    return FastJSONResponse({"message": branches}, headers=etag_headers(etag))
 
 
 # API to create a new branch
@@ -62,11 +83,62 @@ async def create_branch(
     query = Branch.__table__.insert().values(
         uid=uid,
         path=path,
-    )
-    await database.execute(query)
+    ).returning(Branch.__table__.c.bid)
+    bid = await database.fetch_val(query)
+    await record_changes(uid, (BRANCH, UPSERT, [bid]))
     return {"message": "Branch created successfully"}
 
 
+# API to rename a branch or move it (with its whole subtree) under another parent
+@router.put("/move-branch/")
+async def move_branch(
+    uid: int = Depends(get_current_uid),
+    body: dict = Body(...),
+):
+    branch = body.get("branch")
+    new_path = body.get("new_path")
+
+    if not branch or not new_path or any(not part for part in new_path.split("/")):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Both branch and new_path are required.",
+        )
+    if "/" not in branch:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The root branch cannot be moved - {branch}",
+        )
+    if new_path == branch or new_path.startswith(branch + "/"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Cannot move a branch into itself - {new_path}",
+        )
+
+    is_exist = await is_exist_branch(uid, branch)
+    if not is_exist:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Branch not found - {branch}",
+        )
+
+    parent = new_path.rsplit("/", 1)[0] if "/" in new_path else None
+    if parent is None or not await is_exist_branch(uid, parent):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid parent path - {parent}",
+        )
+
+    # Any branch or transaction at or under new_path would be merged into the moved subtree
+    if await is_subtree_occupied(uid, new_path):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail=f"Branch already exists - {new_path}",
+        )
+
+    moved = await move_branch_subtree(uid, branch, new_path)
+    return {"message": "Branch moved successfully", **moved}
+
+
 # API to delete a branch
 @router.delete("/delete-branch/")
 async def delete_branch(
@@ -101,22 +173,37 @@ async def delete_branch(
     temp = await database.fetch_all(query)
     tid_list = [x["tid"] for x in temp]
 
-    # Delete transactions
-    await execute_del_transaction(uid, tid_list)
+    # Delete transactions (their change entries are recorded with the delete)
+    try:
+        await execute_del_transaction(uid, tid_list)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to delete the branch's transactions." + str(e),
+        )
+
+    # Archived years of the subtree go too
+    archived = await delete_archived_branch(uid, branch)
+    await release_images(uid, [row["receipt"] for row in archived if row["receipt"]])
+    tid_list = [row["tid"] for row in archived]
 
     # Delete branches
     await delete_branch_bid(uid, bid_list)
+    await delete_branch_checkpoints(uid, branch_list)
+    await record_changes(uid, (TRANSACTION, DELETE, tid_list), (BRANCH, DELETE, bid_list))
 
     return {"message": "Branch deleted successfully"}
 
 
 # API to view daily transactions within a branch
-@router.get("/refer-daily-transaction/")
+@router.get("/refer-daily-transaction/", response_class=FastJSONResponse)
 async def refer_daily_transaction(
+    request: Request,
     uid: int = Depends(get_current_uid),
     begin_date: str = Query(...),
     end_date: str = Query(...),
     branch: str = Query(...),
+    running_balance: bool = Query(False),
 ):
     try:
         begin_date_obj = datetime.strptime(begin_date, "%Y-%m-%d")
@@ -127,19 +214,99 @@ async def refer_daily_transaction(
             detail="Invalid date format. Must be in YYYY-MM-DD format.",
         )
 
-    query = (
-        Transaction.__table__
-        .select()
-        .where(
-            (Transaction.uid == uid)
-            & (or_(Transaction.branch == branch, Transaction.branch.like(f"{branch + '/'}%")))
-            & (Transaction.t_date >= begin_date_obj)
-            & (Transaction.t_date <= end_date_obj)
+    etag = await check_etag(request, uid)
+
+    # The ETag covers uid, data version and all parameters, so it is the cache key
+    async def compute():
+        report = await get_daily_report(uid, branch, begin_date_obj, end_date_obj, running_balance)
+        return dumps(report)
+
+    body = await daily_report_flight.do(etag, compute)
+    return FastJSONResponse(body, headers=etag_headers(etag))
+
+
+# API to get income/expenditure totals for every node of the user's tree
+@router.get("/get-tree-summary/")
+async def get_user_tree_summary(
+    request: Request,
+    uid: int = Depends(get_current_uid),
+    begin_date: str = Query(...),
+    end_date: str = Query(...),
+):
+    try:
+        datetime.strptime(begin_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid date format. Must be in YYYY-MM-DD format.",
         )
-        .order_by(Transaction.t_date)
+
+    etag = await check_etag(request, uid)
+
+    async def compute():
+        summary = await get_tree_summary(uid, begin_date, end_date, await get_display_currency(uid))
+        return dumps({"message": summary})
+
+    body = await tree_summary_flight.do(etag, compute)
+    return FastJSONResponse(body, headers=etag_headers(etag))
+
+
+# API to get income/expenditure per branch level and month/year (year-over-year for years)
+@router.get("/branch-report/")
+async def get_branch_report(
+    request: Request,
+    uid: int = Depends(get_current_uid),
+    begin_date: str = Query(...),
+    end_date: str = Query(...),
+    level: int = Query(1, ge=0),
+    period: str = Query("month", pattern="^(month|year)$"),
+):
+    try:
+        datetime.strptime(begin_date, "%Y-%m-%d")
+        datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid date format. Must be in YYYY-MM-DD format.",
+        )
+
+    etag = await check_etag(request, uid)
+    report = await get_level_report(uid, begin_date, end_date, level, period, await get_display_currency(uid))
+    return FastJSONResponse({"message": report}, headers=etag_headers(etag))
+
+
+# API to search transaction descriptions within a branch subtree
+@router.get("/search-transaction/", response_class=FastJSONResponse)
+async def search_transaction(
+    uid: int = Depends(get_current_uid),
+    q: str = Query(...),
+    branch: str = Query(...),
+    begin_date: Optional[str] = Query(None),
+    end_date: Optional[str] = Query(None),
+    limit: int = Query(50, ge=1, le=SEARCH_MAX_LIMIT),
+    offset: int = Query(0, ge=0),
+):
+    try:
+        begin_date_obj = datetime.strptime(begin_date, "%Y-%m-%d").date() if begin_date else None
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid date format. Must be in YYYY-MM-DD format.",
+        )
+
+    if not tokenize_query(q):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Search query must contain at least one word.",
+        )
+
+    transactions = await search_transactions(
+        uid, q, branch, begin_date_obj, end_date_obj, limit=limit, offset=offset
     )
-    transactions = await database.fetch_all(query)
-    return {"message": transactions}
+    display_currency = await get_display_currency(uid)
+    return FastJSONResponse({"message": await convert_rows(transactions, display_currency), "currency": display_currency})
 
 
 # API to upload transaction data (with optional image)
@@ -149,6 +316,7 @@ async def upload_transaction(
     t_date: str = Form(...),
     branch: str = Form(...),
     cashflow: int = Form(...),
+    currency: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     receipt: Optional[UploadFile] = File(None),
 ):
@@ -160,6 +328,9 @@ async def upload_transaction(
             detail="Invalid date format. Must be in YYYY-MM-DD format.",
         )
 
+    # Amounts without a currency are in the user's display currency
+    currency = normalize_currency(currency) if currency else await get_display_currency(uid)
+
     receipt_path = None
     if receipt:
         try:
@@ -178,6 +349,7 @@ async def upload_transaction(
                 t_date=t_date_obj,
                 branch=branch,
                 cashflow=cashflow,
+                currency=currency,
                 description=description,
                 receipt=receipt_path,
                 c_date=datetime.utcnow(),
@@ -185,11 +357,16 @@ async def upload_transaction(
             )
             .returning(Transaction.__table__.c.tid)
         )
-        await database.execute(query)
+        # Row, checkpoint shift and change entry commit together
+        async with database.transaction():
+            tid = await database.fetch_val(query)
+            await apply_balance_deltas(uid, [(branch, currency, t_date_obj, cashflow)])
+            await record_changes(uid, (TRANSACTION, UPSERT, [tid]))
     except Exception as e:
+        # Rolled back, so no row references the new receipt
         if receipt_path:
             try:
-                await delete_image(uid, receipt_path)
+                await release_images(uid, [receipt_path])
             except Exception as e2:
                 print("Error deleting image", e2)
         raise HTTPException(
@@ -200,26 +377,36 @@ async def upload_transaction(
     return {"message": "Transaction uploaded successfully."}
 
 
+# {tid: receipt} of the user's transactions among tid_list, archived years included
+async def _get_receipts(uid: int, tid_list: List[int]) -> dict:
+    query = (
+        select(Transaction.tid, Transaction.receipt)
+        .where(Transaction.tid.in_(tid_list))
+        .where(Transaction.uid == uid)
+    )
+    receipts = {row["tid"]: row["receipt"] for row in await database.fetch_all(query)}
+    missing = [tid for tid in dict.fromkeys(tid_list) if tid not in receipts]
+    if missing:
+        receipts.update(await get_archived_receipts(uid, missing))
+    return receipts
+
+
 # API to retrieve image file by transaction ID (tid)
 @router.get("/get-receipt/")
 async def get_receipt(
     uid: int = Depends(get_current_uid),
     tid: int = Query(...),
+    size: Optional[int] = Query(None),
 ):
-    query = (
-        Transaction.__table__
-        .select()
-        .where((Transaction.tid == tid) & (Transaction.uid == uid))
-    )
-    transaction = await database.fetch_one(query)
-    if not transaction:
+    receipts = await _get_receipts(uid, [tid])
+    if tid not in receipts:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found.")
 
-    file_name = transaction.receipt
+    file_name = receipts[tid]
     if not file_name:
         return {"receipt": None}
 
-    image_path = await get_image_url(uid, file_name)
+    image_path = await get_image_url(uid, file_name, size)
     return image_path
 
 
@@ -228,31 +415,25 @@ async def get_receipt(
 async def get_receipt_multiple(
     uid: int = Depends(get_current_uid),
     tid_list: List[int] = Query(...),
+    size: Optional[int] = Query(None),
 ):
-    query = (
-        Transaction.__table__
-        .select()
-        .where(Transaction.tid.in_(tid_list))
-        .where(Transaction.uid == uid)
-    )
-    transactions = await database.fetch_all(query)
+    receipts = await _get_receipts(uid, tid_list)
 
-    if not transactions:
+    if not receipts:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Transactions not found.",
         )
 
     image_urls = {}
-    for transaction in transactions:
-        file_name = transaction.receipt
+    for tid, file_name in receipts.items():
         if not file_name:
             continue
 
         try:
-            image_url = await get_image(uid, file_name)
+            image_url = await get_image(uid, file_name, size)
             if image_url:
-                image_urls[transaction.tid] = image_url
+                image_urls[tid] = image_url
         except Exception as e:
             print(f"Failed to get image from Firebase Storage\n{str(e)}")
             continue
@@ -260,6 +441,30 @@ async def get_receipt_multiple(
     return image_urls
 
 
+# API to return signed receipt URLs for a page of transactions
+@router.get("/get-receipt-urls/")
+async def get_receipt_urls(
+    uid: int = Depends(get_current_uid),
+    tid_list: List[int] = Query(...),
+    size: Optional[int] = Query(None),
+):
+    receipts = await _get_receipts(uid, tid_list)
+
+    files = [(tid, file_name) for tid, file_name in receipts.items() if file_name]
+    return await get_image_urls(uid, files, size)
+
+
+# A tid missing from the transaction table may live in an archived year, whose rows are
+# read-only: say so instead of answering "not found"
+async def _raise_missing_transaction(uid: int, tid: int):
+    if tid in await get_archived_tids(uid, [tid]):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Transaction belongs to an archived year and cannot be changed.",
+        )
+    raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found.")
+
+
 # API to modify a transaction
 @router.put("/modify-transaction/")
 async def modify_transaction(
@@ -268,6 +473,7 @@ async def modify_transaction(
     t_date: Optional[str] = Form(None),
     branch: Optional[str] = Form(None),
     cashflow: Optional[int] = Form(None),
+    currency: Optional[str] = Form(None),
     description: Optional[str] = Form(None),
     receipt: Optional[UploadFile] = File(None),
 ):
@@ -278,7 +484,7 @@ async def modify_transaction(
     )
     transaction = await database.fetch_one(query)
     if not transaction:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found.")
+        await _raise_missing_transaction(uid, tid)
 
     update_data = {}
     if t_date:
@@ -293,26 +499,69 @@ async def modify_transaction(
         update_data["branch"] = branch
     if cashflow is not None:
         update_data["cashflow"] = cashflow
+    if currency:
+        update_data["currency"] = normalize_currency(currency)
     if description:
         update_data["description"] = description
 
     if receipt:
-        if transaction.receipt:
-            try:
-                await delete_image(uid, transaction.receipt)
-            except Exception as e:
-                print("error deleting image", e)
-        try:
-            receipt_path = await save_image(uid, receipt)
-            update_data["receipt"] = receipt_path
-        except Exception:
+        receipt_path = await save_image(uid, receipt)
+        if receipt_path is None:
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Failed to save the image.",
             )
+        update_data["receipt"] = receipt_path
+
+    try:
+        # Update, checkpoint shift and change entry commit together; the deltas use the
+        # row as read inside the transaction, not the copy read before the upload
+        async with database.transaction():
+            query = (
+                Transaction.__table__
+                .select()
+                .where((Transaction.tid == tid) & (Transaction.uid == uid))
+            )
+            if DIALECT == POSTGRESQL:
+                query = query.with_for_update()
+            transaction = await database.fetch_one(query)
+            if not transaction:
+                await _raise_missing_transaction(uid, tid)
+
+            query = Transaction.__table__.update().where(Transaction.tid == tid).values(**update_data)
+            await database.execute(query)
+
+            if {"t_date", "branch", "cashflow", "currency"} & update_data.keys():
+                await apply_balance_deltas(uid, [
+                    (transaction.branch, transaction.currency, transaction.t_date, -transaction.cashflow),
+                    (
+                        update_data.get("branch", transaction.branch),
+                        update_data.get("currency", transaction.currency),
+                        update_data.get("t_date", transaction.t_date),
+                        update_data.get("cashflow", transaction.cashflow),
+                    ),
+                ])
+            await record_changes(uid, (TRANSACTION, UPSERT, [tid]))
+    except Exception as e:
+        # Rolled back: the row still points at its old receipt, so drop the new reference
+        if "receipt" in update_data:
+            try:
+                await release_images(uid, [update_data["receipt"]])
+            except Exception as e2:
+                print("error deleting image", e2)
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to update transaction." + str(e),
+        )
 
-    query = Transaction.__table__.update().where(Transaction.tid == tid).values(**update_data)
-    await database.execute(query)
+    # Release the replaced receipt only after the row points at the new one
+    if receipt and transaction.receipt:
+        try:
+            await release_images(uid, [transaction.receipt])
+        except Exception as e:
+            print("error deleting image", e)
 
     return {"message": "Transaction successfully updated."}
 
@@ -331,9 +580,138 @@ async def delete_transaction(
     transaction = await database.fetch_one(query)
 
     if not transaction:
-        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Transaction not found.")
+        await _raise_missing_transaction(uid, tid)
 
-    tid_value = transaction.tid
-    await execute_del_transaction(uid, [tid_value])
+    try:
+        await execute_del_transaction(uid, [transaction.tid])
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to delete transaction." + str(e),
+        )
 
     return {"message": "Transaction successfully deleted."}
+
+
+# API to delete, move or edit many transactions in one DB transaction
+@router.post("/bulk-transaction/")
+async def bulk_transaction(
+    uid: int = Depends(get_current_uid),
+    body: dict = Body(...),
+):
+    operations = body.get("operations")
+    if not isinstance(operations, list) or not operations:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="operations must be a non-empty list.",
+        )
+    if len(operations) > BULK_MAX_OPERATIONS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {BULK_MAX_OPERATIONS} operations per request.",
+        )
+
+    try:
+        results = await execute_bulk_mutation(uid, operations)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Failed to apply bulk operations." + str(e),
+        )
+
+    return {"message": results}
+
+
+# API to fetch transaction/branch changes after a version cursor (since omitted: start a sync)
+@router.get("/changes/", response_class=FastJSONResponse)
+async def get_user_changes(
+    uid: int = Depends(get_current_uid),
+    client_id: str = Query(..., min_length=1, max_length=64),
+    since: Optional[int] = Query(None, ge=0),
+    limit: int = Query(SYNC_MAX_CHANGES, ge=1, le=SYNC_MAX_CHANGES),
+):
+    changes = await get_changes(uid, client_id, since, limit)
+    return FastJSONResponse(changes)
+
+
+# API to load everything the dashboard needs for its first render in one round trip
+@router.get("/bootstrap/", response_class=FastJSONResponse)
+async def bootstrap(
+    request: Request,
+    uid: int = Depends(get_current_uid),
+    begin_date: str = Query(...),
+    end_date: str = Query(...),
+    branch: str = Query("Home"),
+):
+    try:
+        begin_date_obj = datetime.strptime(begin_date, "%Y-%m-%d")
+        end_date_obj = datetime.strptime(end_date, "%Y-%m-%d")
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid date format. Must be in YYYY-MM-DD format.",
+        )
+
+    etag = await check_etag(request, uid)
+    started = time.perf_counter()
+
+    async def load_summary():
+        return await get_tree_summary(uid, begin_date, end_date, await get_display_currency(uid))
+
+    # Independent reads run concurrently, each on its own pooled connection
+    user, tree, daily, summary = await asyncio.gather(
+        get_auth_postgre(uid),
+        get_tree_postgre(uid),
+        get_daily_report(uid, branch, begin_date_obj, end_date_obj),
+        load_summary(),
+    )
+    if not user:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="User information not found.")
+
+    user = dict(user._mapping)
+    user.pop("password", None)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+
+    return FastJSONResponse(
+        {
+            "user": user,
+            "tree": tree,
+            "daily": daily,
+            "summary": summary,
+        },
+        headers={**etag_headers(etag), "Server-Timing": f"bootstrap;dur={elapsed_ms:.1f}"},
+    )
+
+
+# API to download the user's transactions and branch paths as Parquet or an Arrow IPC stream
+@router.get("/export-dataset/")
+async def export_user_dataset(
+    uid: int = Depends(get_current_uid),
+    fmt: str = Query("parquet", alias="format", pattern="^(parquet|arrow)$"),
+):
+    ensure_dataset_support()
+    media_type, suffix = DATASET_FORMATS[fmt]
+    return StreamingResponse(
+        export_dataset(uid, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="finance-tree-{uid}.{suffix}"'},
+    )
+
+
+# API to append an exported dataset (Parquet or Arrow) to the user's account
+@router.post("/import-dataset/")
+async def import_user_dataset(
+    uid: int = Depends(get_current_uid),
+    dataset: UploadFile = File(...),
+):
+    ensure_dataset_support()
+    try:
+        imported = await import_dataset(uid, dataset.file)
+    except ValueError as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Invalid dataset - {str(e)}",
+        )
+    return {"message": "Dataset imported successfully.", **imported}
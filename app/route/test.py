@@ -1,9 +1,23 @@
 # app/route/test.py
-from fastapi import APIRouter, File, UploadFile
-from app.lib.ai_receipt import extract_receipt_info
+import json
+
+from fastapi import APIRouter, Depends, File, HTTPException, UploadFile, status
+from fastapi.responses import StreamingResponse
+from app.firebase.storage import BACKFILL_STATUS, start_variant_backfill
+from app.lib.fx import import_fx_rates, parse_fx_csv
+from app.lib.ai_receipt import extract_receipt_info, get_ocr_cost_stats, is_supported_receipt
+from app.lib.analytics import ANALYTICS_STATS
+from app.lib.archive import ARCHIVE_STATS, archive_closed_years
+from app.lib.reaper import REAPER_STATS
+from app.lib.single_flight import get_single_flight_stats
+from app.lib.ocr_job import DONE, FINISHED_STATES, cancel_job, get_job, submit_job
+from app.route.auth import get_admin_uid, get_current_uid
 
 router = APIRouter()
 
+# Seconds between SSE keep-alive comments while a job is idle
+SSE_KEEPALIVE_SECONDS = 15
+
 @router.get("/test")
 async def test():
     return {"message": "Test route works! version27"}
@@ -23,4 +37,139 @@ async def test_receipt(receipt: UploadFile = File(...)):
         "date": result.get("date"),
         "cashflow": result.get("cashflow"),
         "description": result.get("description"),
-    }
\ No newline at end of file
+        "ocr_passes": result.get("ocr_passes"),
+        "ocr_pixels": result.get("ocr_pixels"),
+    }
+
+# Average OCR passes/pixels per receipt since startup
+@router.get("/ocr-stats")
+async def ocr_stats():
+    return get_ocr_cost_stats()
+
+# Rows deleted by the expired token / verification code reaper
+@router.get("/reaper-stats")
+async def reaper_stats():
+    return REAPER_STATS
+
+# Analytics replica refreshes and replica vs primary report reads
+@router.get("/analytics-stats")
+async def analytics_stats():
+    return ANALYTICS_STATS
+
+# Rows moved from the transaction table to the yearly archive files
+@router.get("/archive-stats")
+async def archive_stats():
+    return ARCHIVE_STATS
+
+# Archive every closed year now instead of waiting for the next scheduled run (Admin)
+@router.post("/archive-closed-years")
+async def run_archive(uid: int = Depends(get_admin_uid)):
+    return await archive_closed_years()
+
+# Build thumbnail/preview variants for receipts uploaded before variants existed (Admin)
+@router.post("/receipt-variant-backfill", status_code=status.HTTP_202_ACCEPTED)
+async def run_variant_backfill(uid: int = Depends(get_admin_uid)):
+    if start_variant_backfill() is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Variant backfill is already running.")
+    return BACKFILL_STATUS
+
+# Progress and failed receipts of the last variant backfill run (Admin)
+@router.get("/receipt-variant-backfill")
+async def variant_backfill_status(uid: int = Depends(get_admin_uid)):
+    return BACKFILL_STATUS
+
+# Cache hits / coalesced waits / misses of the single-flight read caches
+@router.get("/single-flight-stats")
+async def single_flight_stats():
+    return get_single_flight_stats()
+
+# Load daily FX rates from a CSV of date,currency,rate (rate per FX_BASE_CURRENCY unit) (Admin)
+@router.post("/fx-rates")
+async def upload_fx_rates(rates: UploadFile = File(...), uid: int = Depends(get_admin_uid)):
+    try:
+        rows = parse_fx_csv((await rates.read()).decode("utf-8"))
+    except (ValueError, IndexError, UnicodeDecodeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid FX rate CSV.")
+    return {"imported": await import_fx_rates(rows)}
+
+def _get_job_or_404(uid: int, job_id: str):
+    job = get_job(uid, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Receipt job not found.")
+    return job
+
+# Submit a receipt for OCR and return a job id immediately
+@router.post("/receipt-jobs", status_code=status.HTTP_202_ACCEPTED)
+async def submit_receipt_job(receipt: UploadFile = File(...), uid: int = Depends(get_current_uid)):
+    if not is_supported_receipt(receipt.filename):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unsupported receipt file type.")
+
+    content = await receipt.read()
+    if not content:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Receipt file is empty.")
+
+    job = submit_job(uid, content)
+    return job.to_dict()
+
+# Poll job status and current OCR stage
+@router.get("/receipt-jobs/{job_id}")
+async def get_receipt_job(job_id: str, uid: int = Depends(get_current_uid)):
+    return _get_job_or_404(uid, job_id).to_dict()
+
+# Get the extracted fields of a finished job (same shape as /test-receipt)
+@router.get("/receipt-jobs/{job_id}/result")
+async def get_receipt_job_result(job_id: str, uid: int = Depends(get_current_uid)):
+    job = _get_job_or_404(uid, job_id)
+    if job.status not in FINISHED_STATES:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Receipt job is {job.status}.")
+
+    result = job.result if job.status == DONE else None
+    if result is None:
+        return {
+            "status": False,
+            "job_status": job.status,
+            "error": job.error,
+            "cashflow": None,
+            "description": None,
+        }
+
+    return {
+        "status": True,
+        "job_status": job.status,
+        "date": result.get("date"),
+        "cashflow": result.get("cashflow"),
+        "description": result.get("description"),
+        "ocr_passes": result.get("ocr_passes"),
+        "ocr_pixels": result.get("ocr_pixels"),
+    }
+
+# Server-sent events stream of stage progress until the job finishes
+@router.get("/receipt-jobs/{job_id}/events")
+async def stream_receipt_job(job_id: str, uid: int = Depends(get_current_uid)):
+    job = _get_job_or_404(uid, job_id)
+
+    async def events():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"event: {job.status}\ndata: {json.dumps(job.to_dict())}\n\n"
+                if job.status in FINISHED_STATES:
+                    return
+            else:
+                yield ": keep-alive\n\n"
+            await job.wait_for_change(version, SSE_KEEPALIVE_SECONDS)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Cancel a queued or running job
+@router.delete("/receipt-jobs/{job_id}")
+async def cancel_receipt_job(job_id: str, uid: int = Depends(get_current_uid)):
+    job = cancel_job(uid, job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Receipt job not found.")
+    return job.to_dict()
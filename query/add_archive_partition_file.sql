@@ -0,0 +1,5 @@
+-- Current archive file of each archived year; NULL rows keep using "<uid>/<year>.parquet"
+ALTER TABLE archive_partition ADD COLUMN file VARCHAR(128);
+-- tid range of the file, so a tid lookup only opens files that may hold it
+ALTER TABLE archive_partition ADD COLUMN min_tid INTEGER;
+ALTER TABLE archive_partition ADD COLUMN max_tid INTEGER;
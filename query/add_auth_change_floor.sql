@@ -0,0 +1,2 @@
+-- Lowest change log cursor still served; older cursors must reload
+ALTER TABLE auth ADD COLUMN change_floor BIGINT NOT NULL DEFAULT 0;
@@ -0,0 +1,2 @@
+-- Per-user data version bumped by every write route (ETag source)
+ALTER TABLE auth ADD COLUMN data_version BIGINT NOT NULL DEFAULT 0;
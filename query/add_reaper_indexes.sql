@@ -0,0 +1,3 @@
+-- Indexes used by the expired token / verification code reaper
+CREATE INDEX IF NOT EXISTS ix_token_expires_at ON token (expires_at);
+CREATE INDEX IF NOT EXISTS ix_email_verification_created_at ON email_verification (created_at);
@@ -0,0 +1,7 @@
+-- Keep only the newest token row per user, then enforce one row per uid
+DELETE FROM token t
+USING token newer
+WHERE t.uid = newer.uid
+  AND t.token_id < newer.token_id;
+
+ALTER TABLE token ADD CONSTRAINT token_uid_key UNIQUE (uid);
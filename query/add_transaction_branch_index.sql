@@ -0,0 +1,2 @@
+-- Index used by branch subtree filters and set-based branch moves
+CREATE INDEX IF NOT EXISTS ix_transaction_uid_branch ON "transaction" (uid, branch);
@@ -0,0 +1,9 @@
+-- Existing amounts were entered in the owner's display currency
+ALTER TABLE "transaction" ADD COLUMN currency VARCHAR(10);
+UPDATE "transaction"
+SET currency = (SELECT display_currency FROM auth WHERE auth.uid = "transaction".uid);
+ALTER TABLE "transaction" ALTER COLUMN currency SET DEFAULT 'CAD';
+ALTER TABLE "transaction" ALTER COLUMN currency SET NOT NULL;
+
+-- Checkpoints are derived data and are now kept per currency; they are rebuilt on read
+DROP TABLE IF EXISTS balance_checkpoint;
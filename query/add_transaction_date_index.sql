@@ -0,0 +1,2 @@
+-- Index used by date-range reads (listings, reports, archiving closed years)
+CREATE INDEX IF NOT EXISTS ix_transaction_uid_t_date ON "transaction" (uid, t_date);
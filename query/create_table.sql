@@ -8,7 +8,9 @@ CREATE TABLE auth (
     create_time TIMESTAMP DEFAULT NOW(),
     update_time TIMESTAMP DEFAULT NOW(),
     useai BOOLEAN DEFAULT FALSE
-    display_currency VARCHAR(10) NOT NULL DEFAULT 'CAD'    
+    display_currency VARCHAR(10) NOT NULL DEFAULT 'CAD',
+    data_version BIGINT NOT NULL DEFAULT 0,
+    change_floor BIGINT NOT NULL DEFAULT 0
 );
 
 -- Role table
@@ -24,6 +26,7 @@ CREATE TABLE email_verification (
     verified TIMESTAMP DEFAULT NULL,
     created_at TIMESTAMP DEFAULT NOW()
 );
+CREATE INDEX ix_email_verification_created_at ON email_verification (created_at);
 
 -- Branch table
 CREATE TABLE branch (
@@ -39,12 +42,15 @@ CREATE TABLE transaction (
     t_date DATE NOT NULL,
     branch VARCHAR(255) NOT NULL,
     cashflow INTEGER NOT NULL,
+    currency VARCHAR(10) NOT NULL DEFAULT 'CAD',
     description TEXT,
     c_date TIMESTAMP DEFAULT NOW(),
     uid INTEGER NOT NULL,
     receipt VARCHAR(255),
     FOREIGN KEY (uid) REFERENCES auth(uid)
 );
+CREATE INDEX ix_transaction_uid_branch ON transaction (uid, branch);
+CREATE INDEX ix_transaction_uid_t_date ON transaction (uid, t_date);
 
 -- UserRole table
 CREATE TABLE user_role (
@@ -58,10 +64,97 @@ CREATE TABLE user_role (
 -- Token table
 CREATE TABLE token (
     token_id SERIAL PRIMARY KEY,
-    uid INTEGER NOT NULL,
+    uid INTEGER NOT NULL UNIQUE,
     access_token TEXT NOT NULL,
     refresh_token TEXT,
     created_at TIMESTAMP DEFAULT NOW(),
     expires_at TIMESTAMP NOT NULL,
     FOREIGN KEY (uid) REFERENCES auth(uid)
 );
+CREATE INDEX ix_token_expires_at ON token (expires_at);
+
+-- ReceiptBlob table
+CREATE TABLE receipt_blob (
+    rbid SERIAL PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    file_name VARCHAR(255) NOT NULL,
+    ref_count INTEGER NOT NULL DEFAULT 1,
+    created_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE (uid, file_name),
+    FOREIGN KEY (uid) REFERENCES auth(uid)
+);
+
+-- RateLimit table
+CREATE TABLE rate_limit (
+    key VARCHAR(255) PRIMARY KEY,
+    tokens DOUBLE PRECISION NOT NULL,
+    updated_at DOUBLE PRECISION NOT NULL
+);
+CREATE INDEX ix_rate_limit_updated_at ON rate_limit (updated_at);
+
+-- BalanceCheckpoint table
+CREATE TABLE balance_checkpoint (
+    cpid SERIAL PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    branch VARCHAR(255) NOT NULL,
+    currency VARCHAR(10) NOT NULL,
+    period DATE NOT NULL,
+    balance BIGINT NOT NULL,
+    UNIQUE (uid, branch, currency, period),
+    FOREIGN KEY (uid) REFERENCES auth(uid)
+);
+
+-- FxRate table
+CREATE TABLE fx_rate (
+    frid SERIAL PRIMARY KEY,
+    rate_date DATE NOT NULL,
+    currency VARCHAR(10) NOT NULL,
+    rate DOUBLE PRECISION NOT NULL,
+    UNIQUE (currency, rate_date)
+);
+
+-- FxRateVersion table
+CREATE TABLE fx_rate_version (
+    id INTEGER PRIMARY KEY,
+    version BIGINT NOT NULL
+);
+
+-- ChangeLog table
+CREATE TABLE change_log (
+    clid SERIAL PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    seq BIGINT NOT NULL,
+    entity VARCHAR(16) NOT NULL,
+    entity_id INTEGER NOT NULL,
+    op VARCHAR(8) NOT NULL,
+    UNIQUE (uid, entity, entity_id),
+    FOREIGN KEY (uid) REFERENCES auth(uid)
+);
+CREATE INDEX ix_change_log_uid_seq ON change_log (uid, seq);
+
+-- SyncClient table
+CREATE TABLE sync_client (
+    scid SERIAL PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    client_id VARCHAR(64) NOT NULL,
+    last_seq BIGINT NOT NULL,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE (uid, client_id),
+    FOREIGN KEY (uid) REFERENCES auth(uid)
+);
+CREATE INDEX ix_sync_client_updated_at ON sync_client (updated_at);
+
+-- ArchivePartition table
+CREATE TABLE archive_partition (
+    apid SERIAL PRIMARY KEY,
+    uid INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    row_count INTEGER NOT NULL,
+    file VARCHAR(128),
+    min_tid INTEGER,
+    max_tid INTEGER,
+    sealed_before DATE NOT NULL,
+    archived_at TIMESTAMP DEFAULT NOW(),
+    UNIQUE (uid, year),
+    FOREIGN KEY (uid) REFERENCES auth(uid)
+);
@@ -0,0 +1,54 @@
+-- PostgreSQL only: range-partition "transaction" by t_date, one partition per calendar year,
+-- so date-range reads of recent years only touch their own partitions.
+-- The primary key must include the partition key, so it becomes (tid, t_date); tid keeps its
+-- sequence. Partitions for the coming years are created on startup (ensure_year_partitions),
+-- rows outside every yearly partition land in transaction_default.
+-- The search index and its trigram index are recreated on startup (ensure_search_index).
+BEGIN;
+
+LOCK TABLE "transaction" IN ACCESS EXCLUSIVE MODE;
+ALTER TABLE "transaction" RENAME TO transaction_unpartitioned;
+
+CREATE TABLE "transaction" (
+    tid INTEGER NOT NULL DEFAULT nextval('transaction_tid_seq'),
+    t_date DATE NOT NULL,
+    branch VARCHAR(255) NOT NULL,
+    cashflow INTEGER NOT NULL,
+    currency VARCHAR(10) NOT NULL DEFAULT 'CAD',
+    description TEXT,
+    c_date TIMESTAMP DEFAULT NOW(),
+    uid INTEGER NOT NULL,
+    receipt VARCHAR(255),
+    PRIMARY KEY (tid, t_date),
+    FOREIGN KEY (uid) REFERENCES auth(uid)
+) PARTITION BY RANGE (t_date);
+
+-- Keep the sequence when the old table is dropped
+ALTER SEQUENCE transaction_tid_seq OWNED BY "transaction".tid;
+
+DO $$
+DECLARE
+    first_year INTEGER;
+    last_year INTEGER := EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER + 1;
+BEGIN
+    SELECT COALESCE(EXTRACT(YEAR FROM MIN(t_date))::INTEGER, last_year - 1)
+    INTO first_year FROM transaction_unpartitioned;
+    FOR y IN first_year..last_year LOOP
+        EXECUTE format(
+            'CREATE TABLE transaction_y%s PARTITION OF "transaction" FOR VALUES FROM (%L) TO (%L)',
+            y, make_date(y, 1, 1), make_date(y + 1, 1, 1)
+        );
+    END LOOP;
+END $$;
+CREATE TABLE transaction_default PARTITION OF "transaction" DEFAULT;
+
+INSERT INTO "transaction" (tid, t_date, branch, cashflow, currency, description, c_date, uid, receipt)
+SELECT tid, t_date, branch, cashflow, currency, description, c_date, uid, receipt
+FROM transaction_unpartitioned;
+
+DROP TABLE transaction_unpartitioned;
+
+CREATE INDEX ix_transaction_uid_branch ON "transaction" (uid, branch);
+CREATE INDEX ix_transaction_uid_t_date ON "transaction" (uid, t_date);
+
+COMMIT;
@@ -0,0 +1,56 @@
+# tests/conftest.py
+
+import asyncio
+import os
+import tempfile
+
+# The app reads its configuration at import time, so point it at a scratch SQLite file first
+_TMP_DIR = tempfile.mkdtemp(prefix="finance-tree-tests-")
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(_TMP_DIR, 'test.db')}"
+os.environ["ARCHIVE_DIR"] = os.path.join(_TMP_DIR, "archive")
+os.environ["RATE_LIMIT_BACKEND"] = "memory"
+os.environ["JWT_KEY"] = "test-signing-key"
+
+import pytest
+
+from app.db import model
+from app.db.init import Base, database, engine
+
+
+async def _connected(coro):
+    await database.connect()
+    try:
+        return await coro
+    finally:
+        await database.disconnect()
+
+
+# Every test starts from empty tables
+@pytest.fixture(autouse=True)
+def fresh_database():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    yield
+
+
+# Run a coroutine on a fresh event loop with the database connected
+@pytest.fixture
+def run():
+    def _run(coro):
+        return asyncio.run(_connected(coro))
+    return _run
+
+
+# A user with the "Home" root branch; returns the uid
+@pytest.fixture
+def uid(run):
+    async def create():
+        uid = await database.execute(model.Auth.__table__.insert().values(
+            username="tester",
+            email="tester@example.com",
+            password="not-a-hash",
+            display_currency="CAD",
+        ))
+        await database.execute(model.Branch.__table__.insert().values(uid=uid, path="Home"))
+        return uid
+    return run(create())
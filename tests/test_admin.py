@@ -0,0 +1,30 @@
+# tests/test_admin.py
+
+import pytest
+from fastapi import HTTPException
+
+from app.db.init import database
+from app.db.model import Role, UserRole
+from app.route.auth import get_admin_uid
+
+
+def test_admin_routes_reject_users_without_the_admin_role(run, uid):
+    with pytest.raises(HTTPException) as error:
+        run(get_admin_uid(uid))
+    assert error.value.status_code == 403
+
+
+def test_admin_routes_accept_admins(run, uid):
+    async def scenario():
+        role_id = await database.execute(Role.__table__.insert().values(role_name="admin"))
+        await database.execute(UserRole.__table__.insert().values(uid=uid, role_id=role_id))
+        return await get_admin_uid(uid)
+
+    assert run(scenario()) == uid
+
+
+def test_manual_archive_run_requires_the_admin_role():
+    from app.route import test as test_routes
+
+    route = next(route for route in test_routes.router.routes if route.path == "/archive-closed-years")
+    assert get_admin_uid in [dependency.call for dependency in route.dependant.dependencies]
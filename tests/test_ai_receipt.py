@@ -0,0 +1,59 @@
+# tests/test_ai_receipt.py
+
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+from app.lib import ai_receipt
+
+
+def _png() -> bytes:
+    out = BytesIO()
+    Image.new("RGB", (400, 900), "white").save(out, format="PNG")
+    return out.getvalue()
+
+
+# Replace the OCR model with fixed lines per pass label and record which passes ran
+@pytest.fixture
+def ocr_passes(monkeypatch):
+    lines_by_label = {}
+    ran = []
+
+    def fake_ocr(image, label, progress=None, max_side=None, stats=None):
+        ran.append(label)
+        stats["passes"] += 1
+        return list(lines_by_label.get(label, []))
+
+    monkeypatch.setattr(ai_receipt, "_run_ocr_on_array", fake_ocr)
+    return lines_by_label, ran
+
+
+def test_unknown_merchant_with_matching_category_is_confident():
+    fields = ai_receipt._resolve_fields({"top": ["Joe's Corner Spot", "Latte"]})
+    assert fields["description"] == ("Restaurant", True)
+
+
+def test_higher_resolution_pass_adds_to_the_earlier_band_lines(ocr_passes):
+    lines_by_label, ran = ocr_passes
+    lines_by_label["bottom_800"] = ["TOTAL 12.34"]
+    lines_by_label["top_800"] = ["Joe's Corner Spot", "Latte"]
+    lines_by_label["top_1100"] = ["2024/03/05 10:15"]
+
+    result = ai_receipt.extract_receipt_info_from_bytes(_png())
+
+    assert "top_1100" in ran
+    assert result["date"] is not None
+    # The 800px top lines still drive the description after the 1100px re-run
+    assert result["description"] == "Restaurant"
+
+
+def test_missing_date_falls_back_to_the_full_image(ocr_passes):
+    lines_by_label, ran = ocr_passes
+    lines_by_label["bottom_800"] = ["TOTAL 12.34"]
+    lines_by_label["full_1100"] = ["Date: 2024-03-05"]
+
+    result = ai_receipt.extract_receipt_info_from_bytes(_png())
+
+    assert ran[-1] == "full_1100"
+    assert result["date"] is not None
@@ -0,0 +1,19 @@
+# tests/test_analytics.py
+
+from app.db.init import database
+from app.db.model import SyncClient
+from app.lib import analytics
+from app.lib.change_log import get_changes
+
+
+def test_shutdown_drops_this_replicas_cursors_only(run, uid, monkeypatch):
+    monkeypatch.setattr(analytics, "_replica", object())
+
+    async def scenario():
+        await get_changes(uid, analytics.ANALYTICS_CLIENT_ID, None)
+        await get_changes(uid, "analytics-other-instance", None)
+        await analytics.stop_analytics_replica()
+        return [row["client_id"] for row in await database.fetch_all(SyncClient.__table__.select())]
+
+    assert analytics.ANALYTICS_CLIENT_ID != "analytics-replica"
+    assert run(scenario()) == ["analytics-other-instance"]
@@ -0,0 +1,116 @@
+# tests/test_archive.py
+
+import os
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+pytest.importorskip("pyarrow.parquet", exc_type=ImportError)
+
+from app.db.init import database
+from app.db.model import ArchivePartition, Transaction
+from app.lib import archive
+from app.lib.search import ensure_search_index, search_transactions
+from app.lib.transaction import execute_bulk_mutation
+from app.route.db import _get_receipts, delete_transaction, modify_transaction
+
+
+async def _add(uid, t_date, cashflow=-10, description=None, receipt=None):
+    return await database.execute(Transaction.__table__.insert().values(
+        uid=uid, t_date=t_date, branch="Home", cashflow=cashflow, currency="CAD",
+        description=description, receipt=receipt,
+    ))
+
+
+async def _manifest_file(uid, year):
+    return await database.fetch_val(
+        ArchivePartition.__table__.select().with_only_columns(ArchivePartition.file).where(
+            (ArchivePartition.uid == uid) & (ArchivePartition.year == year)
+        )
+    )
+
+
+def test_rearchiving_a_year_replaces_its_file(run, uid):
+    async def scenario():
+        await _add(uid, date(2020, 3, 1))
+        await archive.archive_user(uid, date(2021, 1, 1))
+        first = await _manifest_file(uid, 2020)
+        # A row dated into the closed year later joins the year's file on the next run
+        await _add(uid, date(2020, 4, 1), -5)
+        await archive.archive_user(uid, date(2021, 1, 1))
+        second = await _manifest_file(uid, 2020)
+        rows = await archive.get_archived_rows(uid, "Home", "2020-01-01", "2020-12-31")
+        return first, second, rows
+
+    first, second, rows = run(scenario())
+    assert first != second
+    assert not os.path.exists(os.path.join(archive.ARCHIVE_DIR, first))
+    assert os.path.exists(os.path.join(archive.ARCHIVE_DIR, second))
+    assert [row["cashflow"] for row in rows] == [-10, -5]
+
+
+def test_archived_rows_are_rejected_explicitly(run, uid):
+    async def scenario():
+        tid = await _add(uid, date(2020, 3, 1))
+        await archive.archive_user(uid, date(2021, 1, 1))
+
+        errors = []
+        for call in (
+            delete_transaction(uid=uid, tid=tid),
+            modify_transaction(
+                uid=uid, tid=tid, t_date=None, branch=None, cashflow=5,
+                currency=None, description=None, receipt=None,
+            ),
+            delete_transaction(uid=uid, tid=tid + 1),
+        ):
+            try:
+                await call
+            except HTTPException as e:
+                errors.append(e.status_code)
+        bulk = await execute_bulk_mutation(uid, [{"op": "delete", "tid": tid}])
+        return errors, bulk
+
+    errors, bulk = run(scenario())
+    assert errors == [409, 409, 404]
+    assert bulk[0]["status"] == "archived"
+
+
+def test_tid_lookups_open_only_files_that_may_hold_them(run, uid):
+    async def scenario():
+        tid = await _add(uid, date(2020, 3, 1))
+        await archive.archive_user(uid, date(2021, 1, 1))
+        reads = archive.ARCHIVE_STATS["archive_reads"]
+        # Outside every file's tid range: answered from the manifest alone
+        outside = await archive.get_archived_tids(uid, [tid + 1000])
+        after_outside = archive.ARCHIVE_STATS["archive_reads"]
+        # The second lookup of the same file version comes from the cache
+        first = await archive.get_archived_tids(uid, [tid])
+        second = await archive.get_archived_tids(uid, [tid])
+        return tid, outside, after_outside - reads, first, second, archive.ARCHIVE_STATS["archive_reads"] - reads
+
+    tid, outside, outside_reads, first, second, reads = run(scenario())
+    assert outside == set() and outside_reads == 0
+    assert first == second == {tid}
+    assert reads == 1
+
+
+def test_search_and_receipts_reach_into_archived_years(run, uid):
+    async def scenario():
+        await ensure_search_index()
+        old = await _add(uid, date(2020, 3, 1), description="Coffee beans", receipt="abc.png")
+        await _add(uid, date(2020, 4, 1), description="Rent")
+        new = await _add(uid, date(2024, 1, 2), description="Coffee shop")
+        await archive.archive_user(uid, date(2021, 1, 1))
+
+        everything = await search_transactions(uid, "coff", "Home")
+        second_page = await search_transactions(uid, "coff", "Home", limit=1, offset=1)
+        recent = await search_transactions(uid, "coff", "Home", begin_date=date(2021, 1, 1))
+        receipts = await _get_receipts(uid, [old, new, new + 100])
+        return old, new, everything, second_page, recent, receipts
+
+    old, new, everything, second_page, recent, receipts = run(scenario())
+    assert [row["tid"] for row in everything] == [new, old]
+    assert [row["tid"] for row in second_page] == [old]
+    assert [row["tid"] for row in recent] == [new]
+    assert receipts == {old: "abc.png", new: None}
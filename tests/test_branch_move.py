@@ -0,0 +1,40 @@
+# tests/test_branch_move.py
+
+from datetime import date
+
+from app.db.init import database
+from app.db.model import Branch, ChangeLog, Transaction
+from app.lib.branch import is_subtree_occupied, move_branch_subtree
+
+
+def test_move_rewrites_the_subtree_only(run, uid):
+    async def scenario():
+        for path in ("Home/Food", "Home/Food/Cafe", "Home/Foodbank", "Home/Fun"):
+            await database.execute(Branch.__table__.insert().values(uid=uid, path=path))
+        for branch in ("Home/Food", "Home/Food/Cafe", "Home/Foodbank"):
+            await database.execute(Transaction.__table__.insert().values(
+                uid=uid, t_date=date(2024, 1, 2), branch=branch, cashflow=-10, currency="CAD",
+            ))
+
+        moved = await move_branch_subtree(uid, "Home/Food", "Home/Fun/Eating")
+        paths = {row["path"] for row in await database.fetch_all(Branch.__table__.select())}
+        branches = sorted(row["branch"] for row in await database.fetch_all(Transaction.__table__.select()))
+        changes = await database.fetch_all(ChangeLog.__table__.select())
+        occupied = await is_subtree_occupied(uid, "Home/Food")
+        return moved, paths, branches, changes, occupied
+
+    moved, paths, branches, changes, occupied = run(scenario())
+    assert moved == {"branches": 2, "transactions": 2}
+    # "Home/Foodbank" shares the prefix text but is not under "Home/Food"
+    assert paths == {"Home", "Home/Fun", "Home/Fun/Eating", "Home/Fun/Eating/Cafe", "Home/Foodbank"}
+    assert branches == ["Home/Foodbank", "Home/Fun/Eating", "Home/Fun/Eating/Cafe"]
+    assert len(changes) == 4
+    assert not occupied
+
+
+def test_wildcards_in_paths_match_literally(run, uid):
+    async def scenario():
+        await database.execute(Branch.__table__.insert().values(uid=uid, path="Home/Food/Cafe"))
+        return await is_subtree_occupied(uid, "Home/Fo_d"), await is_subtree_occupied(uid, "Home/Food")
+
+    assert run(scenario()) == (False, True)
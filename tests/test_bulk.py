@@ -0,0 +1,98 @@
+# tests/test_bulk.py
+
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+from app.db.init import database
+from app.db.model import BalanceCheckpoint, Branch, ChangeLog, Transaction
+from app.lib.ledger import get_opening_balance
+from app.lib import transaction
+from app.lib.transaction import execute_bulk_mutation
+from app.route.db import delete_transaction
+
+
+async def _seed(uid):
+    await database.execute(Branch.__table__.insert().values(uid=uid, path="Home/Food"))
+    tids = []
+    for cashflow in (-10, -20, -30, -40):
+        tids.append(await database.execute(Transaction.__table__.insert().values(
+            uid=uid, t_date=date(2024, 1, 5), branch="Home", cashflow=cashflow, currency="CAD",
+        )))
+    return tids
+
+
+def test_bulk_operations_report_per_item_and_keep_checkpoints(run, uid):
+    async def scenario():
+        a, b, c, d = await _seed(uid)
+        await get_opening_balance(uid, "Home/Food", date(2024, 3, 1))
+
+        results = await execute_bulk_mutation(uid, [
+            {"op": "delete", "tid": a},
+            {"op": "move", "tid": b, "branch": "Home/Food"},
+            {"op": "edit", "tid": c, "fields": {"cashflow": -5, "description": "lunch"}},
+            {"op": "edit", "tid": d, "fields": {"cashflow": -5, "description": "lunch"}},
+            {"op": "move", "tid": a + 100, "branch": "Home/Food"},
+            {"op": "move", "tid": c, "branch": "Home/Nowhere"},
+        ])
+        rows = {row["tid"]: row for row in await database.fetch_all(Transaction.__table__.select())}
+        food = await get_opening_balance(uid, "Home/Food", date(2024, 3, 1))
+        await database.execute(BalanceCheckpoint.__table__.delete())
+        return results, rows, food, await get_opening_balance(uid, "Home/Food", date(2024, 3, 1)), (a, b, c, d)
+
+    results, rows, food, fresh, (a, b, c, d) = run(scenario())
+    assert [result["status"] for result in results] == ["ok", "ok", "ok", "ok", "not_found", "error"]
+    assert results[5]["detail"] == "Branch not found - Home/Nowhere"
+    assert a not in rows
+    assert rows[b]["branch"] == "Home/Food"
+    assert (rows[c]["cashflow"], rows[d]["description"]) == (-5, "lunch")
+    assert food == fresh == {"CAD": -20}
+
+
+@pytest.mark.parametrize("operation, message", [
+    ({"op": "edit", "tid": 1, "fields": {"description": ["not", "text"]}}, "description must be a string or null."),
+    ({"op": "edit", "tid": 1, "fields": ["description"]}, "fields must be a non-empty object"),
+    ({"op": "move", "tid": 1, "branch": {"path": "Home"}}, "branch must be a string."),
+    ({"op": "delete", "tid": True}, "tid must be an integer."),
+])
+def test_malformed_operation_is_rejected_with_its_index(run, uid, operation, message):
+    async def scenario():
+        await _seed(uid)
+        await execute_bulk_mutation(uid, [{"op": "delete", "tid": 1}, operation])
+
+    with pytest.raises(HTTPException) as error:
+        run(scenario())
+    assert error.value.status_code == 400
+    assert error.value.detail.startswith(f"operations[1]: {message}")
+    # Nothing was applied
+    assert run(database.fetch_val('SELECT COUNT(*) FROM "transaction"')) == 4
+
+
+def test_failed_checkpoint_update_keeps_the_deleted_row(run, uid, monkeypatch):
+    async def broken(uid, deltas):
+        raise RuntimeError("checkpoint update failed")
+    monkeypatch.setattr(transaction, "apply_balance_deltas", broken)
+
+    async def scenario():
+        tid = (await _seed(uid))[0]
+        with pytest.raises(HTTPException) as error:
+            await delete_transaction(uid=uid, tid=tid)
+        rows = await database.fetch_all(Transaction.__table__.select().where(Transaction.tid == tid))
+        changes = await database.fetch_all(ChangeLog.__table__.select())
+        return error.value.status_code, rows, changes
+
+    status_code, rows, changes = run(scenario())
+    assert status_code == 500
+    assert len(rows) == 1
+    assert changes == []
+
+
+def test_delete_records_its_change_with_the_row(run, uid):
+    async def scenario():
+        tid = (await _seed(uid))[0]
+        await delete_transaction(uid=uid, tid=tid)
+        return tid, await database.fetch_all(ChangeLog.__table__.select())
+
+    tid, changes = run(scenario())
+    assert [(row["entity_id"], row["op"]) for row in changes] == [(tid, "delete")]
@@ -0,0 +1,55 @@
+# tests/test_change_log.py
+
+from datetime import date
+
+from app.db.init import database
+from app.db.model import Transaction
+from app.lib.change_log import DELETE, TRANSACTION, UPSERT, get_changes, record_changes
+
+
+async def _add(uid, count):
+    tids = []
+    for _ in range(count):
+        tids.append(await database.execute(Transaction.__table__.insert().values(
+            uid=uid, t_date=date(2024, 1, 2), branch="Home", cashflow=-10, currency="CAD",
+        )))
+    return tids
+
+
+def test_pages_hold_whole_writes_within_the_limit(run, uid):
+    async def scenario():
+        start = await get_changes(uid, "phone", None)
+        for count in (2, 2, 3):
+            await record_changes(uid, (TRANSACTION, UPSERT, await _add(uid, count)))
+        first = await get_changes(uid, "phone", start["version"], limit=5)
+        second = await get_changes(uid, "phone", first["version"], limit=5)
+        return start, first, second
+
+    start, first, second = run(scenario())
+    assert start["reset"] and start["version"] == 0
+    # The third write would overflow the page, so it waits for the next one
+    assert [change["seq"] for change in first["changes"]] == [1, 1, 2, 2]
+    assert first["has_more"] and first["version"] == 2
+    assert all(change["data"]["tid"] == change["id"] for change in first["changes"])
+    assert [change["seq"] for change in second["changes"]] == [3, 3, 3]
+    assert not second["has_more"] and second["version"] == 3
+
+
+def test_a_write_larger_than_a_page_resets_the_client(run, uid):
+    async def scenario():
+        await record_changes(uid, (TRANSACTION, UPSERT, await _add(uid, 4)))
+        return await get_changes(uid, "phone", 0, limit=3)
+
+    result = run(scenario())
+    assert result == {"version": 1, "reset": True, "has_more": False, "changes": []}
+
+
+def test_upserts_of_deleted_rows_come_back_as_tombstones(run, uid):
+    async def scenario():
+        tids = await _add(uid, 2)
+        await record_changes(uid, (TRANSACTION, UPSERT, tids))
+        await database.execute(Transaction.__table__.delete().where(Transaction.tid == tids[0]))
+        return await get_changes(uid, "phone", 0)
+
+    changes = run(scenario())["changes"]
+    assert [(change["op"], change["data"] is None) for change in changes] == [(DELETE, True), (UPSERT, False)]
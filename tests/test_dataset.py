@@ -0,0 +1,52 @@
+# tests/test_dataset.py
+
+from datetime import date
+from io import BytesIO
+
+import pytest
+
+pytest.importorskip("pyarrow.parquet", exc_type=ImportError)
+
+from app.db.init import database
+from app.db.model import Auth, Branch, Transaction
+from app.lib import archive
+from app.lib.dataset import export_dataset, import_dataset
+
+
+async def _rows(uid):
+    query = Transaction.__table__.select().where(Transaction.uid == uid)
+    return sorted(
+        (row["t_date"], row["branch"], row["cashflow"], row["currency"], row["description"])
+        for row in await database.fetch_all(query)
+    )
+
+
+@pytest.mark.parametrize("fmt", ["parquet", "arrow"])
+def test_export_then_import_reproduces_archived_and_hot_rows(run, uid, fmt):
+    async def scenario():
+        await database.execute(Branch.__table__.insert().values(uid=uid, path="Home/Food"))
+        for t_date, branch, cashflow, description in (
+            (date(2019, 5, 1), "Home", 1000, "salary"),
+            (date(2020, 2, 3), "Home/Food", -25, None),
+            (date(2024, 1, 2), "Home/Food", -40, "groceries"),
+        ):
+            await database.execute(Transaction.__table__.insert().values(
+                uid=uid, t_date=t_date, branch=branch, cashflow=cashflow, currency="CAD", description=description,
+            ))
+        expected = await _rows(uid)
+        await archive.archive_user(uid, date(2021, 1, 1))
+
+        data = b"".join([chunk async for chunk in export_dataset(uid, fmt)])
+
+        other = await database.execute(Auth.__table__.insert().values(
+            username="other", email="other@example.com", password="not-a-hash", display_currency="CAD",
+        ))
+        await database.execute(Branch.__table__.insert().values(uid=other, path="Home"))
+        imported = await import_dataset(other, BytesIO(data))
+        branches = {row["path"] for row in await database.fetch_all(Branch.__table__.select().where(Branch.uid == other))}
+        return expected, await _rows(other), imported, branches
+
+    expected, rows, imported, branches = run(scenario())
+    assert rows == expected
+    assert imported == {"transactions": 3, "branches": 1}
+    assert branches == {"Home", "Home/Food"}
@@ -0,0 +1,79 @@
+# tests/test_fx.py
+
+from datetime import date
+
+from app.db.init import database
+from app.db.migrate import ensure_transaction_currency
+from app.db.model import Transaction
+from app.lib import fx
+from app.lib.data_version import get_etag_version
+from app.lib.tree_summary import get_tree_summary
+
+
+async def _add(uid, t_date, cashflow, currency):
+    await database.execute(Transaction.__table__.insert().values(
+        uid=uid, t_date=t_date, branch="Home", cashflow=cashflow, currency=currency,
+    ))
+
+
+def test_rows_without_a_rate_keep_their_currency_and_are_flagged(run, uid):
+    fx._pair_cache.clear()
+
+    async def scenario():
+        await fx.import_fx_rates([(date(2024, 1, 2), "CAD", 1.25)])
+        await _add(uid, date(2024, 1, 2), 100, "USD")
+        await _add(uid, date(2024, 1, 3), 40, "EUR")
+        await _add(uid, date(2024, 1, 4), -500, "CAD")
+        rows = await database.fetch_all(Transaction.__table__.select().order_by(Transaction.tid))
+        converted = await fx.convert_rows(rows, "CAD")
+        summary = await get_tree_summary(uid, "2024-01-01", "2024-01-05", "CAD")
+        return converted, summary
+
+    converted, summary = run(scenario())
+    usd, eur, cad = converted
+    assert (usd["cashflow"], usd["currency"], usd["fx_missing"]) == (125, "CAD", False)
+    assert (eur["cashflow"], eur["currency"], eur["fx_missing"]) == (40, "EUR", True)
+    assert (cad["cashflow"], cad["fx_missing"]) == (-500, False)
+
+    # No EUR rate at all: its sum stays out of the totals and is listed in EUR
+    nodes = {node["path"]: node for node in summary["nodes"]}
+    assert nodes["Home"]["income"] == 125
+    assert nodes["Home"]["expenditure"] == 500
+    assert summary["unconverted"] == [
+        {"branch": "Home", "monthly": "2024-01", "income": 40, "expenditure": 0, "currency": "EUR"}
+    ]
+
+
+def test_currency_migration_backfills_the_display_currency(run, uid):
+    async def scenario():
+        await database.execute('DROP TABLE "transaction"')
+        await database.execute(
+            'CREATE TABLE "transaction" (tid INTEGER PRIMARY KEY, t_date DATE NOT NULL, branch VARCHAR(255) NOT NULL, '
+            'cashflow INTEGER NOT NULL, description TEXT, c_date TIMESTAMP, uid INTEGER NOT NULL, receipt VARCHAR(255))'
+        )
+        await database.execute(
+            'INSERT INTO "transaction" (t_date, branch, cashflow, uid) VALUES (\'2024-01-02\', \'Home\', 10, :uid)',
+            values={"uid": uid},
+        )
+        await database.execute("UPDATE auth SET display_currency = 'EUR'")
+        await ensure_transaction_currency()
+        await ensure_transaction_currency()
+        return await database.fetch_val('SELECT currency FROM "transaction"')
+
+    assert run(scenario()) == "EUR"
+
+
+def test_rate_import_changes_the_etag_version(run, uid):
+    async def scenario():
+        before = await get_etag_version(uid)
+        await fx.import_fx_rates([(date(2024, 1, 2), "CAD", 1.25)])
+        fx._pair_cache[(date(2024, 1, 2), "USD", "CAD")] = 1.25
+        # Another instance imports: the version read alongside the ETag drops stale pairs
+        await fx.bump_fx_version()
+        after = await get_etag_version(uid)
+        return before, after
+
+    before, after = run(scenario())
+    assert before == "0.0"
+    assert after == "0.2"
+    assert not fx._pair_cache
@@ -0,0 +1,70 @@
+# tests/test_ledger.py
+
+from datetime import date
+
+import pytest
+from fastapi import HTTPException
+
+from app.db.init import database
+from app.db.model import BalanceCheckpoint, ChangeLog
+from app.lib.ledger import get_opening_balance
+from app.route import db as db_route
+
+
+async def _upload(uid, t_date, cashflow, branch="Home"):
+    await db_route.upload_transaction(
+        uid=uid, t_date=t_date, branch=branch, cashflow=cashflow,
+        currency="CAD", description=None, receipt=None,
+    )
+    return await database.fetch_val("SELECT MAX(tid) FROM \"transaction\"")
+
+
+async def _modify(uid, tid, **changes):
+    fields = {"t_date": None, "branch": None, "cashflow": None, "currency": None, "description": None, "receipt": None}
+    fields.update(changes)
+    await db_route.modify_transaction(uid=uid, tid=tid, **fields)
+
+
+def test_checkpoints_follow_writes_before_them(run, uid):
+    async def scenario():
+        first = await _upload(uid, "2024-01-10", 100)
+        # Stores a checkpoint for March
+        assert await get_opening_balance(uid, "Home", date(2024, 3, 15)) == {"CAD": 100}
+        assert await database.fetch_val(BalanceCheckpoint.__table__.select().with_only_columns(BalanceCheckpoint.balance)) == 100
+
+        await _upload(uid, "2024-02-01", -30)
+        await _modify(uid, first, cashflow=50)
+        await _modify(uid, first, t_date="2024-04-01")
+        cached = await get_opening_balance(uid, "Home", date(2024, 3, 15))
+
+        # Same answer when recomputed from the rows alone
+        await database.execute(BalanceCheckpoint.__table__.delete())
+        fresh = await get_opening_balance(uid, "Home", date(2024, 3, 15))
+        return cached, fresh
+
+    cached, fresh = run(scenario())
+    assert cached == fresh == {"CAD": -30}
+
+
+def test_failed_upload_rolls_back_row_and_checkpoint_shift(run, uid, monkeypatch):
+    async def fail(*args, **kwargs):
+        raise RuntimeError("change log unavailable")
+
+    async def scenario():
+        await _upload(uid, "2024-01-10", 100)
+        await get_opening_balance(uid, "Home", date(2024, 3, 15))
+
+        monkeypatch.setattr(db_route, "record_changes", fail)
+        with pytest.raises(HTTPException) as error:
+            await _upload(uid, "2024-02-01", -30)
+        assert error.value.status_code == 500
+
+        rows = await database.fetch_val("SELECT COUNT(*) FROM \"transaction\"")
+        checkpoint = await database.fetch_val("SELECT balance FROM balance_checkpoint")
+        changes = await database.fetch_val(ChangeLog.__table__.select().with_only_columns(ChangeLog.seq))
+        return rows, checkpoint, changes
+
+    rows, checkpoint, changes = run(scenario())
+    assert rows == 1
+    assert checkpoint == 100
+    assert changes == 1
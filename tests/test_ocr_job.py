@@ -0,0 +1,72 @@
+# tests/test_ocr_job.py
+
+import asyncio
+import threading
+
+import pytest
+from fastapi import HTTPException
+
+from app.lib import ocr_job
+
+
+@pytest.fixture(autouse=True)
+def empty_queue():
+    ocr_job._jobs.clear()
+    yield
+    ocr_job._jobs.clear()
+
+
+def test_full_queue_rejects_new_jobs_with_429(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(ocr_job, "OCR_JOB_MAX_PENDING", 1)
+    monkeypatch.setattr(ocr_job, "extract_receipt_info_from_bytes", lambda content, progress: release.wait(5))
+
+    async def scenario():
+        first = ocr_job.submit_job(1, b"receipt")
+        try:
+            with pytest.raises(HTTPException) as error:
+                ocr_job.submit_job(2, b"receipt")
+            return error.value.status_code
+        finally:
+            release.set()
+            await first.task
+
+    assert asyncio.run(scenario()) == 429
+
+
+def test_one_user_cannot_fill_the_queue(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(ocr_job, "OCR_JOB_MAX_PENDING", 3)
+    monkeypatch.setattr(ocr_job, "OCR_JOB_MAX_PENDING_PER_USER", 1)
+    monkeypatch.setattr(ocr_job, "extract_receipt_info_from_bytes", lambda content, progress: release.wait(5))
+
+    async def scenario():
+        jobs = [ocr_job.submit_job(1, b"receipt")]
+        try:
+            with pytest.raises(HTTPException) as error:
+                ocr_job.submit_job(1, b"receipt")
+            # Another user still gets a slot
+            jobs.append(ocr_job.submit_job(2, b"receipt"))
+            return error.value.status_code
+        finally:
+            release.set()
+            await asyncio.gather(*(job.task for job in jobs))
+
+    assert asyncio.run(scenario()) == 429
+
+
+def test_failed_job_reports_the_error_to_its_owner_only(monkeypatch):
+    def broken(content, progress):
+        raise ValueError("cannot identify image file")
+    monkeypatch.setattr(ocr_job, "extract_receipt_info_from_bytes", broken)
+
+    async def scenario():
+        job = ocr_job.submit_job(1, b"not an image")
+        await job.task
+        return job
+
+    job = asyncio.run(scenario())
+    assert job.status == ocr_job.FAILED
+    assert job.to_dict()["error"] == "ValueError: cannot identify image file"
+    assert ocr_job.get_job(1, job.job_id) is job
+    assert ocr_job.get_job(2, job.job_id) is None
@@ -0,0 +1,66 @@
+# tests/test_rate_limit.py
+
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+from app.lib import rate_limit
+from app.lib.rate_limit import TokenBucketLimiter, enforce_rate_limit, get_client_ip
+from app.route.auth import signin
+
+
+def _request(forwarded_for=None, client="10.0.0.1") -> Request:
+    headers = [(b"x-forwarded-for", forwarded_for.encode())] if forwarded_for else []
+    return Request({"type": "http", "headers": headers, "client": (client, 12345)})
+
+
+def test_limiter_denies_after_capacity_with_retry_after():
+    limiter = TokenBucketLimiter("test", "2/60")
+
+    async def scenario():
+        await enforce_rate_limit((limiter, "a@example.com"))
+        await enforce_rate_limit((limiter, "a@example.com"))
+        # Other keys have their own bucket
+        await enforce_rate_limit((limiter, "b@example.com"))
+        with pytest.raises(HTTPException) as error:
+            await enforce_rate_limit((limiter, "a@example.com"))
+        return error.value
+
+    error = asyncio.run(scenario())
+    assert error.status_code == 429
+    assert int(error.headers["Retry-After"]) == 30
+
+
+def test_idle_and_excess_keys_are_dropped(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_MAX_KEYS", 3)
+    limiter = TokenBucketLimiter("test", "1/10")
+
+    limiter._hit_memory("old", now=0)
+    limiter._hit_memory("a", now=20)
+    assert list(limiter._buckets) == ["a"]
+
+    for key in ("b", "c", "d"):
+        limiter._hit_memory(key, now=21)
+    assert list(limiter._buckets) == ["b", "c", "d"]
+
+
+def test_forwarded_for_is_ignored_unless_trusted(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_TRUST_PROXY", False)
+    assert get_client_ip(_request("1.2.3.4")) == "10.0.0.1"
+
+
+def test_forwarded_for_uses_the_trusted_hop_not_the_client_supplied_one(monkeypatch):
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_TRUST_PROXY", True)
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_PROXY_HOPS", 1)
+    assert get_client_ip(_request("6.6.6.6, 1.2.3.4")) == "1.2.3.4"
+
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_PROXY_HOPS", 2)
+    assert get_client_ip(_request("6.6.6.6, 1.2.3.4, 10.1.1.1")) == "1.2.3.4"
+
+
+def test_signin_rejects_a_non_string_email():
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(signin(_request(), {"email": ["a@example.com"], "password": "pw"}))
+    assert error.value.status_code == 400
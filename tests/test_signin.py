@@ -0,0 +1,86 @@
+# tests/test_signin.py
+
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from starlette.requests import Request
+
+from app.db.init import database
+from app.db.migrate import ensure_token_uid_unique
+from app.db.model import Auth, Token
+from app.lib.user import hash_password
+from app.route.auth import forget_password, signin
+
+
+def _request() -> Request:
+    return Request({"type": "http", "headers": [], "client": ("10.0.0.1", 12345)})
+
+
+# Count statements sent through the shared database object
+def _count_statements(monkeypatch) -> list:
+    statements = []
+    for name in ("execute", "execute_many", "fetch_one", "fetch_all", "fetch_val"):
+        original = getattr(database, name)
+
+        def counted(query, *args, _original=original, **kwargs):
+            statements.append(query)
+            return _original(query, *args, **kwargs)
+        monkeypatch.setattr(database, name, counted)
+    return statements
+
+
+def _credentials(run):
+    async def create():
+        await database.execute(Auth.__table__.insert().values(
+            username="signin", email="signin@example.com", password=hash_password("Secret123!"),
+            display_currency="CAD",
+        ))
+    run(create())
+    return {"email": "signin@example.com", "password": "Secret123!"}
+
+
+def test_signin_makes_two_statements_and_keeps_one_token_row(run, monkeypatch):
+    credentials = _credentials(run)
+    statements = _count_statements(monkeypatch)
+
+    run(signin(_request(), credentials))
+    assert len(statements) == 2
+    run(signin(_request(), credentials))
+    assert len(statements) == 4
+
+    monkeypatch.undo()
+    assert run(database.fetch_val("SELECT COUNT(*) FROM token")) == 1
+
+
+def test_migration_dedupes_tokens_so_signin_can_upsert(run):
+    credentials = _credentials(run)
+
+    # A token table from before the unique constraint, with duplicate rows
+    async def legacy_table():
+        await database.execute("DROP TABLE token")
+        await database.execute(
+            "CREATE TABLE token (token_id INTEGER PRIMARY KEY, uid INTEGER NOT NULL, access_token TEXT NOT NULL, "
+            "refresh_token TEXT, created_at TIMESTAMP, expires_at TIMESTAMP NOT NULL)"
+        )
+        uid = await database.fetch_val("SELECT uid FROM auth")
+        for token in ("old", "new"):
+            await database.execute(Token.__table__.insert().values(
+                uid=uid, access_token=token, expires_at=datetime(2030, 1, 1),
+            ))
+        await ensure_token_uid_unique()
+        await ensure_token_uid_unique()
+        return await database.fetch_all("SELECT access_token FROM token")
+
+    assert [row["access_token"] for row in run(legacy_table())] == ["new"]
+
+    run(signin(_request(), credentials))
+    assert run(database.fetch_val("SELECT COUNT(*) FROM token")) == 1
+
+
+@pytest.mark.parametrize("route", [signin, forget_password])
+def test_non_string_email_is_a_bad_request(run, route):
+    with pytest.raises(HTTPException) as error:
+        run(route(_request(), {"email": 123, "password": "Secret123!"}))
+    assert error.value.status_code == 400
@@ -0,0 +1,136 @@
+# tests/test_storage.py
+
+import asyncio
+from io import BytesIO
+
+import pytest
+from fastapi import UploadFile
+from PIL import Image
+
+from app.db.crud import acquire_receipt_ref, release_receipt_refs
+from app.firebase import storage as receipt_storage
+
+
+class FakeBlob:
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.objects[self.name] = data
+        self.bucket.uploads += 1
+
+    def download_as_bytes(self):
+        return self.bucket.objects[self.name]
+
+    def delete(self):
+        del self.bucket.objects[self.name]
+
+    def generate_signed_url(self, **kwargs):
+        return f"https://signed.example/{self.name}"
+
+
+class FakeBucket:
+    def __init__(self):
+        self.objects = {}
+        self.lookups = 0
+        self.uploads = 0
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        self.lookups += 1
+        return FakeBlob(self, name) if name in self.objects else None
+
+    def list_blobs(self, prefix=""):
+        return [FakeBlob(self, name) for name in list(self.objects) if name.startswith(prefix)]
+
+
+# Route the storage module to an in-memory bucket
+@pytest.fixture
+def bucket(monkeypatch):
+    fake = FakeBucket()
+    monkeypatch.setattr(receipt_storage.storage, "bucket", lambda: fake)
+    receipt_storage._signed_url_cache.clear()
+    receipt_storage._known_variants.clear()
+    return fake
+
+
+def _png() -> bytes:
+    out = BytesIO()
+    Image.new("RGB", (1200, 800), "white").save(out, format="PNG")
+    return out.getvalue()
+
+
+def test_generated_variants_are_signed_without_a_lookup(run, bucket):
+    async def scenario():
+        await receipt_storage.generate_variants(1, "abc.png", _png())
+        return await receipt_storage.get_image_url(1, "abc.png", size=200)
+
+    url = run(scenario())
+    assert url == "https://signed.example/1/abc.thumb.webp"
+    assert bucket.lookups == 0
+
+
+def _upload(content: bytes) -> UploadFile:
+    return UploadFile(file=BytesIO(content), filename="receipt.png")
+
+
+def test_shared_receipt_blob_outlives_its_first_release(run, uid, bucket):
+    async def scenario():
+        first = await receipt_storage.save_image(uid, _upload(_png()))
+        second = await receipt_storage.save_image(uid, _upload(_png()))
+        await asyncio.gather(*receipt_storage._background_jobs)
+        assert first == second
+
+        await receipt_storage.release_images(uid, [first])
+        assert f"{uid}/{first}" in bucket.objects
+
+        await receipt_storage.release_images(uid, [second])
+        return first
+
+    file_name = run(scenario())
+    assert not [name for name in bucket.objects if file_name.split(".")[0] in name]
+
+
+def test_duplicate_upload_skips_the_storage_write(run, uid, bucket):
+    async def scenario():
+        first = await receipt_storage.save_image(uid, _upload(_png()))
+        await asyncio.gather(*receipt_storage._background_jobs)
+        uploads = bucket.uploads
+        second = await receipt_storage.save_image(uid, _upload(_png()))
+        return first, second, bucket.uploads - uploads
+
+    first, second, uploads = run(scenario())
+    assert first == second
+    assert uploads == 0
+
+
+def test_blob_being_deleted_takes_no_new_reference(run, uid, bucket):
+    async def scenario():
+        file_name = await receipt_storage.save_image(uid, _upload(_png()))
+        await asyncio.gather(*receipt_storage._background_jobs)
+        claimed = await release_receipt_refs(uid, [file_name])
+        # A concurrent upload of the same bytes must not take a reference on the doomed blob
+        refused = await acquire_receipt_ref(uid, file_name)
+        await receipt_storage._delete_claimed(uid, claimed)
+        gone = f"{uid}/{file_name}" not in bucket.objects
+        # Once the delete is done, the same bytes are stored again
+        again = await receipt_storage.save_image(uid, _upload(_png()))
+        return claimed, refused, gone, again, file_name
+
+    claimed, refused, gone, again, file_name = run(scenario())
+    assert claimed == [file_name]
+    assert refused is None
+    assert gone
+    assert again == file_name
+    assert f"{uid}/{file_name}" in bucket.objects
+
+
+def test_backfill_leaves_archive_files_alone(run, bucket):
+    bucket.objects["archive/5/2020-abc.parquet"] = b"PAR1"
+
+    run(receipt_storage.backfill_variants())
+    assert receipt_storage.BACKFILL_STATUS["failed"] == 0
+    assert receipt_storage.BACKFILL_STATUS["processed"] == 0
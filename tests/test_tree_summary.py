@@ -0,0 +1,46 @@
+# tests/test_tree_summary.py
+
+from datetime import date
+
+from app.db.init import database
+from app.db.model import Branch, Transaction
+from app.lib.tree_summary import aggregate_tree, get_tree_summary
+
+
+def test_aggregate_tree_rolls_children_into_ancestors():
+    rows = [
+        {"branch": "Home/Food/Cafe", "monthly": "2024-01", "income": 0, "expenditure": -300},
+        {"branch": "Home/Food", "monthly": "2024-02", "income": 0, "expenditure": -200},
+        {"branch": "Home/Salary", "monthly": "2024-01", "income": 5000, "expenditure": 0},
+    ]
+    summary = aggregate_tree(["Home", "Home/Food", "Home/Salary"], rows)
+    nodes = {node["path"]: node for node in summary["nodes"]}
+
+    assert summary["periods"] == ["2024-01", "2024-02"]
+    assert nodes["Home/Food/Cafe"]["expenditure"] == 300
+    assert nodes["Home/Food"]["expenditure"] == 500
+    assert nodes["Home"]["income"] == 5000
+    assert nodes["Home"]["expenditure"] == 500
+    assert nodes["Home"]["monthly"][1] == {"monthly": "2024-02", "income": 0, "expenditure": 200}
+
+
+def test_tree_summary_reads_every_branch_in_one_pass(run, uid):
+    async def scenario():
+        await database.execute(Branch.__table__.insert().values(uid=uid, path="Home/Food"))
+        for t_date, branch, cashflow in (
+            ("2024-01-05", "Home/Food", -120),
+            ("2024-01-20", "Home", 1000),
+            ("2024-03-01", "Home/Food", -80),
+        ):
+            await database.execute(Transaction.__table__.insert().values(
+                uid=uid, t_date=date.fromisoformat(t_date),
+                branch=branch, cashflow=cashflow, currency="CAD",
+            ))
+        return await get_tree_summary(uid, "2024-01-01", "2024-02-29", "CAD")
+
+    summary = run(scenario())
+    nodes = {node["path"]: node for node in summary["nodes"]}
+    assert summary["currency"] == "CAD"
+    assert nodes["Home"]["income"] == 1000
+    # The March row is outside the range
+    assert nodes["Home"]["expenditure"] == 120